@@ -0,0 +1,333 @@
+'''
+Throughput and latency benchmark of the off-chain commit generation
+(generate_commitment/generate_submarine_commit.py), without any chain.
+
+Measures:
+
+* stages: where the time of one session goes, per stage: drawing the
+  witness (entropy), hashing the full commit (keccak), deriving R and S and
+  rejecting the out of range ones (rsRejection), recovering addressB
+  (ecrecover, including the hash of the unsigned unlock transaction) and
+  encoding the signed unlock transaction and the results (rlp). Times are
+  per session, summed over the witnesses it took.
+* single: latency and throughput of generateCommitAddress, one call per
+  session.
+* batch: generateCommitAddresses on batches of different sizes, in this
+  process.
+* workers: generateCommitAddresses on a batch split between worker
+  processes, including the start of the process pool.
+
+Latencies are given as mean, p50, p95 and p99 in microseconds, throughputs
+in sessions per second. The results are written as one JSON object, and can
+be appended to a JSON lines file to follow them over time.
+
+    python3 bench/bench_commit_generation.py [--output results.json]
+        [--append history.jsonl] [--sessions 1000]
+'''
+import argparse
+import collections
+import datetime
+import json
+import logging
+import os
+import platform
+import sys
+import time
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.append(os.path.join(BENCH_DIR, '..', 'generate_commitment'))
+import generate_submarine_commit as gsc
+
+log = logging.getLogger('BenchCommitGeneration')
+LOGFORMAT = "%(levelname)s:%(filename)s:%(lineno)s:%(funcName)s(): %(message)s"
+log.setLevel(logging.getLevelName('INFO'))
+logHandler = logging.StreamHandler(stream=sys.stderr)
+logHandler.setFormatter(logging.Formatter(LOGFORMAT))
+log.addHandler(logHandler)
+
+STAGES = ("entropy", "keccak", "rsRejection", "ecrecover", "rlp")
+PERCENTILES = (50, 95, 99)
+
+SESSIONS = 1000
+BATCH_SIZES = (16, 256, 4096)
+BATCH_REPEATS = 5
+WORKER_COUNTS = (2, 4)
+WORKER_SESSIONS = 8192
+
+# Session generated by every mode
+FROM_ADDRESS = bytes.fromhex("7d577a597b2742b498cb5cf0c26cdcd726d39e6e")
+TO_ADDRESS = bytes.fromhex("1efd4b3c11b8dcd9fe7bf5caf2e9b8e5c4b4cf3a")
+SEND_AMOUNT = 1337000000000000000
+DAPP_DATA = b''
+
+
+def percentiles(values):
+    '''
+    :param values: latencies in seconds
+    :return: dict of the mean and PERCENTILES (nearest rank) in
+        microseconds
+    '''
+    if not values:
+        return {}
+    ordered = sorted(values)
+    summary = collections.OrderedDict()
+    summary["mean"] = sum(ordered) / len(ordered) * 1e6
+    for percentile in PERCENTILES:
+        rank = max(0, -(-percentile * len(ordered) // 100) - 1)
+        summary["p{}".format(percentile)] = ordered[rank] * 1e6
+    return summary
+
+
+def profiledSession(commitPrefix, commitSuffix, template, stageTimes,
+                    stats):
+    '''
+    Generates one session the way generate_submarine_commit._generateUnlockTx
+    does (with V = 27), timing every stage.
+
+    :param stageTimes: dict from stage to list, the time of each stage in
+        this session is appended to it
+    :param stats: collections.Counter the retries are counted in
+    :return: txRlp, addressB, commit, randw, witnesses drawn
+    '''
+    clock = time.perf_counter
+    spent = dict.fromkeys(STAGES, 0.0)
+    fullCommit = bytearray(commitPrefix + bytes(32) + commitSuffix)
+    witnessStart = len(commitPrefix)
+    witnessEnd = witnessStart + 32
+    rsPreimage = bytearray(33)
+    drawn = []
+
+    for _ in range(gsc.MAX_ATTEMPTS):
+        start = clock()
+        randw = gsc.defaultWitnessPool.draw()
+        drawn.append(randw)
+        witnessDrawn = clock()
+        fullCommit[witnessStart:witnessEnd] = randw
+        commit = gsc.sha3_256(fullCommit)
+        committed = clock()
+        spent["entropy"] += witnessDrawn - start
+        spent["keccak"] += committed - witnessDrawn
+
+        rsPreimage[:32] = commit
+        rsPreimage[32] = 1
+        R = gsc.bytearray_to_int(gsc.sha3_256(rsPreimage))
+        S = None
+        if not (0 < R < gsc.secp256k1n):
+            stats[gsc.RETRY_R_RANGE] += 1
+        else:
+            rsPreimage[32] = 0
+            S = gsc.bytearray_to_int(gsc.sha3_256(rsPreimage))
+            if not (0 < S < (gsc.secp256k1n / 2)):
+                stats[gsc.RETRY_S_RANGE] += 1
+                S = None
+        derived = clock()
+        spent["rsRejection"] += derived - committed
+        if S is None:
+            continue
+
+        sender = gsc._recoverUnlockSender(template, commit, 27, R, S)
+        recovered = clock()
+        spent["ecrecover"] += recovered - derived
+        if sender is None:
+            stats[gsc.RETRY_VRS] += 1
+            continue
+
+        txRlp = template.signed(commit, 27, R, S)
+        addressB = "0x" + gsc.encode_hex(sender)
+        # The hex encoding generateCommitAddress returns
+        hexSession = (gsc.encode_hex(commit), gsc.encode_hex(randw),
+                      gsc.encode_hex(txRlp))
+        spent["rlp"] += clock() - recovered
+
+        stats[gsc.SESSIONS] += 1
+        for stage in STAGES:
+            stageTimes[stage].append(spent[stage])
+        return txRlp, addressB, commit, randw, drawn
+
+    raise gsc.CommitGenerationError(
+        "No usable commit after {} witnesses".format(gsc.MAX_ATTEMPTS))
+
+
+def benchStages(sessions):
+    '''
+    Per stage profile of sessions sessions. The first one is checked
+    against _generateUnlockTx given the same witnesses, so that the profile
+    measures the same work.
+    '''
+    commitPrefix = gsc._commitPrefix(FROM_ADDRESS, TO_ADDRESS, SEND_AMOUNT,
+                                     DAPP_DATA)
+    commitSuffix = gsc._commitSuffix(gsc.DEFAULT_GAS_PRICE,
+                                     gsc.DEFAULT_GAS_LIMIT)
+    template = gsc._UnlockTxTemplate(TO_ADDRESS, SEND_AMOUNT,
+                                     gsc.DEFAULT_GAS_PRICE,
+                                     gsc.DEFAULT_GAS_LIMIT)
+    stageTimes = {stage: [] for stage in STAGES}
+    stats = collections.Counter()
+    attempts = []
+    for i in range(sessions):
+        session = profiledSession(commitPrefix, commitSuffix, template,
+                                  stageTimes, stats)
+        attempts.append(len(session[-1]))
+        if i == 0:
+            expected = gsc._generateUnlockTx(
+                commitPrefix, commitSuffix, TO_ADDRESS, SEND_AMOUNT,
+                gsc.DEFAULT_GAS_PRICE, gsc.DEFAULT_GAS_LIMIT,
+                witnesses=iter(session[-1]))
+            if expected != session[:-1]:
+                raise AssertionError(
+                    "Profiled session differs from _generateUnlockTx")
+
+    total = sum(sum(times) for times in stageTimes.values())
+    results = collections.OrderedDict()
+    for stage in STAGES:
+        summary = collections.OrderedDict()
+        summary["share"] = sum(stageTimes[stage]) / total if total else 0.0
+        summary.update(percentiles(stageTimes[stage]))
+        results[stage] = summary
+    results["session"] = percentiles(
+        [sum(times) for times in zip(*stageTimes.values())])
+    results["witnessesPerSession"] = sum(attempts) / len(attempts)
+    results["retries"] = dict(stats)
+    return results
+
+
+def benchSingle(sessions):
+    '''Latency of sessions calls of generateCommitAddress.'''
+    latencies = []
+    start = time.perf_counter()
+    for _ in range(sessions):
+        callStart = time.perf_counter()
+        gsc.generateCommitAddress(FROM_ADDRESS, TO_ADDRESS, SEND_AMOUNT,
+                                  DAPP_DATA, gsc.DEFAULT_GAS_PRICE,
+                                  gsc.DEFAULT_GAS_LIMIT)
+        latencies.append(time.perf_counter() - callStart)
+    return throughput(sessions, time.perf_counter() - start, latencies)
+
+
+def benchBatch(batchSize, repeats, workers=None):
+    '''
+    Latency of repeats calls of generateCommitAddresses on batchSize rows,
+    per batch and per session.
+    '''
+    rows = [(FROM_ADDRESS, TO_ADDRESS, SEND_AMOUNT, DAPP_DATA,
+             gsc.DEFAULT_GAS_PRICE, gsc.DEFAULT_GAS_LIMIT)] * batchSize
+    latencies = []
+    for _ in range(repeats):
+        callStart = time.perf_counter()
+        gsc.generateCommitAddresses(rows, workers=workers)
+        latencies.append(time.perf_counter() - callStart)
+    results = throughput(batchSize * repeats, sum(latencies), latencies)
+    results["perSession"] = percentiles(
+        [latency / batchSize for latency in latencies])
+    return results
+
+
+def throughput(sessions, seconds, latencies):
+    results = collections.OrderedDict()
+    results["sessions"] = sessions
+    results["seconds"] = seconds
+    results["sessionsPerSecond"] = sessions / seconds if seconds else None
+    results["latency"] = percentiles(latencies)
+    return results
+
+
+def environment():
+    '''What the results depend on besides the code, to compare runs.'''
+    return collections.OrderedDict([
+        ("time", datetime.datetime.utcnow().isoformat() + "Z"),
+        ("python", platform.python_version()),
+        ("platform", platform.platform()),
+        ("cpuCount", os.cpu_count()),
+        ("coincurve", gsc.coincurve is not None),
+        ("crossCheckRecovery", gsc.crossCheckRecovery),
+    ])
+
+
+def _intList(value):
+    return [int(item) for item in value.split(",") if item]
+
+
+def _get_args():
+    parser = argparse.ArgumentParser(
+        description="Throughput and latency benchmark of commit generation")
+    parser.add_argument(
+        '-o',
+        '--output',
+        default=None,
+        help="File to write the results to, as JSON. Default is stdout.")
+    parser.add_argument(
+        '-a',
+        '--append',
+        default=None,
+        help="JSON lines file to append the results to, one line per run.")
+    parser.add_argument(
+        '-n',
+        '--sessions',
+        type=int,
+        default=SESSIONS,
+        help="Sessions for the stage profile and the single call mode. "
+        "Default is {}.".format(SESSIONS))
+    parser.add_argument(
+        '--batch-sizes',
+        type=_intList,
+        default=BATCH_SIZES,
+        help="Comma separated batch sizes.")
+    parser.add_argument(
+        '--batch-repeats',
+        type=int,
+        default=BATCH_REPEATS,
+        help="Batches generated per batch size (and per worker count). "
+        "Default is {}.".format(BATCH_REPEATS))
+    parser.add_argument(
+        '--workers',
+        type=_intList,
+        default=WORKER_COUNTS,
+        help="Comma separated numbers of worker processes, empty for none.")
+    parser.add_argument(
+        '--worker-sessions',
+        type=int,
+        default=WORKER_SESSIONS,
+        help="Batch size with worker processes. Default is {}.".format(
+            WORKER_SESSIONS))
+    return parser.parse_args()
+
+
+def main():
+    args = _get_args()
+    # generateCommitAddress logs every unlock transaction
+    gsc.log.setLevel(logging.WARNING)
+
+    results = environment()
+    results["stages"] = benchStages(args.sessions)
+    log.info("Stages: {}".format(
+        ", ".join("{} {:.0%}".format(stage, results["stages"][stage]["share"])
+                  for stage in STAGES)))
+    results["single"] = benchSingle(args.sessions)
+    log.info("Single: {:.0f} sessions/s".format(
+        results["single"]["sessionsPerSecond"]))
+    results["batch"] = collections.OrderedDict()
+    for batchSize in args.batch_sizes:
+        results["batch"][str(batchSize)] = benchBatch(batchSize,
+                                                      args.batch_repeats)
+        log.info("Batch of {}: {:.0f} sessions/s".format(
+            batchSize, results["batch"][str(batchSize)]["sessionsPerSecond"]))
+    results["workers"] = collections.OrderedDict()
+    for workers in args.workers:
+        results["workers"][str(workers)] = benchBatch(
+            args.worker_sessions, args.batch_repeats, workers)
+        log.info("{} workers: {:.0f} sessions/s".format(
+            workers, results["workers"][str(workers)]["sessionsPerSecond"]))
+
+    output = json.dumps(results, indent=2) + "\n"
+    if args.output is None:
+        sys.stdout.write(output)
+    else:
+        with open(args.output, "w") as outputFile:
+            outputFile.write(output)
+    if args.append is not None:
+        with open(args.append, "a") as historyFile:
+            historyFile.write(json.dumps(results) + "\n")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,484 @@
+'''
+Gas benchmark of the submarine send workflow (commit, reveal, unlock) on the
+pyethereum tester chain.
+
+Runs LibSubmarineSimple (through LibSubmarineSimpleTestHelper) for every
+combination of DApp data size, number of transactions in the commit block
+(which sets the depth of the transaction proof) and unlock amount, and the
+whole workflow of the example contracts (Exchange, ERC721AuctionSubmarine).
+It also compares the gas per session of revealing many sessions with reveal,
+one transaction each, and with one revealMany, and of revealing sessions with
+trie proofs against an attested commit block, and the net gas (after
+refunds) of settling a session with and without consuming it.
+The contracts and chains are set up the same way as in the tests.
+
+The gas used by every step is written as JSON and compared against a
+baseline; the benchmark fails if a step uses more gas than the baseline plus
+the tolerance.
+
+    python3 bench/bench_gas.py [--output results.json] [--tolerance 0.01]
+    python3 bench/bench_gas.py --update-baseline
+'''
+import argparse
+import collections
+import json
+import logging
+import os
+import sys
+
+import rlp
+from ethereum import transactions, utils
+from ethereum.tools import tester as t
+from eth_abi.packed import encode_single_packed
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.append(os.path.join(BENCH_DIR, '..', 'test'))
+sys.path.append(os.path.join(BENCH_DIR, '..', 'generate_commitment'))
+import generate_reveal_proof
+import generate_submarine_commit
+from test_utils import (rec_bin, copy_chain_fixture, new_tester_chain,
+                        proveth_compatible_commit_block)
+
+log = logging.getLogger('BenchGas')
+LOGFORMAT = "%(levelname)s:%(filename)s:%(lineno)s:%(funcName)s(): %(message)s"
+log.setLevel(logging.getLevelName('INFO'))
+logHandler = logging.StreamHandler(stream=sys.stderr)
+logHandler.setFormatter(logging.Formatter(LOGFORMAT))
+log.addHandler(logHandler)
+
+DEFAULT_BASELINE = os.path.join(BENCH_DIR, 'gas_baseline.json')
+# Relative gas increase over the baseline that fails the benchmark
+DEFAULT_TOLERANCE = 0.01
+
+DAPP_DATA_SIZES = (0, 32, 256)
+BLOCK_TX_COUNTS = (1, 16, 128)
+UNLOCK_AMOUNTS = (1, 1337000000000000000, 10**23)
+# Sessions revealed at once by revealMany, at most revealBatchLimit
+REVEAL_BATCH_SIZES = (1, 8, 32)
+
+OURGASPRICE = 10**6
+OURGASLIMIT = 3712394
+BASIC_SEND_GAS_LIMIT = 21000
+EXTRA_TRANSACTION_FEES = 100000000000000000
+
+# Exchange and auction scenarios, as in their tests
+ALICE_PRIVATE_KEY = t.k1
+CONTRACT_OWNER_ADDRESS = t.a7
+CONTRACT_OWNER_PRIVATE_KEY = t.k7
+ALICE_TRADE_AMOUNT = 2200000000000000000
+BID_AMOUNT = 1337000000000000000
+TOKEN_ID = 3
+REVEAL_PERIOD_LENGTH = 256
+
+
+def gas_used(chain, send):
+    '''
+    :param send: function sending one transaction on chain
+    :return: gas used by that transaction
+    '''
+    before = chain.head_state.gas_used
+    send()
+    return chain.head_state.gas_used - before
+
+
+def fixture(test_case_class):
+    '''
+    Sets up a chain like the tests of test_case_class (a
+    ChainFixtureTestCase) do.
+
+    :return: chain, dict of the deployed contracts
+    '''
+    chain = new_tester_chain()
+    return chain, test_case_class.set_up_chain(chain)
+
+
+class Session(object):
+    '''
+    One submarine send of ALICE_PRIVATE_KEY to a contract, with the gas
+    used by each of its steps.
+    '''
+
+    def __init__(self, chain, contract, amount, dappData=b''):
+        self.chain = chain
+        self.contract = contract
+        self.amount = amount
+        self.dappData = dappData
+        self.gas = collections.OrderedDict()
+        addressB, commit, witness, unlockTxHex = generate_submarine_commit.generateCommitAddress(
+            utils.privtoaddr(ALICE_PRIVATE_KEY), contract.address, amount,
+            dappData, OURGASPRICE, OURGASLIMIT)
+        self.addressB = rec_bin(addressB)
+        self.commit = rec_bin(commit)
+        self.witness = rec_bin(witness)
+        self.unlockTx = rlp.decode(rec_bin(unlockTxHex), transactions.Transaction)
+
+    def sendCommit(self, blockTxCount=1):
+        '''
+        Sends the commit transaction as the last of blockTxCount transactions
+        of a block (the others are plain sends).
+        '''
+        for i in range(blockTxCount - 1):
+            key = t.keys[2 + i % (len(t.keys) - 2)]
+            self.chain.direct_tx(
+                transactions.Transaction(
+                    self.chain.head_state.get_nonce(utils.privtoaddr(key)),
+                    OURGASPRICE, BASIC_SEND_GAS_LIMIT, t.a0, 1, b'').sign(key))
+        self.sendCommitTx()
+        self.chain.mine(1)
+
+    def sendCommitTx(self):
+        '''
+        Sends the commit transaction, without mining it.
+        '''
+        self.commitTx = transactions.Transaction(
+            self.chain.head_state.get_nonce(utils.privtoaddr(ALICE_PRIVATE_KEY)),
+            OURGASPRICE, BASIC_SEND_GAS_LIMIT, self.addressB,
+            self.amount + EXTRA_TRANSACTION_FEES, b'').sign(ALICE_PRIVATE_KEY)
+        self.gas["commit"] = gas_used(
+            self.chain, lambda: self.chain.direct_tx(self.commitTx))
+
+    def revealArgs(self, trieProof=False):
+        '''
+        :param trieProof: whether to prove the commit transaction with a
+            trie proof, for a commit block that is attested already, rather
+            than a proof blob
+        :return: the arguments of reveal, once the commit transaction is
+            mined
+        '''
+        commitBlockNumber, commitTxIndex = self.chain.chain.get_tx_position(
+            self.commitTx)
+        commitBlock = proveth_compatible_commit_block(
+            self.chain.chain.get_block_by_number(commitBlockNumber),
+            self.commitTx)
+        blockProofs = generate_reveal_proof.BlockProofs(commitBlock)
+        if trieProof:
+            proofBlob = blockProofs.trieProof(commitTxIndex)
+        else:
+            proofBlob = blockProofs.proofBlob(commitTxIndex)
+        unlockTxUnsignedRlp = rlp.encode(
+            transactions.UnsignedTransaction(
+                self.unlockTx.nonce, self.unlockTx.gasprice,
+                self.unlockTx.startgas, self.unlockTx.to, self.unlockTx.value,
+                self.unlockTx.data), transactions.UnsignedTransaction)
+        return (commitBlockNumber, self.dappData, self.witness,
+                unlockTxUnsignedRlp, proofBlob)
+
+    def reveal(self):
+        revealArgs = self.revealArgs()
+        self.gas["reveal"] = gas_used(
+            self.chain, lambda: self.contract.reveal(
+                *revealArgs, sender=ALICE_PRIVATE_KEY, gasprice=OURGASPRICE))
+        self.chain.mine(1)
+
+    def unlock(self):
+        self.gas["unlock"] = gas_used(
+            self.chain, lambda: self.chain.direct_tx(self.unlockTx))
+        self.chain.mine(1)
+
+    def call(self, step, send):
+        self.gas[step] = gas_used(self.chain, send)
+        self.chain.mine(1)
+
+
+def bench_lib_submarine_simple(dappDataSizes, blockTxCounts, unlockAmounts):
+    '''
+    :return: dict from scenario name to dict from step to gas
+    '''
+    from test_LibSubmarineSimple import TestLibSubmarineSimple
+    fixtureChain, fixtureContracts = fixture(TestLibSubmarineSimple)
+    results = collections.OrderedDict()
+    for dappDataSize in dappDataSizes:
+        for blockTxCount in blockTxCounts:
+            for amount in unlockAmounts:
+                chain, contracts = copy_chain_fixture(fixtureChain,
+                                                     fixtureContracts)
+                verifier = contracts['verifier_contract']
+                session = Session(chain, verifier, amount,
+                                  b'\x42' * dappDataSize)
+                session.sendCommit(blockTxCount)
+                chain.mine(verifier.commitPeriodLength() + 1)
+                session.reveal()
+                session.unlock()
+                name = "LibSubmarineSimple/dappData={}/blockTxs={}/amount={}".format(
+                    dappDataSize, blockTxCount, amount)
+                results[name] = session.gas
+                log.info("{}: {}".format(name, dict(session.gas)))
+    return results
+
+
+def bench_reveal_many(batchSizes):
+    '''
+    Gas per session of revealing batchSizes sessions, all committed in the
+    same block, with reveal one by one and with one revealMany.
+
+    :return: dict from scenario name to dict from step to gas
+    '''
+    from test_LibSubmarineSimple import TestLibSubmarineSimple
+    fixtureChain, fixtureContracts = fixture(TestLibSubmarineSimple)
+    results = collections.OrderedDict()
+    for batchSize in batchSizes:
+        gas = collections.OrderedDict()
+        for batched in (False, True):
+            chain, contracts = copy_chain_fixture(fixtureChain,
+                                                 fixtureContracts)
+            verifier = contracts['verifier_contract']
+            sessions = [
+                Session(chain, verifier, UNLOCK_AMOUNTS[1])
+                for _ in range(batchSize)
+            ]
+            for session in sessions:
+                session.sendCommitTx()
+            chain.mine(verifier.commitPeriodLength() + 1)
+            reveals = [session.revealArgs() for session in sessions]
+            if batched:
+                batch = generate_reveal_proof.encodeRevealBatch(reveals)
+                total = gas_used(
+                    chain, lambda: verifier.revealMany(
+                        batch, sender=ALICE_PRIVATE_KEY,
+                        gasprice=OURGASPRICE))
+                gas["revealManyPerSession"] = total // batchSize
+            else:
+                total = 0
+                for revealArgs in reveals:
+                    total += gas_used(
+                        chain, lambda: verifier.reveal(
+                            *revealArgs, sender=ALICE_PRIVATE_KEY,
+                            gasprice=OURGASPRICE))
+                gas["revealPerSession"] = total // batchSize
+        name = "LibSubmarineSimple/revealMany/sessions={}".format(batchSize)
+        results[name] = gas
+        log.info("{}: {}".format(name, dict(gas)))
+    return results
+
+
+def bench_attested_reveals(sessionCounts):
+    '''
+    Gas of revealing sessionCounts sessions committed in the same block: the
+    first one with a proof blob (which attests the block), the others with
+    trie proofs only.
+
+    :return: dict from scenario name to dict from step to gas
+    '''
+    from test_LibSubmarineSimple import TestLibSubmarineSimple
+    fixtureChain, fixtureContracts = fixture(TestLibSubmarineSimple)
+    results = collections.OrderedDict()
+    for sessionCount in sessionCounts:
+        chain, contracts = copy_chain_fixture(fixtureChain, fixtureContracts)
+        verifier = contracts['verifier_contract']
+        sessions = [
+            Session(chain, verifier, UNLOCK_AMOUNTS[1])
+            for _ in range(sessionCount)
+        ]
+        for session in sessions:
+            session.sendCommitTx()
+        chain.mine(verifier.commitPeriodLength() + 1)
+        gas = collections.OrderedDict()
+        total = 0
+        for i, session in enumerate(sessions):
+            revealArgs = session.revealArgs(trieProof=i > 0)
+            sessionGas = gas_used(
+                chain, lambda: verifier.reveal(
+                    *revealArgs, sender=ALICE_PRIVATE_KEY,
+                    gasprice=OURGASPRICE))
+            if i == 0:
+                gas["revealProofBlob"] = sessionGas
+            else:
+                total += sessionGas
+        if sessionCount > 1:
+            gas["revealTrieProofPerSession"] = total // (sessionCount - 1)
+        name = "LibSubmarineSimple/attested/sessions={}".format(sessionCount)
+        results[name] = gas
+        log.info("{}: {}".format(name, dict(gas)))
+    return results
+
+
+def bench_consume():
+    '''
+    Net gas (after refunds) of settling a completed session (paying out its
+    amount) alone and together with consuming it (a tombstone, which
+    guards against spending it twice and earns no refund).
+
+    :return: dict from scenario name to dict from step to gas
+    '''
+    from test_LibSubmarineSimple import TestLibSubmarineSimple
+    fixtureChain, fixtureContracts = fixture(TestLibSubmarineSimple)
+    gas = collections.OrderedDict()
+    for consume in (False, True):
+        chain, contracts = copy_chain_fixture(fixtureChain, fixtureContracts)
+        verifier = contracts['verifier_contract']
+        session = Session(chain, verifier, UNLOCK_AMOUNTS[1])
+        session.sendCommit()
+        chain.mine(verifier.commitPeriodLength() + 1)
+        session.reveal()
+        session.unlock()
+        step = "settleAndConsume" if consume else "settle"
+        session.call(step, lambda: verifier.settle(
+            session.commit, consume, sender=ALICE_PRIVATE_KEY,
+            gasprice=OURGASPRICE))
+        gas[step] = session.gas[step]
+    name = "LibSubmarineSimple/consume"
+    log.info("{}: {}, consuming costs {:+d} gas".format(
+        name, dict(gas), gas["settleAndConsume"] - gas["settle"]))
+    return {name: gas}
+
+
+def bench_exchange():
+    from test_ExampleExchange import TestExampleAuction as TestExampleExchange
+    chain, contracts = fixture(TestExampleExchange)
+    exchange = contracts['exchange_contract']
+    session = Session(chain, exchange, ALICE_TRADE_AMOUNT)
+    session.sendCommit()
+    chain.mine(exchange.commitPeriodLength() + 1)
+    session.reveal()
+    session.unlock()
+    session.call(
+        "ethToTokenSwap", lambda: exchange.ethToTokenSwap(
+            session.commit, sender=ALICE_PRIVATE_KEY, gasprice=OURGASPRICE))
+    log.info("Exchange: {}".format(dict(session.gas)))
+    return {"Exchange": session.gas}
+
+
+def bench_auction():
+    from test_ExampleAuction import TestExampleAuction, COMMIT_PERIOD_LENGTH
+    chain, contracts = fixture(TestExampleAuction)
+    erc721 = contracts['erc721_contract']
+    auction = contracts['auction_contract']
+    startAuctionBlock = chain.head_state.block_number + 1
+    endCommitPeriodBlock = chain.head_state.block_number + COMMIT_PERIOD_LENGTH
+    erc721.safeTransferFrom(
+        CONTRACT_OWNER_ADDRESS, auction.address, TOKEN_ID,
+        encode_single_packed('(uint32,uint32)',
+                             [startAuctionBlock, endCommitPeriodBlock]),
+        sender=CONTRACT_OWNER_PRIVATE_KEY)
+    chain.mine(1)
+
+    session = Session(chain, auction, BID_AMOUNT)
+    session.sendCommit()
+    chain.mine(COMMIT_PERIOD_LENGTH + 1)
+    session.reveal()
+    session.unlock()
+    chain.mine(REVEAL_PERIOD_LENGTH)
+    session.call(
+        "finalize", lambda: auction.finalize(
+            session.commit, sender=ALICE_PRIVATE_KEY, gasprice=OURGASPRICE))
+    log.info("ERC721AuctionSubmarine: {}".format(dict(session.gas)))
+    return {"ERC721AuctionSubmarine": session.gas}
+
+
+def compare(results, baseline, tolerance):
+    '''
+    :return: list of regressions, as (scenario, step, baseline gas, gas)
+    '''
+    regressions = []
+    for name, steps in results.items():
+        for step, gas in steps.items():
+            baselineGas = baseline.get(name, {}).get(step)
+            if baselineGas is None:
+                log.info("{} {}: {} gas, not in the baseline".format(
+                    name, step, gas))
+            elif gas > baselineGas * (1 + tolerance):
+                regressions.append((name, step, baselineGas, gas))
+            elif gas != baselineGas:
+                log.info("{} {}: {} gas, baseline {}".format(
+                    name, step, gas, baselineGas))
+    return regressions
+
+
+def _intList(value):
+    return [int(item) for item in value.split(",") if item]
+
+
+def _get_args():
+    parser = argparse.ArgumentParser(
+        description="Gas benchmark of commit, reveal and unlock")
+    parser.add_argument(
+        '-o',
+        '--output',
+        default=None,
+        help="File to write the results to, as JSON. Default is stdout.")
+    parser.add_argument(
+        '-b',
+        '--baseline',
+        default=DEFAULT_BASELINE,
+        help="Baseline results to compare against. Default is {}.".format(
+            os.path.relpath(DEFAULT_BASELINE)))
+    parser.add_argument(
+        '-t',
+        '--tolerance',
+        type=float,
+        default=DEFAULT_TOLERANCE,
+        help="Relative gas increase over the baseline that fails the "
+        "benchmark. Default is {}.".format(DEFAULT_TOLERANCE))
+    parser.add_argument(
+        '--update-baseline',
+        action='store_true',
+        help="Write the results to the baseline instead of comparing.")
+    parser.add_argument(
+        '--dapp-data-sizes',
+        type=_intList,
+        default=DAPP_DATA_SIZES,
+        help="Comma separated DApp data sizes in bytes.")
+    parser.add_argument(
+        '--block-tx-counts',
+        type=_intList,
+        default=BLOCK_TX_COUNTS,
+        help="Comma separated numbers of transactions in the commit block.")
+    parser.add_argument(
+        '--unlock-amounts',
+        type=_intList,
+        default=UNLOCK_AMOUNTS,
+        help="Comma separated unlock amounts in Wei.")
+    parser.add_argument(
+        '--reveal-batch-sizes',
+        type=_intList,
+        default=REVEAL_BATCH_SIZES,
+        help="Comma separated numbers of sessions revealed by revealMany, "
+        "and committed in one block for the attested reveals.")
+    parser.add_argument(
+        '--no-examples',
+        action='store_true',
+        help="Skip the example contracts.")
+    return parser.parse_args()
+
+
+def main():
+    args = _get_args()
+    # Without a baseline the benchmark could never fail, so that is an
+    # error, checked before spending minutes on the benchmark
+    if not args.update_baseline and not os.path.exists(args.baseline):
+        log.error("No baseline at {}, run with --update-baseline to "
+                  "create one".format(args.baseline))
+        sys.exit(1)
+    results = bench_lib_submarine_simple(
+        args.dapp_data_sizes, args.block_tx_counts, args.unlock_amounts)
+    results.update(bench_reveal_many(args.reveal_batch_sizes))
+    results.update(bench_attested_reveals(args.reveal_batch_sizes))
+    results.update(bench_consume())
+    if not args.no_examples:
+        results.update(bench_exchange())
+        results.update(bench_auction())
+
+    output = json.dumps(results, indent=2) + "\n"
+    if args.output is None:
+        sys.stdout.write(output)
+    else:
+        with open(args.output, "w") as outputFile:
+            outputFile.write(output)
+
+    if args.update_baseline:
+        with open(args.baseline, "w") as baselineFile:
+            baselineFile.write(output)
+        log.info("Wrote the baseline to {}".format(args.baseline))
+        return
+    with open(args.baseline) as baselineFile:
+        baseline = json.load(baselineFile)
+    regressions = compare(results, baseline, args.tolerance)
+    for name, step, baselineGas, gas in regressions:
+        log.error("{} {}: {} gas, {:+.2%} over the baseline ({})".format(
+            name, step, gas, gas / baselineGas - 1, baselineGas))
+    if regressions:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -7,6 +7,8 @@ import "./proveth/Solidity-RLP/contracts/RLPReader.sol";
 contract LibSubmarineSimple is ProvethVerifier {
 
     using SafeMath for uint256;
+    using RLPReader for bytes;
+    using RLPReader for RLPReader.RLPItem;
 
     ////////////
     // Events //
@@ -23,6 +25,9 @@ contract LibSubmarineSimple is ProvethVerifier {
         bytes32 _commitBlockHash,
         address _submarineAddr
     );
+    event Consumed(
+        bytes32 indexed _submarineId
+    );
 
     /////////////
     // Storage //
@@ -36,10 +41,31 @@ contract LibSubmarineSimple is ProvethVerifier {
     // further than 256 blocks (limit comes from EVM BLOCKHASH opcode), we use a
     // uint8.
     uint8 public commitPeriodLength = 20;
+    // Maximum number of sessions revealed by one revealMany call. A reveal
+    // costs roughly 150k to 250k gas depending on the depth of the proof,
+    // and memory grows with every session of the batch, so this keeps a full
+    // batch well within an 8M block gas limit.
+    uint16 public revealBatchLimit = 32;
+
+    // Index of the transactions root in an RLP encoded block header
+    uint8 constant BLOCK_HEADER_TRANSACTIONS_ROOT = 4;
+    // amountUnlocked of a consumed session, with amountRevealed zero. No
+    // unlock can send more than this.
+    uint96 constant CONSUMED_AMOUNT_UNLOCKED = 2**96 - 1;
 
     // Stored "session" state information
     mapping(bytes32 => SubmarineSession) public sessions;
 
+    // Transactions root of every block a proof blob was checked for, by
+    // block hash. Once a block is attested, reveals of sessions committed in
+    // it only need a trie proof of their commit tx against this root,
+    // instead of a proof blob with the whole block header.
+    mapping(bytes32 => bytes32) public attestedTransactionsRoots;
+
+    // A session consumed by the DApp (see consumeSession) is kept forever as
+    // a tombstone with commitTxBlockNumber set, so the submarine ID can't be
+    // revealed again.
+    //
     // A submarine send is considered "finished" when the amount revealed and
     // unlocked are both greater than zero, and the amount for the unlock is
     // greater than or equal to the reveal amount.
@@ -159,6 +185,55 @@ contract LibSubmarineSimple is ProvethVerifier {
         return sesh.commitTxIndex;
     }
 
+    /**
+     * @notice Session information of many submarine IDs at once, see
+     *         getSubmarineState.
+     * @return states one word per submarine ID, in the same order, packing
+     *         amountRevealed (bits 0 to 95), amountUnlocked (bits 96 to 191),
+     *         commitTxBlockNumber (bits 192 to 223) and commitTxIndex (bits
+     *         224 to 239). See submarine_state.decodeSubmarineStates.
+     */
+    function getSubmarineStates(bytes32[] memory _submarineIds)
+        public view returns (uint256[] memory states)
+    {
+        states = new uint256[](_submarineIds.length);
+        for (uint256 i = 0; i < _submarineIds.length; i++) {
+            SubmarineSession memory sesh = sessions[_submarineIds[i]];
+            states[i] = uint256(sesh.amountRevealed)
+                | (uint256(sesh.amountUnlocked) << 96)
+                | (uint256(sesh.commitTxBlockNumber) << 192)
+                | (uint256(sesh.commitTxIndex) << 224);
+        }
+    }
+
+    /**
+     * @notice revealedAndUnlocked of many submarine IDs at once.
+     * @return completed bitmap of the results, in the same order as the
+     *         submarine IDs: bit i % 256 of word i / 256 is set if submarine
+     *         send i has been completed. See
+     *         submarine_state.decodeCompletedBitmap.
+     */
+    function revealedAndUnlockedMany(bytes32[] memory _submarineIds)
+        public view returns (uint256[] memory completed)
+    {
+        completed = new uint256[]((_submarineIds.length + 255) / 256);
+        for (uint256 i = 0; i < _submarineIds.length; i++) {
+            if (revealedAndUnlocked(_submarineIds[i])) {
+                completed[i / 256] |= uint256(1) << (i % 256);
+            }
+        }
+    }
+
+    /**
+     * @notice Whether a session was consumed by the DApp, see
+     *         consumeSession.
+     */
+    function isConsumed(bytes32 _submarineId) public view returns (bool) {
+        SubmarineSession memory sesh = sessions[_submarineId];
+        return sesh.amountRevealed == 0
+            && sesh.amountUnlocked == CONSUMED_AMOUNT_UNLOCKED;
+    }
+
     /////////////
     // Setters //
     /////////////
@@ -193,7 +268,10 @@ contract LibSubmarineSimple is ProvethVerifier {
      * @param _witness Witness "secret" we committed to
      * @param _rlpUnlockTxUnsigned RLP encoded unsigned unlock transaction
      * @param _proofBlob the proof blob that gets passed to proveth to verify
-     *        merkle trie inclusion in a prior block.
+     *        merkle trie inclusion in a prior block. If the transactions root
+     *        of the commit block is attested (see attestedTransactionsRoots),
+     *        it can be the RLP encoded list [txIndex, stack] instead, with
+     *        only the trie nodes of the proof blob.
      */
     function reveal(
         uint32 _commitTxBlockNumber,
@@ -202,18 +280,109 @@ contract LibSubmarineSimple is ProvethVerifier {
         bytes memory _rlpUnlockTxUnsigned,
         bytes memory _proofBlob
     ) public {
-        bytes32 commitBlockHash = blockhash(_commitTxBlockNumber);
+        revealSession(
+            _commitTxBlockNumber,
+            commitBlockHash(_commitTxBlockNumber),
+            _embeddedDAppData,
+            _witness,
+            _rlpUnlockTxUnsigned,
+            _proofBlob
+        );
+    }
+
+    /**
+     * @notice Function called by the user to reveal many sessions at once,
+     *         for the price of one transaction. Every session is checked and
+     *         handled exactly as by reveal; if any of them is invalid, none
+     *         is revealed.
+     * @dev The block hash and commit period of each commit block are checked
+     *      once for all the sessions committed in it. As with reveal, the
+     *      submarine IDs are computed with msg.sender as the user, so a batch
+     *      holds sessions of its sender only; relaying other users' sessions
+     *      is out of scope.
+     * @param _batch RLP encoded list of commit blocks, each one a list
+     *        [commitTxBlockNumber, [session, ...]], and every session a list
+     *        [embeddedDAppData, witness, rlpUnlockTxUnsigned, proofBlob] of
+     *        the arguments of reveal. At most revealBatchLimit sessions.
+     *        See generate_reveal_proof.encodeRevealBatch.
+     */
+    function revealMany(bytes memory _batch) public {
+        RLPReader.RLPItem[] memory commitBlocks = _batch.toRlpItem().toList();
+        uint256 revealed = 0;
+        for (uint256 i = 0; i < commitBlocks.length; i++) {
+            RLPReader.RLPItem[] memory commitBlock = commitBlocks[i].toList();
+            require(commitBlock.length == 2, "Invalid reveal batch");
+            RLPReader.RLPItem[] memory blockSessions = commitBlock[1].toList();
+            revealed = revealed.add(blockSessions.length);
+            require(
+                revealed <= revealBatchLimit,
+                "More sessions than revealBatchLimit in the batch"
+            );
+            revealBlockSessions(uint32(commitBlock[0].toUint()), blockSessions);
+        }
+    }
+
+    /**
+     * @notice Reveals the sessions of revealMany committed in one block.
+     * @param _commitTxBlockNumber Number of block in which the commit txs
+     *        were included.
+     * @param _blockSessions RLP lists of the reveal arguments of every
+     *        session, see revealMany.
+     */
+    function revealBlockSessions(
+        uint32 _commitTxBlockNumber,
+        RLPReader.RLPItem[] memory _blockSessions
+    ) internal {
+        bytes32 blockHash = commitBlockHash(_commitTxBlockNumber);
+        for (uint256 i = 0; i < _blockSessions.length; i++) {
+            RLPReader.RLPItem[] memory session = _blockSessions[i].toList();
+            require(session.length == 4, "Invalid reveal batch");
+            revealSession(
+                _commitTxBlockNumber,
+                blockHash,
+                session[0].toBytes(),
+                bytes32(session[1].toUint()),
+                session[2].toBytes(),
+                session[3].toBytes()
+            );
+        }
+    }
+
+    /**
+     * @notice Hash of the block in which commit transactions were included,
+     *         checking that it can be revealed now.
+     * @param _commitTxBlockNumber Number of block in which the commit tx was
+     *        included.
+     */
+    function commitBlockHash(uint32 _commitTxBlockNumber)
+        internal view returns (bytes32)
+    {
+        bytes32 blockHash = blockhash(_commitTxBlockNumber);
         require(
-            commitBlockHash != 0x0,
+            blockHash != 0x0,
             "Commit Block is too old to retreive block hash or does not exist"
         );
         require(
             block.number.sub(_commitTxBlockNumber) > commitPeriodLength,
             "Wait for commitPeriodLength blocks before revealing");
+        return blockHash;
+    }
 
+    /**
+     * @notice Reveals one session, see reveal.
+     * @param _commitBlockHash Hash of block _commitTxBlockNumber, see
+     *        commitBlockHash
+     */
+    function revealSession(
+        uint32 _commitTxBlockNumber,
+        bytes32 _commitBlockHash,
+        bytes memory _embeddedDAppData,
+        bytes32 _witness,
+        bytes memory _rlpUnlockTxUnsigned,
+        bytes memory _proofBlob
+    ) internal {
         UnsignedTransaction memory unsignedUnlockTx =
             decodeUnsignedTx(_rlpUnlockTxUnsigned);
-        bytes32 unsignedUnlockTxHash = keccak256(_rlpUnlockTxUnsigned);
 
         require(unsignedUnlockTx.nonce == 0);
         require(unsignedUnlockTx.to == address(this));
@@ -234,40 +403,18 @@ contract LibSubmarineSimple is ProvethVerifier {
             "The tx is already revealed"
         );
 
-        SignedTransaction memory provenCommitTx;
-        uint8 provenCommitTxResultValid;
-        uint256 provenCommitTxIndex;
-        (
-            provenCommitTxResultValid,
-            provenCommitTxIndex,
-            provenCommitTx.nonce,
-            /* gasprice */,
-            /* startgas */,
-            provenCommitTx.to,
-            provenCommitTx.value,
-            provenCommitTx.data,
-            /* v */ ,
-            /* r */,
-            /* s */,
-            provenCommitTx.isContractCreation
-        ) = txProof(commitBlockHash, _proofBlob);
-
-        require(
-            provenCommitTxResultValid == TX_PROOF_RESULT_PRESENT,
-            "The proof is invalid"
+        (address submarine, uint256 provenCommitTxIndex) = provenCommitTx(
+            _commitBlockHash,
+            _proofBlob,
+            unsignedUnlockTx.value
         );
-        require(provenCommitTx.value >= unsignedUnlockTx.value);
-        require(provenCommitTx.isContractCreation == false);
-        require(provenCommitTx.data.length == 0);
 
-        address submarine = ecrecover(
-            unsignedUnlockTxHash,
+        require(submarine == ecrecover(
+            keccak256(_rlpUnlockTxUnsigned),
             vee,
             keccak256(abi.encodePacked(submarineId, byte(uint8(1)))),
             keccak256(abi.encodePacked(submarineId, byte(uint8(0))))
-        );
-
-        require(provenCommitTx.to == submarine);
+        ));
         sessions[submarineId].amountRevealed = uint96(unsignedUnlockTx.value);
         sessions[submarineId].commitTxBlockNumber = _commitTxBlockNumber;
         sessions[submarineId].commitTxIndex = uint16(provenCommitTxIndex);
@@ -275,7 +422,7 @@ contract LibSubmarineSimple is ProvethVerifier {
             submarineId,
             uint96(unsignedUnlockTx.value),
             _witness,
-            commitBlockHash,
+            _commitBlockHash,
             submarine
         );
 
@@ -286,6 +433,110 @@ contract LibSubmarineSimple is ProvethVerifier {
         );
     }
 
+    /**
+     * @notice Checks the proof of a commit transaction, either a proveth
+     *         proof blob or, if the transactions root of the commit block is
+     *         attested, a trie proof against it. The first proof blob
+     *         checked for a block attests its transactions root.
+     * @param _commitBlockHash Hash of the block the commit tx is in
+     * @param _proofBlob the proof of the commit tx, see reveal
+     * @param _unlockValue value of the unlock tx, the commit tx must send at
+     *        least as much
+     * @return to address the commit tx sends to, i.e. the submarine address
+     * @return txIndex index of the commit tx in its block
+     */
+    function provenCommitTx(
+        bytes32 _commitBlockHash,
+        bytes memory _proofBlob,
+        uint256 _unlockValue
+    ) internal returns (address to, uint256 txIndex) {
+        RLPReader.RLPItem[] memory proof = _proofBlob.toRlpItem().toList();
+        if (proof.length == 2) {
+            bytes32 transactionsRoot = attestedTransactionsRoots[_commitBlockHash];
+            require(
+                transactionsRoot != 0x0,
+                "The commit block is not attested, reveal with a proof blob"
+            );
+            return trieProofCommitTx(transactionsRoot, proof, _unlockValue);
+        }
+        (to, txIndex) = proofBlobCommitTx(
+            _commitBlockHash,
+            _proofBlob,
+            _unlockValue
+        );
+        if (attestedTransactionsRoots[_commitBlockHash] == 0x0) {
+            // txProof checked that the header hashes to _commitBlockHash
+            attestedTransactionsRoots[_commitBlockHash] = bytes32(
+                proof[1].toList()[BLOCK_HEADER_TRANSACTIONS_ROOT].toUint());
+        }
+    }
+
+    /**
+     * @notice Checks a proveth proof blob of a commit transaction, see
+     *         provenCommitTx.
+     */
+    function proofBlobCommitTx(
+        bytes32 _commitBlockHash,
+        bytes memory _proofBlob,
+        uint256 _unlockValue
+    ) internal view returns (address to, uint256 txIndex) {
+        SignedTransaction memory commitTx;
+        uint8 resultValid;
+        (
+            resultValid,
+            txIndex,
+            commitTx.nonce,
+            /* gasprice */,
+            /* startgas */,
+            commitTx.to,
+            commitTx.value,
+            commitTx.data,
+            /* v */ ,
+            /* r */,
+            /* s */,
+            commitTx.isContractCreation
+        ) = txProof(_commitBlockHash, _proofBlob);
+
+        require(
+            resultValid == TX_PROOF_RESULT_PRESENT,
+            "The proof is invalid"
+        );
+        require(commitTx.value >= _unlockValue);
+        require(commitTx.isContractCreation == false);
+        require(commitTx.data.length == 0);
+        return (commitTx.to, txIndex);
+    }
+
+    /**
+     * @notice Checks a trie proof of a commit transaction against the
+     *         transactions root of its block, see provenCommitTx. The trie
+     *         is walked by ProvethVerifier, as for a proof blob.
+     * @param _transactionsRoot attested transactions root of the commit block
+     * @param _trieProof [txIndex, stack]: the index of the commit tx in its
+     *        block, and the trie nodes from the root to its leaf, as in a
+     *        proof blob
+     */
+    function trieProofCommitTx(
+        bytes32 _transactionsRoot,
+        RLPReader.RLPItem[] memory _trieProof,
+        uint256 _unlockValue
+    ) internal pure returns (address to, uint256 txIndex) {
+        require(!_trieProof[0].isList(), "The proof is invalid");
+        // The key of a transaction in the trie is its RLP encoded index, see
+        // ProvethVerifier.decodeProofBlob
+        bytes memory rlpTx = validateMPTProof(
+            _transactionsRoot,
+            decodeNibbles(_trieProof[0].toRlpBytes(), 0),
+            _trieProof[1].toList()
+        );
+        require(rlpTx.length > 0, "The proof is invalid");
+        SignedTransaction memory commitTx = decodeSignedTx(rlpTx);
+        require(commitTx.value >= _unlockValue);
+        require(commitTx.isContractCreation == false);
+        require(commitTx.data.length == 0);
+        return (commitTx.to, _trieProof[0].toUint());
+    }
+
     /**
      * @notice Function called by the submarine address to unlock the session.
      * @dev warning this function does NO validation whatsoever.
@@ -304,6 +555,34 @@ contract LibSubmarineSimple is ProvethVerifier {
         emit Unlocked(_submarineId, uint96(msg.value));
     }
 
+    /**
+     * @notice Guards against spending a completed session twice: DApps
+     *         that pay out or settle the amount revealed (e.g.
+     *         ERC721AuctionSubmarine.finalize) call this when they do, so
+     *         that revealedAndUnlocked is false from then on.
+     * @dev The session is turned into a tombstone in place: the amounts are
+     *      cleared and commitTxBlockNumber is kept, so reveal keeps rejecting
+     *      the submarine ID (even for a new commit tx to the same submarine
+     *      address) and unlock can't overwrite it. This frees no storage: the
+     *      slot stays non-zero, so it costs an SSTORE and earns no refund,
+     *      and deleting the session would let the same ID be revealed and
+     *      spent again. A DApp whose own per-session storage is only needed
+     *      until the session is spent (e.g. bidders in
+     *      ERC721AuctionSubmarine) can delete that storage once it is
+     *      consumed, which does earn a refund.
+     * @param _submarineId the ID of a revealed session
+     */
+    function consumeSession(bytes32 _submarineId) internal {
+        require(
+            sessions[_submarineId].commitTxBlockNumber != 0,
+            "The tx is not revealed"
+        );
+        require(!isConsumed(_submarineId), "The session is already consumed");
+        sessions[_submarineId].amountRevealed = 0;
+        sessions[_submarineId].amountUnlocked = CONSUMED_AMOUNT_UNLOCKED;
+        emit Consumed(_submarineId);
+    }
+
     /**
      * @notice revealedAndUnlocked can be called to determine if a submarine
      *         send transaction has been successfully completed for a given
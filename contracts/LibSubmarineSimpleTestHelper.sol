@@ -9,5 +9,20 @@ contract LibSubmarineSimpleTestHelper is LibSubmarineSimple {
         uint256 _value
     ) internal {
 
+    }
+
+	function consume(bytes32 _submarineId) public {
+        consumeSession(_submarineId);
+    }
+
+	// A DApp settling a completed session by paying out its amount, with or
+	// without consuming it, for the gas benchmark.
+	function settle(bytes32 _submarineId, bool _consume) public {
+        require(revealedAndUnlocked(_submarineId));
+        uint256 amount = getSubmarineAmount(_submarineId);
+        if (_consume) {
+            consumeSession(_submarineId);
+        }
+        msg.sender.transfer(amount);
     }
 }
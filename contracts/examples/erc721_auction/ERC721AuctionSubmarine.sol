@@ -74,11 +74,17 @@ contract ERC721Auction is IERC721Receiver, LibSubmarineSimple {
     require(revealedAndUnlocked(_submarineId));
     require(bidders[_submarineId] == msg.sender);
 
+    // The consumed session can never be revealed or finalized again, so the
+    // bidder is not needed anymore and is deleted for the refund.
+    uint256 amount = getSubmarineAmount(_submarineId);
+    consumeSession(_submarineId);
+    delete bidders[_submarineId];
+
     if (_submarineId == winningSubmarineId) {
       erc721.safeTransferFrom(address(this), msg.sender, erc721TokenId);
-      seller.transfer(getSubmarineAmount(_submarineId));
+      seller.transfer(amount);
     } else {
-      msg.sender.transfer(getSubmarineAmount(_submarineId));
+      msg.sender.transfer(amount);
     }
   }
 }
@@ -0,0 +1,345 @@
+'''
+Long running commit generation server, so that generating a submarine
+session does not pay for starting python and importing ethereum every time.
+
+Requests and results are the JSON lines of generate_submarine_commit.py -i
+(see streamCommitAddresses), sent over a Unix socket or a localhost TCP
+connection. A client can send many requests without waiting for their
+results (pipelining); the results of a connection come back in the order of
+its requests, with line counting the requests of the connection.
+
+CommitClient only needs the standard library; generate_submarine_commit
+(and with it ethereum) is only imported to run a server.
+'''
+import argparse
+import collections
+import json
+import logging
+import os
+import queue
+import socket
+import socketserver
+import sys
+import threading
+
+from concurrent.futures import Future, ProcessPoolExecutor, ThreadPoolExecutor
+
+# Logging
+log = logging.getLogger('SubmarineCommitDaemon')
+LOGFORMAT = "%(levelname)s:%(filename)s:%(lineno)s:%(funcName)s(): %(message)s"
+log.setLevel(logging.getLevelName('INFO'))
+logHandler = logging.StreamHandler(stream=sys.stderr)
+logHandler.setFormatter(logging.Formatter(LOGFORMAT))
+log.addHandler(logHandler)
+
+# Requests of one connection that are read ahead of the result being sent
+DEFAULT_PIPELINE_DEPTH = 64
+
+
+class _CommitRequestHandler(socketserver.StreamRequestHandler):
+    '''
+    Serves one connection. This thread reads and parses the requests and
+    submits them to the worker pool of the server; a second thread writes
+    the results in order. At most pipelineDepth requests are in between, after
+    that reading waits for results to be sent.
+    '''
+
+    def setup(self):
+        self.disable_nagle_algorithm = isinstance(self.server,
+                                                  _TCPCommitServer)
+        super().setup()
+
+    def handle(self):
+        results = queue.Queue(maxsize=self.server.pipelineDepth)
+        writer = threading.Thread(target=self._writeResults, args=(results, ))
+        writer.daemon = True
+        writer.start()
+        try:
+            lineNumber = 0
+            for line in self.rfile:
+                if not line.strip():
+                    continue
+                lineNumber += 1
+                results.put(self.server.submit(lineNumber, line))
+        finally:
+            results.put(None)
+            writer.join()
+
+    def _writeResults(self, results):
+        for future in iter(results.get, None):
+            try:
+                self.wfile.write(
+                    json.dumps(future.result()).encode() + b"\n")
+            except OSError:
+                # The client went away, drain the rest
+                pass
+
+
+class _CommitServerMixIn(socketserver.ThreadingMixIn):
+    daemon_threads = True
+
+    def setUpCommitServer(self, workers, processes, pipelineDepth):
+        from generate_submarine_commit import _generateCommitAddressesChunk
+        self.pipelineDepth = pipelineDepth
+        if processes:
+            self.executor = ProcessPoolExecutor(max_workers=workers)
+        else:
+            self.executor = ThreadPoolExecutor(max_workers=workers)
+        # Import and load everything now, rather than on the first request
+        for future in [
+                self.executor.submit(_generateCommitAddressesChunk, [])
+                for _ in range(workers or 1)
+        ]:
+            future.result()
+
+    def submit(self, lineNumber, line):
+        '''
+        :return: Future of the JSON result object of the request line
+        '''
+        from generate_submarine_commit import _commitResult, _generateCommitAddressesChunk, _parseCommitRequest, _recordRetries
+        request = None
+        try:
+            request = json.loads(line.decode())
+            row = _parseCommitRequest(request, {})
+        except Exception as e:
+            # A bad line must never drop the connection, whatever it holds.
+            # UnicodeDecodeError and json.JSONDecodeError are ValueErrors
+            done = Future()
+            done.set_result(_commitResult(
+                lineNumber, request, error=str(e) or type(e).__name__))
+            return done
+
+        result = Future()
+
+        def generated(future):
+            try:
+                columns, stats = future.result()
+            except Exception as e:
+                log.exception("Generating line {} failed".format(lineNumber))
+                result.set_result(
+                    _commitResult(lineNumber, request, error=str(e)))
+                return
+            _recordRetries(stats)
+            result.set_result(
+                _commitResult(lineNumber, request, next(zip(*columns))))
+
+        self.executor.submit(_generateCommitAddressesChunk,
+                             [row]).add_done_callback(generated)
+        return result
+
+    def server_close(self):
+        super().server_close()
+        if hasattr(self, "executor"):
+            self.executor.shutdown()
+
+
+class _UnixCommitServer(_CommitServerMixIn, socketserver.UnixStreamServer):
+    _bound = False
+
+    def server_bind(self):
+        super().server_bind()
+        self._bound = True
+
+    def server_close(self):
+        super().server_close()
+        # Not if binding failed, the path may be another server's socket
+        if self._bound:
+            os.unlink(self.server_address)
+            self._bound = False
+
+
+class _TCPCommitServer(_CommitServerMixIn, socketserver.TCPServer):
+    allow_reuse_address = True
+
+
+def makeCommitServer(address,
+                     workers=None,
+                     processes=False,
+                     pipelineDepth=DEFAULT_PIPELINE_DEPTH):
+    '''
+    Creates a commit generation server. Run it with serve_forever(), stop it
+    with shutdown() and server_close().
+
+    :param address: path of the Unix socket to listen on, or a (host, port)
+        tuple to listen on TCP. Do not listen on anything else than
+        localhost: the results contain the witnesses.
+    :param workers: size of the worker pool that generates the sessions,
+        default is the number of CPUs
+    :param processes: if True, the workers are processes instead of threads
+        (more parallel, but every request is pickled to a worker)
+    :param pipelineDepth: number of requests of one connection that can be
+        waiting for their result to be sent
+    :return: socketserver server
+    '''
+    if workers is None:
+        workers = os.cpu_count() or 1
+    if isinstance(address, str):
+        server = _UnixCommitServer(address, _CommitRequestHandler)
+    else:
+        server = _TCPCommitServer(address, _CommitRequestHandler)
+    try:
+        server.setUpCommitServer(workers, processes, pipelineDepth)
+    except BaseException:
+        server.server_close()
+        raise
+    return server
+
+
+class CommitClient(object):
+    '''
+    Client for a commit generation server, see makeCommitServer. One client
+    uses one connection and must not be shared between threads.
+    '''
+
+    def __init__(self, address, timeout=None):
+        '''
+        :param address: path of the Unix socket, or (host, port) tuple
+        :param timeout: optional socket timeout in seconds
+        '''
+        if isinstance(address, str):
+            self._socket = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        else:
+            self._socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+            self._socket.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self._socket.settimeout(timeout)
+        self._socket.connect(address)
+        self._rfile = self._socket.makefile("rb")
+
+    def generate(self,
+                 fromAddress,
+                 toAddress,
+                 sendAmount,
+                 dappData=None,
+                 gasPrice=None,
+                 gasLimit=None):
+        '''
+        Generates one submarine session.
+
+        :param fromAddress: 0x prefixed, EIP-55 checksummed address
+        :param toAddress: 0x prefixed, EIP-55 checksummed address
+        :param sendAmount: Send Amount (in Wei)
+        :param dappData: optional hex string
+        :return: JSON result object, see streamCommitAddresses
+        '''
+        request = collections.OrderedDict([("fromAddress", fromAddress),
+                                           ("toAddress", toAddress),
+                                           ("sendAmount", sendAmount)])
+        for key, value in (("dappData", dappData), ("gasPrice", gasPrice),
+                           ("gasLimit", gasLimit)):
+            if value is not None:
+                request[key] = value
+        return self.generateMany([request])[0]
+
+    def generateMany(self, requests):
+        '''
+        Sends all requests at once (while reading the results), so that the
+        server works on many of them at the same time.
+
+        :param requests: list of JSON request objects, see
+            streamCommitAddresses
+        :return: list of JSON result objects, in the order of requests
+        '''
+        data = b"".join(
+            json.dumps(request).encode() + b"\n" for request in requests)
+        sender = threading.Thread(target=self._socket.sendall, args=(data, ))
+        sender.start()
+        try:
+            return [self._readResult() for _ in requests]
+        finally:
+            sender.join()
+
+    def _readResult(self):
+        line = self._rfile.readline()
+        if not line:
+            raise ConnectionError("Commit server closed the connection")
+        return json.loads(line.decode())
+
+    def close(self):
+        self._rfile.close()
+        self._socket.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+def _get_args():
+    '''
+    Internal function. Creates an argparser for the main method to use.
+
+    :return: parser: argparse object for parsing program arguments.
+    '''
+    parser = argparse.ArgumentParser(
+        description="Server generating submarine sessions on request",
+        formatter_class=argparse.RawTextHelpFormatter)
+    parser.add_argument(
+        '-s',
+        '--socket',
+        required=False,
+        type=str,
+        default=None,
+        help="Path of the Unix socket to listen on.")
+    parser.add_argument(
+        '-P',
+        '--port',
+        required=False,
+        type=int,
+        default=None,
+        help="Localhost TCP port to listen on, instead of a Unix socket.")
+    parser.add_argument(
+        '-w',
+        '--workers',
+        required=False,
+        type=int,
+        default=None,
+        help="Optional number of workers. Default is the number of CPUs.")
+    parser.add_argument(
+        '--processes',
+        action='store_true',
+        help="Use worker processes instead of worker threads.")
+    parser.add_argument(
+        '--pipeline-depth',
+        required=False,
+        type=int,
+        default=DEFAULT_PIPELINE_DEPTH,
+        help="Optional number of requests per connection read ahead of "
+        "their results. Default is {}.".format(DEFAULT_PIPELINE_DEPTH))
+    return parser.parse_args()
+
+
+def main():
+    '''
+    Main method. Serves until interrupted.
+    '''
+    parser = _get_args()
+
+    if (parser.socket is None) == (parser.port is None):
+        log.error("Give exactly one of --socket and --port")
+        sys.exit(1)
+    if parser.workers is not None and parser.workers < 1:
+        log.error("Number of workers must be at least 1")
+        sys.exit(1)
+    if parser.pipeline_depth < 1:
+        log.error("Pipeline depth must be at least 1")
+        sys.exit(1)
+
+    address = parser.socket
+    if address is None:
+        address = ("127.0.0.1", parser.port)
+    server = makeCommitServer(address, parser.workers, parser.processes,
+                              parser.pipeline_depth)
+    log.info("Serving commit requests on {}".format(address))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        from generate_submarine_commit import retryStats
+        log.info("Retries: {}".format(dict(retryStats)))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,354 @@
+'''
+Generates the proof blobs that reveal passes to proveth, to prove that a
+commit transaction is part of a block.
+
+proveth.generate_proof_blob(block_dict, tx_index) builds the transaction trie
+of the whole block for every proof. BlockProofs builds it once per block and
+then generates the proofs of as many of its transactions as needed.
+
+A proof blob never changes once its block is mined, so ProofBlobCache keeps
+them (in memory and optionally on disk) by (block hash, transaction index),
+for reveals that have to be sent again.
+
+Once a proof blob of a block has been checked by the contract, its
+transactions root is attested, and the other reveals of sessions committed in
+that block can send BlockProofs.trieProof instead, without the header.
+
+encodeRevealBatch encodes many reveals as the argument of revealMany.
+'''
+import collections
+import logging
+import os
+import struct
+import sys
+import threading
+
+import rlp
+from trie import HexaryTrie
+
+sys.path.append(
+    os.path.join(os.path.dirname(__file__), '..', 'proveth', 'offchain'))
+import proveth
+
+# Logging
+log = logging.getLogger('SubmarineRevealProof')
+LOGFORMAT = "%(levelname)s:%(filename)s:%(lineno)s:%(funcName)s(): %(message)s"
+log.setLevel(logging.getLevelName('INFO'))
+logHandler = logging.StreamHandler(stream=sys.stdout)
+logHandler.setFormatter(logging.Formatter(LOGFORMAT))
+log.addHandler(logHandler)
+
+# proof type of a transaction proof blob
+PROOF_TYPE_TRANSACTION = 1
+
+# Proof blobs a ProofBlobCache keeps in memory by default
+DEFAULT_CACHE_ENTRIES = 4096
+
+# ProofBlobCache.stats keys
+CACHE_HITS = "hits"  # found in memory
+CACHE_DISK_HITS = "diskHits"  # found on disk only
+CACHE_MISSES = "misses"  # generated
+CACHE_EVICTIONS = "evictions"  # dropped from memory (kept on disk)
+
+# Default revealBatchLimit of LibSubmarineSimple: most sessions one
+# revealMany call takes
+DEFAULT_REVEAL_BATCH_LIMIT = 32
+
+# Record header of a ProofBlobCache file: block hash, transaction index and
+# length of the proof blob that follows
+_CACHE_RECORD_HEADER = struct.Struct(">32sII")
+
+
+class BlockProofs(object):
+    '''
+    Transaction proofs of one block, in the format of
+    proveth.generate_proof_blob.
+    '''
+
+    def __init__(self, blockDict):
+        '''
+        Encodes the block header and builds the transaction trie, and checks
+        both against the block hash and transactions root of blockDict.
+
+        :param blockDict: block in the format proveth expects, with all of
+            its transactions, e.g. from
+            test_utils.proveth_compatible_commit_block
+        '''
+        self.header = proveth.block_header(blockDict)
+        self.trie = HexaryTrie(db={})
+        self.txIndexes = []
+        for txDict in blockDict['transactions']:
+            txIndex = _toInt(txDict['transactionIndex'])
+            self.trie.set(rlp.encode(txIndex), proveth.rlp_transaction(txDict))
+            self.txIndexes.append(txIndex)
+
+        transactionsRoot = _toBytes(blockDict['transactionsRoot'])
+        if self.trie.root_hash != transactionsRoot:
+            raise ValueError(
+                "Tx trie root hash does not match. Calculated: {} Sent: {}".
+                format(self.trie.root_hash.hex(), transactionsRoot.hex()))
+
+    def proofBlob(self, txIndex):
+        '''
+        :return: proof blob of the transaction at txIndex, meant to be the
+            same bytes as proveth.generate_proof_blob(blockDict, txIndex).
+            test_GenerateRevealProof checks that against the proveth
+            checkout; it has to pass before this is relied on.
+        '''
+        stackIndexes, stack = self._proof(txIndex)
+        # The items proveth.generate_proof_blob encodes, if generate_proof
+        # returns stack indexes and stack (otherwise the unpacking fails)
+        return rlp.encode([
+            PROOF_TYPE_TRANSACTION,
+            self.header,
+            txIndex,
+            bytes(stackIndexes),
+            stack,
+        ])
+
+    def trieProof(self, txIndex):
+        '''
+        :return: trie proof of the transaction at txIndex, RLP encoded
+            [txIndex, stack]: the proof blob without the block header. reveal
+            takes it instead of the proof blob once the transactions root of
+            the block is attested (see
+            LibSubmarineSimple.attestedTransactionsRoots).
+        '''
+        stackIndexes, stack = self._proof(txIndex)
+        return rlp.encode([txIndex, stack])
+
+    def _proof(self, txIndex):
+        '''
+        :return: stack indexes and stack of trie nodes of the transaction at
+            txIndex, from proveth.generate_proof
+        '''
+        mptKey = rlp.encode(txIndex)
+        mptKeyNibbles = bytes(
+            nibble for byte in mptKey for nibble in (byte >> 4, byte & 0x0f))
+        return proveth.generate_proof(self.trie, mptKeyNibbles)
+
+    def proofBlobs(self, txIndexes=None):
+        '''
+        :param txIndexes: optional iterable of transaction indexes, default is
+            every transaction of the block
+        :return: dict from transaction index to proof blob
+        '''
+        if txIndexes is None:
+            txIndexes = self.txIndexes
+        return {txIndex: self.proofBlob(txIndex) for txIndex in txIndexes}
+
+
+def generateProofBlobs(blockDict, txIndexes=None):
+    '''
+    Generates the proof blobs of many transactions of one block, building
+    its transaction trie once.
+
+    :param blockDict: block in the format proveth expects, see BlockProofs
+    :param txIndexes: optional iterable of transaction indexes, default is
+        every transaction of the block
+    :return: dict from transaction index to proof blob
+    '''
+    proofBlobs = BlockProofs(blockDict).proofBlobs(txIndexes)
+    log.info("Generated {} proof blobs for block {}".format(
+        len(proofBlobs), blockDict['number']))
+    return proofBlobs
+
+
+def encodeRevealBatch(reveals):
+    '''
+    Encodes reveals as the _batch argument of LibSubmarineSimple.revealMany:
+    an RLP list of [commitTxBlockNumber, [session, ...]] per commit block,
+    so that the contract checks every commit block once.
+
+    :param reveals: iterable of (commitTxBlockNumber, embeddedDAppData,
+        witness, rlpUnlockTxUnsigned, proofBlob), the arguments of reveal
+        (bytes, witness 32 bytes)
+    :return: RLP encoded batch; the sessions of a commit block are revealed
+        in the order of reveals, the commit blocks in the order they first
+        appear
+    '''
+    commitBlocks = collections.OrderedDict()
+    for (commitTxBlockNumber, embeddedDAppData, witness, rlpUnlockTxUnsigned,
+         proofBlob) in reveals:
+        if len(witness) != 32:
+            raise ValueError("Witness must be 32 bytes, got {}".format(
+                len(witness)))
+        commitBlocks.setdefault(commitTxBlockNumber, []).append(
+            [embeddedDAppData, witness, rlpUnlockTxUnsigned, proofBlob])
+    return rlp.encode([[commitTxBlockNumber, sessions]
+                       for commitTxBlockNumber, sessions in
+                       commitBlocks.items()])
+
+
+def revealBatches(reveals, batchLimit=DEFAULT_REVEAL_BATCH_LIMIT):
+    '''
+    Splits reveals into revealMany batches of at most batchLimit sessions
+    (the revealBatchLimit of the contract), keeping the sessions of a commit
+    block together as far as possible.
+
+    :param reveals: iterable of reveal arguments, see encodeRevealBatch
+    :return: list of encoded batches, see encodeRevealBatch
+    '''
+    reveals = sorted(reveals, key=lambda reveal: reveal[0])
+    return [
+        encodeRevealBatch(reveals[start:start + batchLimit])
+        for start in range(0, len(reveals), batchLimit)
+    ]
+
+
+class ProofBlobCache(object):
+    '''
+    Cache of proof blobs by (block hash, transaction index): the most
+    recently used ones in memory, and optionally all of them in an append
+    only file that survives restarts.
+
+    Safe to use from many threads. Only one process should append to a
+    file at a time.
+    '''
+
+    def __init__(self, path=None, maxEntries=DEFAULT_CACHE_ENTRIES):
+        '''
+        :param path: optional file to keep every proof blob in, created if
+            it does not exist. Proof blobs in it are found again by a new
+            ProofBlobCache with the same path.
+        :param maxEntries: number of proof blobs kept in memory
+        '''
+        self.maxEntries = maxEntries
+        # hits, misses and evictions, see CACHE_HITS etc.
+        self.stats = collections.Counter()
+        self._lock = threading.Lock()
+        self._memory = collections.OrderedDict()
+        # (blockHash, txIndex) -> (offset, length) of the blob in the file
+        self._offsets = {}
+        self._file = None
+        if path is not None:
+            self._file = open(path, "a+b")
+            self._loadOffsets()
+
+    def _loadOffsets(self):
+        self._file.seek(0)
+        offset = 0
+        while True:
+            header = self._file.read(_CACHE_RECORD_HEADER.size)
+            if len(header) < _CACHE_RECORD_HEADER.size:
+                break
+            blockHash, txIndex, length = _CACHE_RECORD_HEADER.unpack(header)
+            blobOffset = offset + _CACHE_RECORD_HEADER.size
+            if len(self._file.read(length)) < length:
+                break
+            self._offsets[(blockHash, txIndex)] = (blobOffset, length)
+            offset = blobOffset + length
+        # Drop a record that was cut off, e.g. by a crash while appending
+        self._file.truncate(offset)
+
+    def get(self, blockHash, txIndex):
+        '''
+        :param blockHash: 32 bytes or hex string
+        :return: the proof blob, or None if it is not cached
+        '''
+        key = (_toBytes(blockHash), txIndex)
+        with self._lock:
+            blob = self._memory.get(key)
+            if blob is not None:
+                self._memory.move_to_end(key)
+                self.stats[CACHE_HITS] += 1
+                return blob
+            if key not in self._offsets:
+                return None
+            offset, length = self._offsets[key]
+            self._file.seek(offset)
+            blob = self._file.read(length)
+            self._remember(key, blob)
+            self.stats[CACHE_DISK_HITS] += 1
+            return blob
+
+    def put(self, blockHash, txIndex, blob):
+        '''
+        Adds a proof blob to the cache (and file).
+
+        :param blockHash: 32 bytes or hex string
+        '''
+        key = (_toBytes(blockHash), txIndex)
+        with self._lock:
+            if self._file is not None and key not in self._offsets:
+                self._file.seek(0, os.SEEK_END)
+                offset = self._file.tell() + _CACHE_RECORD_HEADER.size
+                self._file.write(
+                    _CACHE_RECORD_HEADER.pack(key[0], txIndex, len(blob)) +
+                    blob)
+                self._file.flush()
+                self._offsets[key] = (offset, len(blob))
+            self._remember(key, blob)
+
+    def _remember(self, key, blob):
+        self._memory[key] = blob
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.maxEntries:
+            self._memory.popitem(last=False)
+            self.stats[CACHE_EVICTIONS] += 1
+
+    def getOrBuild(self, blockHash, txIndexes, getBlock):
+        '''
+        Returns the proof blobs of txIndexes in the block with blockHash,
+        generating (and caching) the ones that are not cached with one
+        BlockProofs.
+
+        :param blockHash: 32 bytes or hex string
+        :param txIndexes: iterable of transaction indexes
+        :param getBlock: function returning the block in the format proveth
+            expects (see BlockProofs). Only called if a proof blob has to be
+            generated.
+        :return: dict from transaction index to proof blob
+        '''
+        proofBlobs = {}
+        missing = []
+        for txIndex in txIndexes:
+            blob = self.get(blockHash, txIndex)
+            if blob is None:
+                missing.append(txIndex)
+            else:
+                proofBlobs[txIndex] = blob
+        if missing:
+            blockDict = getBlock()
+            if _toBytes(blockDict['hash']) != _toBytes(blockHash):
+                raise ValueError("getBlock returned block {} instead of {}".
+                                 format(blockDict['hash'], blockHash))
+            blockProofs = BlockProofs(blockDict)
+            for txIndex in missing:
+                blob = blockProofs.proofBlob(txIndex)
+                self.put(blockHash, txIndex, blob)
+                proofBlobs[txIndex] = blob
+            with self._lock:
+                self.stats[CACHE_MISSES] += len(missing)
+        return proofBlobs
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+def _toInt(value):
+    '''
+    Internal Function
+    :param value: int, or 0x prefixed hex string as in JSON-RPC results
+    '''
+    if isinstance(value, str):
+        return int(value, 16)
+    return value
+
+
+def _toBytes(value):
+    '''
+    Internal Function
+    :param value: bytes, or 0x prefixed hex string as in JSON-RPC results
+    '''
+    if isinstance(value, str):
+        return bytes.fromhex(value[2:] if value.startswith("0x") else value)
+    return bytes(value)
@@ -1,18 +1,11 @@
-from ethereum.transactions import Transaction
-
-import random
 import logging
 import sys
-import rlp
 import argparse
+import collections
+import itertools
+import json
 import os
-
-from ethereum.utils import check_checksum, decode_hex, normalize_address, encode_hex, bytearray_to_int, sha3_256  # sha3_256 is same as Keccak256
-from ethereum.exceptions import InvalidTransaction
-from py_ecc.secp256k1 import N as secp256k1n
-
-sys.path.append(os.path.join(os.path.dirname(__file__), '..', 'test'))
-from test_utils import rec_bin
+import threading
 
 # Logging
 log = logging.getLogger('SubmarineCommitGenerator')
@@ -22,10 +15,98 @@ logHandler = logging.StreamHandler(stream=sys.stdout)
 logHandler.setFormatter(logging.Formatter(LOGFORMAT))
 log.addHandler(logHandler)
 
-unlockFunctionSelector = decode_hex("ec9b5b3a")
+unlockFunctionSelector = bytes.fromhex("ec9b5b3a")
+
+# Order of the secp256k1 curve (py_ecc.secp256k1.N)
+secp256k1n = 0xFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFEBAAEDCE6AF48A03BBFD25E8CD0364141
+
+# Rows per chunk handed to a worker process by generateCommitAddresses
+DEFAULT_CHUNK_SIZE = 256
+
+# Unlock transaction gas price (50 GWei) and gas limit used by the command
+# line and JSON requests that do not give their own
+DEFAULT_GAS_PRICE = 50000000000
+DEFAULT_GAS_LIMIT = 3712394
+
+# Amounts, gas prices and gas limits are encoded in 32 bytes (see _aux), so
+# they have to be below this
+UINT256_LIMIT = 2**256
+
+# Witnesses drawn for one session before giving up. About three quarters of
+# all witnesses are rejected: S is out of range half of the time, and about
+# half of the remaining R values are not the x coordinate of a point on the
+# curve. That is about 4 draws per session on average (3.7 to 4.1 measured
+# over a few hundred sessions), and 256 rejections in a row happen with
+# probability 0.75**256, about 1e-32, so this is only reached if something
+# is badly wrong (e.g. a witnesses iterator that repeats itself).
+MAX_ATTEMPTS = 256
+
+# Retry causes, as counted in retryStats
+RETRY_R_RANGE = "rRange"  # R not in (0, secp256k1n)
+RETRY_S_RANGE = "sRange"  # S not in (0, secp256k1n / 2)
+RETRY_VRS = "vrs"  # no public key can be recovered from (V, R, S)
+SESSIONS = "sessions"  # sessions generated, to compute rejection rates
 
+# Retries (and generated sessions) since this module was loaded, by cause.
+# Every call can also count its own retries in a Counter passed as stats.
+retryStats = collections.Counter()
+_retryStatsLock = threading.Lock()
 
-def _generateRS(addressA, addressC, sendAmount, dappData, gasPrice, gasLimit):
+
+# If set, every commit address recovered with coincurve is recovered again
+# through pyethereum (Transaction.sender) and both have to be the same.
+# Meant for tests, it takes away the speedup of the fast path.
+crossCheckRecovery = os.environ.get("SUBMARINE_CROSS_CHECK", "") not in ("",
+                                                                        "0")
+
+
+# Set by _importDependencies
+_dependenciesImported = False
+
+
+def _importDependencies():
+    '''
+    Internal Function
+    Imports the packages that generating commits needs (rlp, ethereum and,
+    if installed, coincurve). Importing them takes most of a second, so when
+    run from the command line this is only done once the arguments have been
+    checked, and not at all for --help. When imported as a library, it is
+    done on import.
+    '''
+    global _dependenciesImported, rlp, coincurve, Transaction, \
+        InvalidTransaction, check_checksum, normalize_address, encode_hex, \
+        bytearray_to_int, sha3_256
+    if _dependenciesImported:
+        return
+    import rlp
+    from ethereum.transactions import Transaction
+    from ethereum.exceptions import InvalidTransaction
+    from ethereum.utils import check_checksum, normalize_address, encode_hex, bytearray_to_int, sha3_256  # sha3_256 is same as Keccak256
+    try:
+        import coincurve
+    except ImportError:
+        coincurve = None
+    _dependenciesImported = True
+
+
+if __name__ != "__main__":
+    _importDependencies()
+
+
+class CommitGenerationError(Exception):
+    '''
+    Raised when no usable commit is found within MAX_ATTEMPTS witnesses.
+    '''
+    pass
+
+
+def _generateRS(addressA,
+                addressC,
+                sendAmount,
+                dappData,
+                gasPrice,
+                gasLimit,
+                stats=None):
     '''
     Internal Function
     Calculates R & S in a way that
@@ -33,30 +114,135 @@ def _generateRS(addressA, addressC, sendAmount, dappData, gasPrice, gasLimit):
     0 < R < secp256k1n
     0 < S < secp256k1n / 2
 
-    if not recursively runs itself til satisfied \_:)_/
+    if not draws a new witness til satisfied \_:)_/ (at most MAX_ATTEMPTS
+    times, then raises CommitGenerationError)
 
     :param addressA: Sender's Address
     :param addressC: Smart Contracts Address
     :param sendAmount: Send Amount (in Wei)
     :param data: Data for smart contract
+    :param stats: optional collections.Counter that the retries of this call
+        are added to (see retryStats)
     :return:
 
     commit, randw, R, S
 
     '''
     #TODO: validate AddressA and AddressC
-    commit, randw = _generateCommit(addressA, addressC, sendAmount, dappData,
-                                    gasPrice, gasLimit)
+    callStats = collections.Counter()
+    try:
+        return _generateRSFromParts(
+            _commitPrefix(addressA, addressC, sendAmount, dappData),
+            _commitSuffix(gasPrice, gasLimit),
+            stats=callStats)
+    finally:
+        _recordRetries(callStats, stats)
 
-    R = bytearray_to_int(sha3_256(commit + b'\x01'))
-    S = bytearray_to_int(sha3_256(commit + b'\x00'))
 
-    if (0 < R < secp256k1n) & (0 < S < (secp256k1n / 2)):
-        return commit, randw, R, S
-    else:
-        log.info("Invalid R,S. Regenerating the hashes...")
-        return _generateRS(addressA, addressC, sendAmount, dappData, gasPrice,
-                           gasLimit)
+def _generateRSFromParts(commitPrefix,
+                         commitSuffix,
+                         witnesses=None,
+                         stats=None):
+    '''
+    Internal Function
+    Same as _generateRS, but takes the fixed parts of the full commit already
+    encoded (see _commitPrefix and _commitSuffix).
+
+    :param witnesses: optional iterator of witnesses, see
+        _generateCommitFromParts
+    :param stats: optional collections.Counter the retries are counted in.
+        Unlike _generateRS, this does not update retryStats.
+    :return:
+
+    commit, randw, R, S
+    '''
+    return next(_rsCandidates(commitPrefix, commitSuffix, witnesses, stats))
+
+
+def _rsCandidates(commitPrefix, commitSuffix, witnesses=None, stats=None):
+    '''
+    Internal Function
+    Generator of (commit, randw, R, S) tuples with R and S in range (see
+    _generateRS), each one for a new witness. Raises CommitGenerationError
+    once MAX_ATTEMPTS witnesses have been drawn, counting the ones that
+    produced a candidate.
+
+    The full commit and the R/S preimages are kept in buffers that are
+    reused for every witness.
+
+    :param stats: optional collections.Counter that RETRY_R_RANGE and
+        RETRY_S_RANGE rejections are counted in
+    '''
+    fullCommit = bytearray(commitPrefix + bytes(32) + commitSuffix)
+    witnessStart = len(commitPrefix)
+    witnessEnd = witnessStart + 32
+    rsPreimage = bytearray(33)
+
+    for _ in range(MAX_ATTEMPTS):
+        randw = _drawWitness(witnesses)
+        fullCommit[witnessStart:witnessEnd] = randw
+        commit = sha3_256(fullCommit)
+
+        rsPreimage[:32] = commit
+        rsPreimage[32] = 1
+        R = bytearray_to_int(sha3_256(rsPreimage))
+        if not (0 < R < secp256k1n):
+            _countRetry(stats, RETRY_R_RANGE)
+            continue
+        rsPreimage[32] = 0
+        S = bytearray_to_int(sha3_256(rsPreimage))
+        if not (0 < S < (secp256k1n / 2)):
+            _countRetry(stats, RETRY_S_RANGE)
+            continue
+
+        yield commit, randw, R, S
+
+    raise CommitGenerationError(
+        "No usable commit after {} witnesses".format(MAX_ATTEMPTS))
+
+
+def _countRetry(stats, cause):
+    '''
+    Internal Function
+    Counts one retry for cause in stats (if given) and logs it.
+    '''
+    if stats is not None:
+        stats[cause] += 1
+    log.debug("Retrying with a new witness ({})".format(cause))
+
+
+def _recordRetries(callStats, stats=None):
+    '''
+    Internal Function
+    Adds the retries counted during one call to retryStats, and to the
+    caller's stats counter if one was given.
+    '''
+    with _retryStatsLock:
+        retryStats.update(callStats)
+    if stats is not None:
+        stats.update(callStats)
+
+
+def _aux(x):
+    return x.to_bytes(32, byteorder='big')
+
+
+def _commitPrefix(addressA, addressC, sendAmount, dappData):
+    '''
+    Internal Function
+    Encodes the part of the full commit that comes before the witness:
+    (AddressA | AddressC | sendAmount | data)
+    '''
+    return addressA + addressC + _aux(sendAmount) + dappData
+
+
+def _commitSuffix(gasPrice, gasLimit):
+    '''
+    Internal Function
+    Encodes the part of the full commit that comes after the witness:
+    (gasPrice | gasLimit)
+    '''
+    return _aux(gasPrice) + _aux(gasLimit)
 
 
 def _generateCommit(addressA, addressC, sendAmount, dappData, gasPrice,
@@ -64,7 +250,6 @@ def _generateCommit(addressA, addressC, sendAmount, dappData, gasPrice,
     '''
     Internal Function
     Generates a random number (w for witness) and calculates the Keccak256 hash of (AddressA | Address C | sendAmount | data | w)
-    Called from _generateRS()
     :param addressA: Sender's Address
     :param addressC: Smart Contracts Address
     :param sendAmount: Send Amount (in Wei)
@@ -75,20 +260,99 @@ def _generateCommit(addressA, addressC, sendAmount, dappData, gasPrice,
     w: Random number w for witness
 
     '''
-    rand_gen = random.SystemRandom()  # This uses os.urandom() . Secure enough?
-    w = bytes([rand_gen.randrange(256)
-               for _ in range(256 // 8)])  # random bytes
+    return _generateCommitFromParts(
+        _commitPrefix(addressA, addressC, sendAmount, dappData),
+        _commitSuffix(gasPrice, gasLimit))
 
-    def aux(x):
-        return x.to_bytes(32, byteorder='big')
 
-    fullCommit = (addressA + addressC + aux(sendAmount) + dappData + w +
-                  aux(gasPrice) + aux(gasLimit))
-    # log.info("Commit / Session: {} \nAddress A {}\nAddress C {}\n send Amount {}\n dappData {}\n witness {}\n gasprice {}\n gaslimit {}\n".format(fullCommit, addressA, addressC, str(aux(sendAmount)), dappData, w, str(aux(gasPrice)), str(aux(gasLimit))))
+def _generateCommitFromParts(commitPrefix, commitSuffix, witnesses=None):
+    '''
+    Internal Function
+    Same as _generateCommit, but takes the fixed parts of the full commit
+    already encoded, so that they can be shared between many commits.
+    :param commitPrefix: (AddressA | AddressC | sendAmount | data), see _commitPrefix
+    :param commitSuffix: (gasPrice | gasLimit), see _commitSuffix
+    :param witnesses: optional iterator of 32 byte witnesses, see
+        _drawWitness
+    :return:
+
+    FullCommit, w
+    '''
+    w = _drawWitness(witnesses)
+
+    fullCommit = commitPrefix + w + commitSuffix
+    # log.info("Commit / Session: {} \nPrefix {}\n witness {}\n Suffix {}\n".format(fullCommit, commitPrefix, w, commitSuffix))
 
     return sha3_256(fullCommit), w
 
 
+def _drawWitness(witnesses=None):
+    '''
+    Internal Function
+    Returns a new 32 byte witness w.
+    :param witnesses: optional iterator of 32 byte witnesses (e.g. a
+        WitnessPool) to take w from. If None, w is taken from
+        defaultWitnessPool.
+    '''
+    if witnesses is None:
+        return defaultWitnessPool.draw()
+    return next(witnesses)
+
+
+class WitnessPool(object):
+    '''
+    Source of 32 byte witnesses, read from os.urandom() blockSize witnesses
+    at a time instead of one syscall per witness.
+
+    Every witness is handed out once. A WitnessPool can be shared between
+    threads, and a process forked from one that uses it (e.g. a worker of
+    generateCommitAddresses) throws away the buffer it inherited and reads
+    its own, so that parent and child never hand out the same witness.
+
+    It is an iterator, so it can be passed as witnesses wherever an
+    iterator of witnesses is taken.
+    '''
+
+    def __init__(self, blockSize=256):
+        '''
+        :param blockSize: number of witnesses read from os.urandom() at once
+        '''
+        self.blockSize = blockSize
+        self._reset()
+
+    def _reset(self):
+        self._lock = threading.Lock()
+        self._pid = os.getpid()
+        self._block = b''
+        self._offset = 0
+
+    def draw(self):
+        '''
+        :return: a new 32 byte witness
+        '''
+        if self._pid != os.getpid():
+            # Forked: the lock may have been held by another thread of the
+            # parent, and the buffered witnesses are the parent's too.
+            self._reset()
+        with self._lock:
+            if self._offset >= len(self._block):
+                self._block = os.urandom(32 * self.blockSize)
+                self._offset = 0
+            w = self._block[self._offset:self._offset + 32]
+            self._offset += 32
+        return w
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        return self.draw()
+
+
+# Witness source used when none is passed in
+defaultWitnessPool = WitnessPool()
+
+
 def _generateAddressBInternal(addressA,
                               addressC,
                               sendAmount,
@@ -96,7 +360,8 @@ def _generateAddressBInternal(addressA,
                               gasPrice,
                               gasLimit,
                               nonce=0,
-                              V=27):
+                              V=27,
+                              stats=None):
     '''
     Main function
 
@@ -110,6 +375,8 @@ def _generateAddressBInternal(addressA,
     :param gasLimit: Gas Limit
     :param nonce: default 0
     :param V: default 27 --> no replay protection.
+    :param stats: optional collections.Counter that the retries of this call
+        are added to (see retryStats)
     :return:
 
     tx obj, addressB, commit, randw
@@ -119,35 +386,212 @@ def _generateAddressBInternal(addressA,
     commit : commit message
     randw: w (witness) random number
     '''
+    callStats = collections.Counter()
+    try:
+        txRlp, addressB, commit, randw = _generateUnlockTx(
+            _commitPrefix(addressA, addressC, sendAmount, dappData),
+            _commitSuffix(gasPrice, gasLimit), addressC, sendAmount,
+            gasPrice, gasLimit, nonce, V, stats=callStats)
+    finally:
+        _recordRetries(callStats, stats)
+    tx = rlp.decode(txRlp, Transaction)
+    tx.sender = normalize_address(addressB)
+    log.info("Unlock TX Dict: {}".format(tx.to_dict()))
+    return tx, addressB, commit, randw
+
+
+def _generateUnlockTx(commitPrefix,
+                      commitSuffix,
+                      addressC,
+                      sendAmount,
+                      gasPrice,
+                      gasLimit,
+                      nonce=0,
+                      V=27,
+                      witnesses=None,
+                      stats=None):
+    '''
+    Internal Function
+    Does the work of _generateAddressBInternal from an already encoded
+    commit prefix and suffix (see _commitPrefix and _commitSuffix), without
+    logging the unlock transaction and without building a Transaction.
+    :param witnesses: optional iterator of witnesses, see
+        _generateCommitFromParts
+    :param stats: optional collections.Counter the retries are counted in.
+        Unlike _generateAddressBInternal, this does not update retryStats.
+
+    :return:
 
-    commit, randw, R, S = _generateRS(addressA, addressC, sendAmount, dappData,
-                                      gasPrice, gasLimit)
+    txRlp, addressB, commit, randw
 
-    submarineData = unlockFunctionSelector + commit
-    # assert(len(commit) == 36)
-    tx = Transaction(
-        nonce,
-        gasPrice,
-        gasLimit,
-        addressC,
-        sendAmount,
-        data=submarineData,
-        v=V,
-        r=R,
-        s=S)
+    txRlp: RLP encoded (signed) unlock transaction
+    '''
+    template = _UnlockTxTemplate(addressC, sendAmount, gasPrice, gasLimit,
+                                 nonce)
+    for commit, randw, R, S in _rsCandidates(commitPrefix, commitSuffix,
+                                             witnesses, stats):
+        sender = _recoverUnlockSender(template, commit, V, R, S)
+        if sender is None:
+            _countRetry(stats, RETRY_VRS)
+            continue
+
+        if stats is not None:
+            stats[SESSIONS] += 1
+        return template.signed(commit, V, R, S), "0x" + encode_hex(
+            sender), commit, randw
+
+
+class _UnlockTxTemplate(object):
+    '''
+    Internal Class
+    RLP encoding of the unlock transactions of one (addressC, sendAmount,
+    gasPrice, gasLimit, nonce). Everything but the commit (the last 32 bytes
+    of the data) and the signature is encoded once, the commit is written
+    into a buffer that is reused for every candidate.
+    '''
+
+    def __init__(self, addressC, sendAmount, gasPrice, gasLimit, nonce=0):
+        addressC = normalize_address(addressC, allow_blank=True)
+        self._fields = (nonce, gasPrice, gasLimit, addressC, sendAmount)
+        payload = b"".join(
+            rlp.encode(field) for field in self._fields +
+            (unlockFunctionSelector + bytes(32), ))
+        # RLP of the unsigned transaction, which ends with the commit
+        self._unsigned = bytearray(_rlpListPrefix(len(payload)) + payload)
+        self._payloadStart = len(self._unsigned) - len(payload)
+        self._commitStart = len(self._unsigned) - 32
+
+    def unsignedHash(self, commit):
+        '''
+        :return: Keccak256 hash of the RLP encoded unsigned transaction, the
+            hash that (V, R, S) sign
+        '''
+        self._unsigned[self._commitStart:] = commit
+        return sha3_256(self._unsigned)
+
+    def signed(self, commit, V, R, S):
+        '''
+        :return: RLP encoding of the signed transaction, as rlp.encode(tx)
+        '''
+        self._unsigned[self._commitStart:] = commit
+        payload = (self._unsigned[self._payloadStart:] + _rlpInt(V) +
+                   _rlpInt(R) + _rlpInt(S))
+        return bytes(_rlpListPrefix(len(payload)) + payload)
+
+    def transaction(self, commit, V, R, S):
+        '''
+        :return: the signed transaction as ethereum.transactions.Transaction
+        '''
+        nonce, gasPrice, gasLimit, addressC, sendAmount = self._fields
+        return Transaction(
+            nonce,
+            gasPrice,
+            gasLimit,
+            addressC,
+            sendAmount,
+            data=unlockFunctionSelector + commit,
+            v=V,
+            r=R,
+            s=S)
+
+
+def _rlpInt(x):
+    '''
+    Internal Function
+    RLP encoding of a non-negative integer (big endian, no leading zeros)
+    smaller than 2**448, i.e. at most 55 bytes long.
+    '''
+    if x == 0:
+        return b"\x80"
+    if x < 0x80:
+        return bytes([x])
+    length = (x.bit_length() + 7) // 8
+    return bytes([0x80 + length]) + x.to_bytes(length, byteorder='big')
+
+
+def _rlpListPrefix(length):
+    '''
+    Internal Function
+    RLP prefix of a list whose encoded items are length bytes long.
+    '''
+    if length < 56:
+        return bytes([0xc0 + length])
+    lengthBytes = length.to_bytes((length.bit_length() + 7) // 8,
+                                  byteorder='big')
+    return bytes([0xf7 + len(lengthBytes)]) + lengthBytes
+
+
+def _recoverUnlockSender(template, commit, V, R, S):
+    '''
+    Internal Function
+    Recovers addressB, the sender of the unlock transaction with commit and
+    signature (V, R, S). Uses libsecp256k1 directly through coincurve if it
+    is installed, otherwise (or for V other than 27 and 28)
+    Transaction.sender.
+
+    :param template: _UnlockTxTemplate of the unlock transaction
+    :return: 20 byte sender address, or None if no public key can be
+        recovered from (V, R, S)
+    '''
+    if coincurve is None or V not in (27, 28):
+        return _recoverSenderFallback(template.transaction(commit, V, R, S))
+
+    sender = _recoverAddressB(template.unsignedHash(commit), V, R, S)
+
+    if crossCheckRecovery:
+        tx = template.transaction(commit, V, R, S)
+        fallbackSender = _recoverSenderFallback(tx)
+        if fallbackSender != sender:
+            raise AssertionError(
+                "coincurve recovered {} but pyethereum recovered {}".format(
+                    sender, fallbackSender))
+        if rlp.encode(tx) != template.signed(commit, V, R, S):
+            raise AssertionError(
+                "Unlock transaction template encodes {} differently".format(
+                    tx.to_dict()))
+
+    return sender
+
+
+def _recoverAddressB(unsignedHash, V, R, S):
+    '''
+    Internal Function
+    Recovers the address that signed unsignedHash with (V, R, S), with
+    coincurve.
 
+    :param unsignedHash: Keccak256 hash of the RLP encoded unsigned
+        transaction
+    :return: 20 byte address, or None if no public key can be recovered
+    '''
+    if not (0 < R < secp256k1n and 0 < S < secp256k1n):
+        return None
     try:
-        addressB = tx.to_dict().get("sender")
-        log.info("Unlock TX Dict: {}".format(tx.to_dict()))
-        return tx, addressB, commit, randw
+        publicKey = coincurve.PublicKey.from_signature_and_message(
+            R.to_bytes(32, byteorder='big') + S.to_bytes(32, byteorder='big')
+            + bytes([V - 27]),
+            unsignedHash,
+            hasher=None)
+    except Exception:
+        # R is not the x coordinate of a point on the curve
+        return None
+    return sha3_256(publicKey.format(compressed=False)[1:])[-20:]
+
 
+def _recoverSenderFallback(tx):
+    '''
+    Internal Function
+    Recovers the sender of tx through Transaction.sender.
+
+    :return: 20 byte sender address, or None if no public key can be
+        recovered from (V, R, S)
+    '''
+    try:
+        return tx.sender
     except (ValueError, InvalidTransaction) as e:
+        # Without coincurve pyethereum raises ValueError('Invalid VRS')
         if isinstance(e, ValueError) and "VRS" not in str(e):
             raise
-        log.info("Address no good (%s), retrying" % e)
-        return _generateAddressBInternal(addressA, addressC, sendAmount,
-                                         dappData, gasPrice, gasLimit, nonce,
-                                         V)
+        return None
 
 
 def printRemix(fromAddress, tx, w):
@@ -164,7 +608,7 @@ def printRemix(fromAddress, tx, w):
 
 
 def generateCommitAddress(fromAddress, toAddress, sendAmount, dappData,
-                          gasPrice, gasLimit):
+                          gasPrice, gasLimit, stats=None):
     '''
     Exportable _generateAddressBInternal
 
@@ -180,15 +624,378 @@ def generateCommitAddress(fromAddress, toAddress, sendAmount, dappData,
     w (witness):
     tx_hex : B -> C (txUnlock) transactions
 
+    Raises CommitGenerationError if no usable witness is found within
+    MAX_ATTEMPTS draws. Pass a collections.Counter as stats to get the number
+    of retries this took, by cause (see RETRY_R_RANGE, RETRY_S_RANGE,
+    RETRY_VRS).
 
     '''
     tx, addressB, commit, randw = _generateAddressBInternal(
-        fromAddress, toAddress, sendAmount, dappData, gasPrice, gasLimit)
+        fromAddress, toAddress, sendAmount, dappData, gasPrice, gasLimit,
+        stats=stats)
 
     return addressB, encode_hex(commit), encode_hex(randw), encode_hex(
         rlp.encode(tx))
 
 
+def generateCommitAddresses(commitRequests, workers=None,
+                            chunkSize=DEFAULT_CHUNK_SIZE, stats=None):
+    '''
+    Batch version of generateCommitAddress, for generating many submarine
+    sessions at once.
+
+    The commit encodings are shared between rows with the same gas price
+    and gas limit, and the unlock transactions are not logged one by one.
+
+    :param commitRequests: iterable of (fromAddress, toAddress, sendAmount,
+        dappData, gasPrice, gasLimit) rows, with the same types as the
+        arguments of generateCommitAddress
+    :param workers: optional number of worker processes. If more than 1, the
+        rows are split into chunks of chunkSize rows that are generated in
+        parallel by a process pool. Every worker draws its own witnesses.
+    :param chunkSize: number of rows per chunk sent to a worker process
+    :param stats: optional collections.Counter that the retries of the whole
+        batch are added to, including the ones made in worker processes (see
+        generateCommitAddress)
+    :return: all in hex, as columns (one list per value, one entry per row,
+        in the order of commitRequests, also when generated in parallel)
+
+
+    addressBs, commits, ws (witnesses), tx_hexes
+    '''
+    callStats = collections.Counter()
+    try:
+        if workers is not None and workers > 1:
+            columns = ([], [], [], [])
+            for _, (chunkColumns, chunkStats) in _generateChunks(
+                    ((None, chunk)
+                     for chunk in _chunks(commitRequests, chunkSize)),
+                    workers):
+                for column, chunkColumn in zip(columns, chunkColumns):
+                    column.extend(chunkColumn)
+                callStats.update(chunkStats)
+        else:
+            columns, chunkStats = _generateCommitAddressesChunk(commitRequests)
+            callStats.update(chunkStats)
+    finally:
+        _recordRetries(callStats, stats)
+
+    log.info("Generated {} submarine commits".format(len(columns[1])))
+    return columns
+
+
+def _generateCommitAddressesChunk(commitRequests):
+    '''
+    Internal Function
+    Does the work of generateCommitAddresses in the current process. This is
+    what every worker process runs on its chunk of rows.
+
+    :return: (addressBs, commits, ws (witnesses), tx_hexes), stats
+
+    stats is a collections.Counter of the retries made, which is sent back
+    along with the rows since retryStats of a worker process is not shared.
+    '''
+    addressBs, commits, witnesses, txHexes = [], [], [], []
+    stats = collections.Counter()
+    commitSuffixes = {}
+
+    for (fromAddress, toAddress, sendAmount, dappData, gasPrice,
+         gasLimit) in commitRequests:
+        commitSuffix = commitSuffixes.get((gasPrice, gasLimit))
+        if commitSuffix is None:
+            commitSuffix = commitSuffixes[(gasPrice, gasLimit)] = \
+                _commitSuffix(gasPrice, gasLimit)
+
+        txRlp, addressB, commit, randw = _generateUnlockTx(
+            _commitPrefix(fromAddress, toAddress, sendAmount, dappData),
+            commitSuffix, toAddress, sendAmount, gasPrice, gasLimit,
+            stats=stats)
+
+        addressBs.append(addressB)
+        commits.append(encode_hex(commit))
+        witnesses.append(encode_hex(randw))
+        txHexes.append(encode_hex(txRlp))
+
+    return (addressBs, commits, witnesses, txHexes), stats
+
+
+def generateGasLadder(fromAddress,
+                      toAddress,
+                      sendAmount,
+                      dappData,
+                      gasVariants,
+                      stats=None):
+    '''
+    Generates one submarine session per (gasPrice, gasLimit) variant for the
+    same sender, contract, amount and data, so that the gas price can be
+    chosen when the commit transaction is broadcast, from the fees of the
+    moment. Every variant has its own witness, commit, addressB and unlock
+    transaction, since the gas price and limit are part of the commit. The
+    parts of the commit that all variants share are encoded once.
+
+    :param gasVariants: iterable of (gasPrice, gasLimit); repeated variants
+        are generated once
+    :param stats: optional collections.Counter that the retries are added
+        to (see generateCommitAddress)
+    :return: collections.OrderedDict from (gasPrice, gasLimit) to (addressB,
+        commit, w (witness), tx_hex), all in hex as returned by
+        generateCommitAddress, in the order of gasVariants. See
+        pickGasVariant.
+    '''
+    commitPrefix = _commitPrefix(fromAddress, toAddress, sendAmount,
+                                 dappData)
+    ladder = collections.OrderedDict()
+    callStats = collections.Counter()
+    try:
+        for gasPrice, gasLimit in gasVariants:
+            if (gasPrice, gasLimit) in ladder:
+                continue
+            txRlp, addressB, commit, randw = _generateUnlockTx(
+                commitPrefix, _commitSuffix(gasPrice, gasLimit), toAddress,
+                sendAmount, gasPrice, gasLimit, stats=callStats)
+            ladder[(gasPrice, gasLimit)] = (addressB, encode_hex(commit),
+                                            encode_hex(randw),
+                                            encode_hex(txRlp))
+    finally:
+        _recordRetries(callStats, stats)
+    return ladder
+
+
+def pickGasVariant(ladder, minGasPrice, minGasLimit=0):
+    '''
+    Picks the cheapest variant of a generateGasLadder result that pays at
+    least minGasPrice, with at least minGasLimit gas.
+
+    :return: ((gasPrice, gasLimit), (addressB, commit, w (witness), tx_hex)),
+        or None if no variant is enough
+    '''
+    variants = [(gasPrice * gasLimit, gasPrice, gasLimit)
+                for gasPrice, gasLimit in ladder
+                if gasPrice >= minGasPrice and gasLimit >= minGasLimit]
+    if not variants:
+        return None
+    _, gasPrice, gasLimit = min(variants)
+    return (gasPrice, gasLimit), ladder[(gasPrice, gasLimit)]
+
+
+def _generateChunks(taggedChunks, workers=None):
+    '''
+    Internal Function
+    Runs _generateCommitAddressesChunk on every chunk of rows, in a process
+    pool if workers is more than 1. At most two chunks per worker are
+    submitted ahead of the one being returned, so that taggedChunks is read
+    only as fast as the chunks are generated.
+
+    :param taggedChunks: iterable of (tag, rows), tag is passed through
+    :return: iterator of (tag, (columns, stats)), in the order of
+        taggedChunks
+    '''
+    if workers is None or workers <= 1:
+        for tag, rows in taggedChunks:
+            yield tag, _generateCommitAddressesChunk(rows)
+        return
+
+    from concurrent.futures import ProcessPoolExecutor
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        pending = collections.deque()
+        for tag, rows in taggedChunks:
+            pending.append(
+                (tag, executor.submit(_generateCommitAddressesChunk, rows)))
+            if len(pending) >= 2 * workers:
+                tag, future = pending.popleft()
+                yield tag, future.result()
+        while pending:
+            tag, future = pending.popleft()
+            yield tag, future.result()
+
+
+def streamCommitAddresses(lines, out, workers=None, defaults=None):
+    '''
+    Generates a submarine session for every JSON line of lines, and writes
+    one JSON line per input line to out, in the same order. Lines are read
+    and results written as they go, so memory use does not depend on the
+    length of the input.
+
+    Every input line is an object with the keys fromAddress, toAddress
+    (0x prefixed, EIP-55 checksummed), sendAmount (Wei), and optionally
+    dappData (hex), gasPrice, gasLimit (see DEFAULT_GAS_PRICE and
+    DEFAULT_GAS_LIMIT) and id. Blank lines are skipped.
+
+    Every output line has the input line number as line (and id, if the
+    input had one), and either addressB, commit, witness and txHex (see
+    generateCommitAddress) or error, if the input line was not valid.
+
+    :param lines: iterable of JSON strings, e.g. an open file
+    :param out: text stream the results are written to
+    :param workers: optional number of worker processes, see
+        generateCommitAddresses. Without workers every line is answered
+        before the next one is read. With workers, lines are generated (and
+        written) DEFAULT_CHUNK_SIZE at a time.
+    :param defaults: optional dict of values for keys missing in a line
+    :return: number of sessions generated
+    '''
+    chunkSize = 1 if workers is None or workers <= 1 else DEFAULT_CHUNK_SIZE
+    entries = ((lineNumber, line)
+               for lineNumber, line in enumerate(lines, start=1)
+               if line.strip())
+    generated = 0
+    callStats = collections.Counter()
+    try:
+        for entryChunk, (columns, chunkStats) in _generateChunks(
+                _parsedChunks(entries, chunkSize, defaults or {}), workers):
+            callStats.update(chunkStats)
+            rows = zip(*columns)
+            for lineNumber, request, error in entryChunk:
+                if error is None:
+                    result = _commitResult(lineNumber, request, next(rows))
+                    generated += 1
+                else:
+                    result = _commitResult(lineNumber, request, error=error)
+                out.write(json.dumps(result) + "\n")
+            out.flush()
+    finally:
+        _recordRetries(callStats)
+    return generated
+
+
+def _commitResult(lineNumber, request, session=None, error=None):
+    '''
+    Internal Function
+    Builds the JSON result object of one streamed commit request.
+
+    :param request: the decoded request, its id is copied if it has one
+    :param session: (addressB, commit, witness, txHex) row of
+        generateCommitAddresses, if the request was valid
+    :param error: error message, if it was not
+    '''
+    result = collections.OrderedDict([("line", lineNumber)])
+    if isinstance(request, dict) and "id" in request:
+        result["id"] = request["id"]
+    if error is None:
+        for key, value in zip(("addressB", "commit", "witness", "txHex"),
+                              session):
+            result[key] = value
+    else:
+        result["error"] = error
+    return result
+
+
+def _parsedChunks(entries, chunkSize, defaults):
+    '''
+    Internal Function
+    Parses the (lineNumber, line) entries of streamCommitAddresses, in chunks
+    of chunkSize entries.
+
+    :return: iterator of (entryChunk, rows), entryChunk has a (lineNumber,
+        request, error) for every entry, rows the commit request of every
+        valid entry
+    '''
+    for chunk in _chunks(entries, chunkSize):
+        entryChunk, rows = [], []
+        for lineNumber, line in chunk:
+            request, error = None, None
+            try:
+                request = json.loads(line)
+                rows.append(_parseCommitRequest(request, defaults))
+            except Exception as e:
+                # A bad line must never stop the stream, whatever it holds.
+                # json.JSONDecodeError is a ValueError too
+                error = str(e) or type(e).__name__
+            entryChunk.append((lineNumber, request, error))
+        yield entryChunk, rows
+
+
+def _parseCommitRequest(request, defaults):
+    '''
+    Internal Function
+    Turns a decoded JSON line of streamCommitAddresses into a commit request
+    row, see generateCommitAddresses.
+
+    Raises ValueError if it is not valid, so that generating the row can't
+    fail.
+    '''
+    if not isinstance(request, dict):
+        raise ValueError("Expected a JSON object")
+    values = {"gasPrice": DEFAULT_GAS_PRICE, "gasLimit": DEFAULT_GAS_LIMIT}
+    values.update(defaults)
+    values.update(request)
+    for key in ("fromAddress", "toAddress", "sendAmount"):
+        if values.get(key) is None:
+            raise ValueError("Missing {}".format(key))
+    for key in ("sendAmount", "gasPrice", "gasLimit"):
+        if not isinstance(values.get(key), int) or isinstance(
+                values[key], bool) or not 0 <= values[key] < UINT256_LIMIT:
+            raise ValueError(
+                "{} must be a non-negative integer below 2**256".format(key))
+    fromAddress = _parseAddress(values["fromAddress"], "From")
+    toAddress = _parseAddress(values["toAddress"], "Target")
+    dappData = values.get("dappData")
+    try:
+        dappData = _hexToBytes("" if dappData is None else dappData)
+    except ValueError:
+        raise ValueError("dappData must be a hex string")
+
+    return (fromAddress, toAddress, values["sendAmount"], dappData,
+            values["gasPrice"], values["gasLimit"])
+
+
+def _parseAddress(address, name):
+    '''
+    Internal Function
+    Checks that address is a 0x prefixed, EIP-55 checksummed hex address.
+
+    Raises ValueError if not.
+
+    :param name: how the address is called in the error messages, e.g.
+        "Target"
+    :return: the address as 20 bytes
+    '''
+    if not isinstance(address, str) or len(address) != 42:
+        raise ValueError(
+            "{} Address length does not appear to match the correct length of an Ethereum address".
+            format(name))
+    if address[0:2] != "0x":
+        raise ValueError(
+            "{} address not in expected format, expected address to start with 0x".
+            format(name))
+    _importDependencies()
+    try:
+        checksummed = check_checksum(address)
+    except (TypeError, ValueError):
+        raise ValueError("{} address is not a hex string {}".format(
+            name, address))
+    if not checksummed:
+        raise ValueError(
+            "{} address is not correctly encoded using EIP-55 {}".format(
+                name, address))
+    return normalize_address(address)
+
+
+def _hexToBytes(hexString):
+    '''
+    Internal Function
+    Decodes a hex string, with or without 0x prefix. Raises ValueError if it
+    is not a string of valid hex.
+    '''
+    if not isinstance(hexString, str):
+        raise ValueError("Expected a hex string")
+    if hexString.startswith("0x"):
+        hexString = hexString[2:]
+    return bytes.fromhex(hexString)
+
+
+def _chunks(iterable, size):
+    '''
+    Internal Function
+    Splits iterable into lists of at most size items, keeping their order.
+    '''
+    iterator = iter(iterable)
+    chunk = list(itertools.islice(iterator, size))
+    while chunk:
+        yield chunk
+        chunk = list(itertools.islice(iterator, size))
+
+
 def _get_args():
     '''
     Internal function. Creates an argparser for the main method to use.
@@ -202,28 +1009,30 @@ def _get_args():
     parser.add_argument(
         '-t',
         '--target-address',
-        required=True,
+        required=False,
         type=str,
-        default="",
+        default=None,
         help="Target end address to send the money to in the end. "
-        "Probably this should be the LibSubmarine contract address.")
+        "Probably this should be the LibSubmarine contract address. "
+        "Required unless --input is given.")
     parser.add_argument(
         '-f',
         '--from-address',
-        required=True,
+        required=False,
         type=str,
-        default="",
+        default=None,
         help=
         "From address that starts the submarine process. This should be an address "
-        "that you control.")
+        "that you control. Required unless --input is given.")
     parser.add_argument(
         '-a',
         '--amount',
-        required=True,
+        required=False,
         type=int,
-        default=0,
+        default=None,
         help=
-        "Amount of money you are sending through the submarine transaction in Wei."
+        "Amount of money you are sending through the submarine transaction in Wei. "
+        "Required unless --input is given."
     )
     parser.add_argument(
         '-d',
@@ -240,7 +1049,7 @@ def _get_args():
         '--gas-price',
         required=False,
         type=int,
-        default=50000000000,
+        default=DEFAULT_GAS_PRICE,
         help="Optional Gas price for TX Unlock transaction. Default is 50 GWei"
     )
     parser.add_argument(
@@ -248,9 +1057,41 @@ def _get_args():
         '--gas-limit',
         required=False,
         type=int,
-        default=3712394,
+        default=DEFAULT_GAS_LIMIT,
         help=
         "Optional Gas limit for TX Unlock transaction. Default is 3.7 million gas.")
+    parser.add_argument(
+        '-n',
+        '--sessions',
+        required=False,
+        type=int,
+        default=1,
+        help=
+        "Optional number of independent submarine sessions (each with its own "
+        "witness and commit address) to generate for these arguments. "
+        "Default is 1.")
+    parser.add_argument(
+        '-w',
+        '--workers',
+        required=False,
+        type=int,
+        default=None,
+        help=
+        "Optional number of worker processes to generate the sessions with. "
+        "Default is to generate them in this process.")
+    parser.add_argument(
+        '-i',
+        '--input',
+        required=False,
+        type=str,
+        default=None,
+        help=
+        "Optional file of commit requests, one JSON object per line, or - to "
+        "read them from stdin.\n"
+        "Keys: fromAddress, toAddress, sendAmount, dappData, gasPrice, gasLimit, "
+        "id (optional, copied to the result).\n"
+        "Missing keys are taken from the other arguments. One JSON result per "
+        "line is written to stdout, with an error key for invalid lines.")
     return parser.parse_args()
 
 
@@ -261,47 +1102,53 @@ def main():
 
     parser = _get_args()
 
-    if len(parser.target_address) != 42:
-        log.error(
-            "Target Address length does not appear to match the correct length of an Ethereum address"
-        )
-        sys.exit(1)
-    if len(parser.from_address) != 42:
-        log.error(
-            "From Address length does not appear to match the correct length of an Ethereum address"
-        )
+    if parser.sessions < 1:
+        log.error("Number of sessions must be at least 1")
         sys.exit(1)
-    if parser.target_address[0:2] != "0x":
-        log.error(
-            "Target address not in expected format, expected address to start with 0x"
-        )
-        sys.exit(1)
-    if parser.from_address[0:2] != "0x":
-        log.error(
-            "From address not in expected format, expected address to start with 0x"
-        )
+    if parser.workers is not None and parser.workers < 1:
+        log.error("Number of workers must be at least 1")
         sys.exit(1)
 
-    if not check_checksum(parser.target_address):
-        log.error(
-            "Target address is not correctly encoded using EIP-55 {}".format(
-                parser.target_address))
-        sys.exit(1)
-    if not check_checksum(parser.from_address):
-        log.error(
-            "From address is not correctly encoded using EIP-55 {}".format(
-                parser.from_address))
+    if parser.input is not None:
+        _streamMain(parser)
+        return
+
+    for option, value in (("--target-address", parser.target_address),
+                          ("--from-address", parser.from_address),
+                          ("--amount", parser.amount)):
+        if value is None:
+            log.error("{} is required unless --input is given".format(option))
+            sys.exit(1)
+
+    try:
+        toAddress = _parseAddress(parser.target_address, "Target")
+        fromAddress = _parseAddress(parser.from_address, "From")
+    except ValueError as e:
+        log.error(e)
         sys.exit(1)
 
-    toAddress = normalize_address(parser.target_address)
-    fromAddress = normalize_address(parser.from_address)
     gasPrice = parser.gas_price
     gasLimit = parser.gas_limit
     sendAmount = parser.amount
-    if (parser.dapp_data):
-        dappData = rec_bin(parser.dapp_data)
-    else:
-        dappData = b""
+    try:
+        dappData = _hexToBytes(parser.dapp_data)
+    except ValueError:
+        log.error("DApp data is not a hex string {}".format(parser.dapp_data))
+        sys.exit(1)
+
+    _importDependencies()
+
+    if parser.sessions > 1 or parser.workers is not None:
+        for addressB, commit, witness, txHex in zip(*generateCommitAddresses(
+                [(fromAddress, toAddress, sendAmount, dappData, gasPrice,
+                  gasLimit)] * parser.sessions,
+                workers=parser.workers)):
+            print("-" * 35)
+            print("AddressB: {}".format(addressB))
+            print("commit: {}".format(commit))
+            print("witness (w): {}".format(witness))
+            print("Reveal Transaction (hex): {}".format(txHex))
+        return
 
     tx, addressB, commit, randw = _generateAddressBInternal(
         fromAddress, toAddress, sendAmount, dappData, gasPrice, gasLimit)
@@ -321,5 +1168,35 @@ def main():
     )
 
 
+def _streamMain(parser):
+    '''
+    Internal function. Runs the --input mode of main.
+    '''
+    _importDependencies()
+
+    # stdout is for the results only
+    log.removeHandler(logHandler)
+    stderrHandler = logging.StreamHandler(stream=sys.stderr)
+    stderrHandler.setFormatter(logging.Formatter(LOGFORMAT))
+    log.addHandler(stderrHandler)
+
+    defaults = {"gasPrice": parser.gas_price, "gasLimit": parser.gas_limit}
+    for key, value in (("fromAddress", parser.from_address),
+                       ("toAddress", parser.target_address),
+                       ("sendAmount", parser.amount),
+                       ("dappData", parser.dapp_data or None)):
+        if value is not None:
+            defaults[key] = value
+
+    if parser.input == "-":
+        generated = streamCommitAddresses(sys.stdin, sys.stdout,
+                                          parser.workers, defaults)
+    else:
+        with open(parser.input) as lines:
+            generated = streamCommitAddresses(lines, sys.stdout,
+                                              parser.workers, defaults)
+    log.info("Generated {} submarine commits".format(generated))
+
+
 if __name__ == "__main__":
     main()
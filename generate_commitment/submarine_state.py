@@ -0,0 +1,99 @@
+'''
+Reads the state of many submarine sessions in one contract call, with
+LibSubmarineSimple.getSubmarineStates and revealedAndUnlockedMany, and decodes
+the packed results into columns (one list per field, one entry per
+submarine ID).
+'''
+import collections
+import logging
+import sys
+
+# Logging
+log = logging.getLogger('SubmarineState')
+LOGFORMAT = "%(levelname)s:%(filename)s:%(lineno)s:%(funcName)s(): %(message)s"
+log.setLevel(logging.getLevelName('INFO'))
+logHandler = logging.StreamHandler(stream=sys.stdout)
+logHandler.setFormatter(logging.Formatter(LOGFORMAT))
+log.addHandler(logHandler)
+
+# Submarine IDs per contract call by querySubmarineStates, so that a call
+# stays well within the gas limit nodes put on eth_call
+DEFAULT_QUERY_CHUNK_SIZE = 2048
+
+# (offset, bits) of every field in a word of getSubmarineStates, in the order
+# of getSubmarineState
+_STATE_FIELDS = (
+    ("amountRevealed", 0, 96),
+    ("amountUnlocked", 96, 96),
+    ("commitTxBlockNumber", 192, 32),
+    ("commitTxIndex", 224, 16),
+)
+
+# amountUnlocked of a session consumed by the DApp (a tombstone), with
+# amountRevealed zero, see LibSubmarineSimple.consumeSession
+CONSUMED_AMOUNT_UNLOCKED = 2**96 - 1
+
+# Columns of the state of many sessions, one list per field of
+# getSubmarineState
+SubmarineStates = collections.namedtuple(
+    'SubmarineStates', [name for name, _, _ in _STATE_FIELDS])
+
+
+def decodeSubmarineStates(packedStates):
+    '''
+    :param packedStates: result of getSubmarineStates, one int per
+        submarine ID
+    :return: SubmarineStates, in the order of packedStates
+    '''
+    return SubmarineStates(*([(state >> offset) & ((1 << bits) - 1)
+                              for state in packedStates]
+                             for _, offset, bits in _STATE_FIELDS))
+
+
+def decodeCompletedBitmap(bitmap, count):
+    '''
+    :param bitmap: result of revealedAndUnlockedMany, list of ints
+    :param count: number of submarine IDs it was called with
+    :return: list of count bools, revealedAndUnlocked of every submarine ID
+    '''
+    return [bool((bitmap[i // 256] >> (i % 256)) & 1) for i in range(count)]
+
+
+def consumedSessions(states):
+    '''
+    :param states: SubmarineStates
+    :return: list of bools, whether each session is consumed (see
+        LibSubmarineSimple.isConsumed)
+    '''
+    return [revealed == 0 and unlocked == CONSUMED_AMOUNT_UNLOCKED
+            for revealed, unlocked in zip(states.amountRevealed,
+                                          states.amountUnlocked)]
+
+
+def querySubmarineStates(contract,
+                         submarineIds,
+                         chunkSize=DEFAULT_QUERY_CHUNK_SIZE):
+    '''
+    Reads the state of many submarine sessions, with one getSubmarineStates
+    and one revealedAndUnlockedMany call per chunkSize submarine IDs.
+
+    :param contract: the contract, with its functions as methods, e.g. a
+        pyethereum tester ABIContract or contract.caller of a web3 contract
+    :param submarineIds: list of 32 byte submarine IDs
+    :return: SubmarineStates, list of revealedAndUnlocked bools, both in the
+        order of submarineIds
+    '''
+    columns = SubmarineStates(*([] for _ in _STATE_FIELDS))
+    completed = []
+    for start in range(0, len(submarineIds), chunkSize):
+        chunk = list(submarineIds[start:start + chunkSize])
+        for column, chunkColumn in zip(
+                columns,
+                decodeSubmarineStates(contract.getSubmarineStates(chunk))):
+            column.extend(chunkColumn)
+        completed.extend(
+            decodeCompletedBitmap(
+                contract.revealedAndUnlockedMany(chunk), len(chunk)))
+    log.info("Read the state of {} submarine sessions".format(
+        len(submarineIds)))
+    return columns, completed
@@ -0,0 +1,380 @@
+'''
+Checks a reveal off-chain before it is sent, the way
+LibSubmarineSimple.reveal does on-chain (proveth's txProof, or the trie proof
+of an attested block, and the requirements on the proven commit transaction
+and the unlock transaction), so that reveals that would revert are dropped
+before they cost gas.
+
+What depends on the state of the contract (whether the session was revealed
+already, which blocks are attested, the commit period, the 256 block limit of
+blockhash) is not checked: the attested transactions root is an argument.
+'''
+import collections
+import itertools
+import logging
+import sys
+
+import rlp
+from ethereum.utils import ecrecover_to_pub, sha3_256
+
+# Logging
+log = logging.getLogger('SubmarineRevealVerifier')
+LOGFORMAT = "%(levelname)s:%(filename)s:%(lineno)s:%(funcName)s(): %(message)s"
+log.setLevel(logging.getLevelName('INFO'))
+logHandler = logging.StreamHandler(stream=sys.stdout)
+logHandler.setFormatter(logging.Formatter(LOGFORMAT))
+log.addHandler(logHandler)
+
+# LibSubmarineSimple.vee
+UNLOCK_TX_V = 27
+
+# proof type of a transaction proof blob, see generate_reveal_proof
+PROOF_TYPE_TRANSACTION = 1
+
+# Index of the transactions root and block number in a block header
+_HEADER_TRANSACTIONS_ROOT = 4
+_HEADER_NUMBER = 8
+
+# Reveals per chunk handed to a worker process by verifyReveals
+DEFAULT_CHUNK_SIZE = 64
+
+# What reveal would store for a valid reveal
+VerifiedReveal = collections.namedtuple("VerifiedReveal", [
+    "submarineId", "submarineAddress", "amountRevealed",
+    "commitTxBlockNumber", "commitTxIndex"
+])
+
+
+class InvalidRevealError(ValueError):
+    '''
+    Raised for a reveal that LibSubmarineSimple.reveal would reject.
+    '''
+    pass
+
+
+def verifyReveal(blockHash,
+                 proofBlob,
+                 rlpUnlockTxUnsigned,
+                 witness,
+                 revealer,
+                 dappData=b'',
+                 contractAddress=None,
+                 transactionsRoot=None,
+                 commitTxBlockNumber=None):
+    '''
+    Checks the arguments of a reveal call like LibSubmarineSimple.reveal.
+    Raises InvalidRevealError, with the reason reveal would revert with, if
+    it would revert.
+
+    :param blockHash: hash of the block with the commit transaction
+        (blockhash(_commitTxBlockNumber) of reveal)
+    :param proofBlob: proof blob of the commit transaction, or its trie
+        proof [txIndex, stack] if the commit block is attested, see
+        generate_reveal_proof
+    :param rlpUnlockTxUnsigned: RLP encoded unsigned unlock transaction
+    :param witness: 32 byte witness
+    :param revealer: 20 byte address that sends the reveal (msg.sender,
+        addressA)
+    :param dappData: the embedded DApp data of the session
+    :param contractAddress: optional 20 byte address of the contract
+        (addressC). Unless given, the unlock transaction's to address is
+        trusted to be the contract.
+    :param transactionsRoot: optional attested transactions root of the
+        commit block (LibSubmarineSimple.attestedTransactionsRoots). A trie
+        proof is only accepted with it, as reveal does.
+    :param commitTxBlockNumber: optional block number of the commit block,
+        returned as commitTxBlockNumber for a trie proof, which does not
+        include the block header
+    :return: VerifiedReveal
+    '''
+    unlockTx = _decodeUnsignedTx(rlpUnlockTxUnsigned)
+    nonce, gasPrice, gasLimit, unlockTo, unlockValue = unlockTx
+    if nonce != 0:
+        raise InvalidRevealError("The unlock tx nonce is not 0")
+    if contractAddress is not None and unlockTo != contractAddress:
+        raise InvalidRevealError("The unlock tx is not sent to the contract")
+
+    # fullCommit = (addressA + addressC + aux(sendAmount) + dappData + w + aux(gasPrice) + aux(gasLimit))
+    submarineId = sha3_256(revealer + unlockTo + _aux(unlockValue) +
+                           dappData + witness + _aux(gasPrice) +
+                           _aux(gasLimit))
+
+    if _isTrieProof(proofBlob):
+        if transactionsRoot is None:
+            raise InvalidRevealError(
+                "The commit block is not attested, reveal with a proof blob")
+        commitTxIndex, commitTx = trieProof(transactionsRoot, proofBlob)
+    else:
+        commitTxBlockNumber, commitTxIndex, commitTx = txProof(
+            blockHash, proofBlob)
+    _, _, _, commitTo, commitValue, commitData = commitTx[:6]
+
+    if commitValue < unlockValue:
+        raise InvalidRevealError(
+            "The commit tx sends less than the unlock tx value")
+    if commitTo == b'':
+        raise InvalidRevealError("The commit tx is a contract creation")
+    if commitData != b'':
+        raise InvalidRevealError("The commit tx has data")
+
+    submarineAddress = _ecrecover(
+        sha3_256(rlpUnlockTxUnsigned), UNLOCK_TX_V,
+        _toInt(sha3_256(submarineId + b'\x01')),
+        _toInt(sha3_256(submarineId + b'\x00')))
+    if commitTo != submarineAddress:
+        raise InvalidRevealError(
+            "The commit tx is not sent to the submarine address")
+
+    return VerifiedReveal(submarineId, submarineAddress, unlockValue,
+                          commitTxBlockNumber, commitTxIndex)
+
+
+def txProof(blockHash, proofBlob):
+    '''
+    Checks a proof blob like proveth's txProof: it has to have exactly the
+    five items proveth encodes, the block header has to hash to blockHash, and the transaction trie proof has to lead from its
+    transactions root to a transaction at the proven index. Raises
+    InvalidRevealError otherwise.
+
+    :return: block number, transaction index, decoded transaction (list of
+        nonce, gasprice, startgas, to, value, data, v, r, s; the integers
+        decoded)
+    '''
+    try:
+        proof = rlp.decode(proofBlob)
+        # [kind, header, txIndex, stackIndexes, stack]
+        kind, header, txIndex, stackIndexes, stack = proof
+        kind, txIndex = _toInt(kind), _toInt(txIndex)
+        _toBytes(stackIndexes)
+    except (rlp.exceptions.DecodingError, ValueError, TypeError):
+        raise InvalidRevealError("The proof is invalid (not a proof blob)")
+    if kind != PROOF_TYPE_TRANSACTION:
+        raise InvalidRevealError("The proof is invalid (not a tx proof)")
+    if not isinstance(header, list) or len(header) <= _HEADER_NUMBER:
+        raise InvalidRevealError("The proof is invalid (not a block header)")
+    if sha3_256(rlp.encode(header)) != blockHash:
+        raise InvalidRevealError(
+            "The proof is invalid (header does not match the block hash)")
+
+    return (_toInt(header[_HEADER_NUMBER]), txIndex,
+            _provenTx(_toBytes(header[_HEADER_TRANSACTIONS_ROOT]), txIndex,
+                      stack))
+
+
+def trieProof(transactionsRoot, proof):
+    '''
+    Checks a trie proof [txIndex, stack] (generate_reveal_proof's
+    BlockProofs.trieProof) against the attested transactions root of its
+    block, like reveal does. Raises InvalidRevealError if it is invalid.
+
+    :return: transaction index, decoded transaction, see txProof
+    '''
+    try:
+        txIndex, stack = rlp.decode(proof)
+        txIndex = _toInt(txIndex)
+    except (rlp.exceptions.DecodingError, ValueError, TypeError):
+        raise InvalidRevealError("The proof is invalid (not a trie proof)")
+    return txIndex, _provenTx(_toBytes(transactionsRoot), txIndex, stack)
+
+
+def _isTrieProof(proof):
+    '''
+    Internal Function
+    Whether proof is a trie proof rather than a proof blob: reveal tells
+    them apart by their number of items.
+    '''
+    try:
+        decoded = rlp.decode(proof)
+    except rlp.exceptions.DecodingError:
+        return False
+    return isinstance(decoded, list) and len(decoded) == 2
+
+
+def _provenTx(rootHash, txIndex, stack):
+    '''
+    Internal Function
+    :return: the decoded transaction that stack proves to be at txIndex in
+        the transaction trie with rootHash, see txProof
+    '''
+    rlpTx = _validateMPTProof(rootHash, _nibbles(rlp.encode(txIndex)), stack)
+    if rlpTx is None:
+        raise InvalidRevealError(
+            "The proof is invalid (tx is not in the block)")
+    try:
+        tx = rlp.decode(rlpTx)
+    except rlp.exceptions.DecodingError:
+        raise InvalidRevealError("The proof is invalid (not a tx)")
+    if not isinstance(tx, list) or len(tx) != 9:
+        raise InvalidRevealError("The proof is invalid (not a tx)")
+    for field in (0, 1, 2, 4, 6, 7, 8):
+        tx[field] = _toInt(tx[field])
+    for field in (3, 5):
+        _toBytes(tx[field])
+    return tx
+
+
+def _validateMPTProof(rootHash, keyNibbles, stack):
+    '''
+    Internal Function
+    Follows keyNibbles from the node with rootHash through the nodes of
+    stack, each of which has to be the one the previous node refers to.
+
+    :return: the value stored at the key, or None if the proof shows that
+        there is none. Raises InvalidRevealError if the proof is broken.
+    '''
+    if not isinstance(stack, list) or not stack:
+        raise InvalidRevealError("The proof is invalid (empty stack)")
+    nodes = iter(stack)
+    node = next(nodes)
+    if not isinstance(node, list) or sha3_256(rlp.encode(node)) != rootHash:
+        raise InvalidRevealError(
+            "The proof is invalid (root node does not match)")
+
+    position = 0
+    while True:
+        if len(node) == 17:
+            if position == len(keyNibbles):
+                return _toBytes(node[16]) or None
+            reference = node[keyNibbles[position]]
+            position += 1
+        elif len(node) == 2:
+            path, isLeaf = _decodeHexPrefix(node[0])
+            if tuple(keyNibbles[position:position + len(path)]) != path:
+                return None
+            position += len(path)
+            if isLeaf:
+                return _toBytes(node[1]) if position == len(keyNibbles) else None
+            reference = node[1]
+        else:
+            raise InvalidRevealError(
+                "The proof is invalid (not a trie node)")
+
+        if reference == b'':
+            return None
+        if isinstance(reference, list):
+            # Nodes shorter than 32 bytes are embedded in their parent
+            node = reference
+            continue
+        node = next(nodes, None)
+        if not isinstance(node, list) or sha3_256(
+                rlp.encode(node)) != reference:
+            raise InvalidRevealError(
+                "The proof is invalid (node does not match its parent)")
+
+
+def _decodeHexPrefix(encodedPath):
+    '''
+    Internal Function
+    :return: path nibbles (tuple), whether the node is a leaf
+    '''
+    nibbles = _nibbles(_toBytes(encodedPath))
+    if not nibbles or nibbles[0] > 3:
+        raise InvalidRevealError("The proof is invalid (bad node path)")
+    flag = nibbles[0]
+    # odd length paths have their first nibble next to the flag
+    return tuple(nibbles[1 if flag & 1 else 2:]), flag >= 2
+
+
+def _nibbles(data):
+    return bytes(nibble for byte in data for nibble in (byte >> 4, byte & 0x0f))
+
+
+def _decodeUnsignedTx(rlpUnlockTxUnsigned):
+    '''
+    Internal Function
+    :return: nonce, gasPrice, gasLimit, to, value
+    '''
+    try:
+        unlockTx = rlp.decode(rlpUnlockTxUnsigned)
+    except rlp.exceptions.DecodingError:
+        unlockTx = None
+    if not isinstance(unlockTx, list) or len(unlockTx) != 6:
+        raise InvalidRevealError(
+            "The unlock tx is not an RLP encoded unsigned transaction")
+    return (_toInt(unlockTx[0]), _toInt(unlockTx[1]), _toInt(unlockTx[2]),
+            _toBytes(unlockTx[3]), _toInt(unlockTx[4]))
+
+
+def _ecrecover(messageHash, V, R, S):
+    '''
+    Internal Function
+    Same as Solidity's ecrecover: the 20 byte address, or 20 zero bytes if
+    none can be recovered.
+    '''
+    try:
+        pub = ecrecover_to_pub(messageHash, V, R, S)
+    except ValueError:
+        pub = b'\x00' * 64
+    if pub == b'\x00' * 64:
+        return b'\x00' * 20
+    return sha3_256(pub)[-20:]
+
+
+def _aux(x):
+    return x.to_bytes(32, byteorder='big')
+
+
+def _toInt(data):
+    return int.from_bytes(_toBytes(data), byteorder='big')
+
+
+def _toBytes(item):
+    '''
+    Internal Function
+    Checks that a decoded RLP item is a string, not a list, as reveal's RLP
+    decoding does. Raises InvalidRevealError if not.
+    '''
+    if not isinstance(item, bytes):
+        raise InvalidRevealError("Malformed RLP (expected a string, not a list)")
+    return item
+
+
+def verifyReveals(reveals, workers=None, chunkSize=DEFAULT_CHUNK_SIZE):
+    '''
+    Checks many reveals, see verifyReveal.
+
+    :param reveals: iterable of tuples of verifyReveal arguments
+    :param workers: optional number of worker processes to check the reveals
+        in, in chunks of chunkSize reveals
+    :return: list of (VerifiedReveal, None) for a valid reveal and (None,
+        error message) for an invalid one, in the order of reveals
+    '''
+    if workers is not None and workers > 1:
+        from concurrent.futures import ProcessPoolExecutor
+        results = []
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            for chunkResults in executor.map(_verifyRevealsChunk,
+                                             _chunks(reveals, chunkSize)):
+                results.extend(chunkResults)
+    else:
+        results = _verifyRevealsChunk(reveals)
+
+    invalid = sum(1 for _, error in results if error is not None)
+    log.info("Verified {} reveals, {} invalid".format(len(results), invalid))
+    return results
+
+
+def _verifyRevealsChunk(reveals):
+    '''
+    Internal Function
+    Does the work of verifyReveals in the current process.
+    '''
+    results = []
+    for reveal in reveals:
+        try:
+            results.append((verifyReveal(*reveal), None))
+        except InvalidRevealError as e:
+            results.append((None, str(e)))
+    return results
+
+
+def _chunks(iterable, size):
+    '''
+    Internal Function
+    Splits iterable into lists of at most size items, keeping their order.
+    '''
+    iterator = iter(iterable)
+    chunk = list(itertools.islice(iterator, size))
+    while chunk:
+        yield chunk
+        chunk = list(itertools.islice(iterator, size))
@@ -0,0 +1,252 @@
+'''
+Incremental build of the Solidity contracts under contracts/.
+
+Every source unit (a .sol file, named by its path relative to contracts/, as
+the tests name them, e.g. 'examples/exchange/Exchange.sol') is compiled
+together with the sources it imports, transitively, and its contracts' ABI and
+bytecode are written to build/contracts/<source unit>.json. A unit is only
+compiled again if one of those sources, the solc version or the settings
+changed since its artifact was written.
+
+    python3 test/build_contracts.py [source unit ...]
+
+builds the given source units, default is every source unit under contracts/
+outside of the proveth and openzeppelin-solidity submodules.
+'''
+import argparse
+import hashlib
+import json
+import logging
+import os
+import re
+import sys
+import tempfile
+import time
+
+root_repo_dir = os.path.abspath(os.path.join(os.path.dirname(__file__), '../'))
+CONTRACTS_DIR = os.path.join(root_repo_dir, 'contracts')
+BUILD_DIR = os.path.join(root_repo_dir, 'build', 'contracts')
+
+# Not built by default: libraries, built as far as the contracts use them
+SUBMODULE_DIRS = ('proveth', 'openzeppelin-solidity')
+
+SOLC_SETTINGS = {
+    'evmVersion': 'byzantium',
+    'outputSelection': {'*': {'*': ['abi', 'evm.bytecode']}},
+}
+
+IMPORT_RE = re.compile(r'^\s*import\s+(?:[^"\']*\bfrom\s+)?["\']([^"\']+)["\']', re.M)
+
+log = logging.getLogger('BuildContracts')
+LOGFORMAT = "%(levelname)s:%(filename)s:%(lineno)s:%(funcName)s(): %(message)s"
+log.setLevel(logging.getLevelName('INFO'))
+logHandler = logging.StreamHandler(stream=sys.stdout)
+logHandler.setFormatter(logging.Formatter(LOGFORMAT))
+log.addHandler(logHandler)
+
+
+class ContractBuild(object):
+    '''The import graph of the source units under contracts_dir, and their
+    artifacts in build_dir.
+
+    Sources are read once per ContractBuild: create a new one to see
+    changes made to the sources after that.
+    '''
+
+    def __init__(self, contracts_dir=CONTRACTS_DIR, build_dir=BUILD_DIR,
+                 readonly=False):
+        '''readonly: never write artifacts, e.g. in test processes that use
+        the artifacts a parent process built (see run_tests.py). Out of date
+        units are still compiled, but only kept in memory.
+        '''
+        self.contracts_dir = contracts_dir
+        self.build_dir = build_dir
+        self.readonly = readonly
+        self._contents = {}
+        self._imports = {}
+        self._artifacts = {}
+        self._solc_version = None
+        # Source units compiled by this ContractBuild, in order
+        self.compiled = []
+
+    def source_units(self):
+        '''Source units built by default, see the module documentation.'''
+        units = []
+        for directory, subdirectories, files in os.walk(self.contracts_dir):
+            if directory == self.contracts_dir:
+                subdirectories[:] = [
+                    subdirectory for subdirectory in subdirectories
+                    if subdirectory not in SUBMODULE_DIRS
+                ]
+            for name in files:
+                if name.endswith('.sol'):
+                    units.append(self.unit_name(os.path.join(directory, name)))
+        return sorted(units)
+
+    def unit_name(self, path):
+        return os.path.relpath(path, self.contracts_dir).replace(os.sep, '/')
+
+    def path(self, unit):
+        return os.path.join(self.contracts_dir, *unit.split('/'))
+
+    def contents(self, unit):
+        '''Contents of a source unit, b'' if it does not exist.'''
+        if unit not in self._contents:
+            try:
+                with open(self.path(unit), 'rb') as source_file:
+                    self._contents[unit] = source_file.read()
+            except IOError:
+                self._contents[unit] = b''
+        return self._contents[unit]
+
+    def imports(self, unit):
+        '''Source units that unit imports directly. Imports starting with a
+        dot are relative to the importing unit, others to contracts_dir.
+        '''
+        if unit not in self._imports:
+            imports = []
+            source = self.contents(unit).decode('utf-8', 'replace')
+            for imported in IMPORT_RE.findall(source):
+                if imported.startswith('.'):
+                    imported = os.path.normpath(
+                        os.path.join(os.path.dirname(unit), imported))
+                imports.append(imported.replace(os.sep, '/'))
+            self._imports[unit] = imports
+        return self._imports[unit]
+
+    def dependencies(self, unit):
+        '''unit and every source unit it imports, transitively, sorted.'''
+        dependencies = set()
+        pending = [unit]
+        while pending:
+            current = pending.pop()
+            if current not in dependencies:
+                dependencies.add(current)
+                pending.extend(self.imports(current))
+        return sorted(dependencies)
+
+    def source_hash(self, unit):
+        '''Hex sha256 of the solc version, the settings and the contents of
+        the dependencies of unit: the artifact of unit is up to date if it
+        was built from the same source hash.
+        '''
+        source_hash = hashlib.sha256()
+        source_hash.update(
+            json.dumps([self.solc_version(), SOLC_SETTINGS],
+                       sort_keys=True).encode())
+        for dependency in self.dependencies(unit):
+            source_hash.update(json.dumps(dependency).encode())
+            source_hash.update(
+                hashlib.sha256(self.contents(dependency)).digest())
+        return source_hash.hexdigest()
+
+    def solc_version(self):
+        '''Version string of the solc that compiles the artifacts.'''
+        if self._solc_version is None:
+            from solc import get_solc_version_string
+            self._solc_version = get_solc_version_string()
+        return self._solc_version
+
+    def artifact_path(self, unit):
+        return os.path.join(self.build_dir, *unit.split('/')) + '.json'
+
+    def artifact(self, unit):
+        '''The artifact of unit, built first if it is missing or out of date:
+        {'sourceHash': ..., 'sources': [dependencies],
+        'contracts': {contract name: {'abi': [...], 'bytecode': hex}}}
+        '''
+        source_hash = self.source_hash(unit)
+        artifact = self._artifacts.get(unit)
+        if artifact is not None and artifact['sourceHash'] == source_hash:
+            return artifact
+        try:
+            with open(self.artifact_path(unit)) as artifact_file:
+                artifact = json.load(artifact_file)
+        except (IOError, ValueError):
+            artifact = None
+        if artifact is None or artifact.get('sourceHash') != source_hash:
+            artifact = self.compile(unit, source_hash)
+            self.compiled.append(unit)
+            if not self.readonly:
+                write_json_atomically(self.artifact_path(unit), artifact)
+        self._artifacts[unit] = artifact
+        return artifact
+
+    def compile(self, unit, source_hash):
+        from solc import compile_standard
+        start = time.time()
+        sources = self.dependencies(unit)
+        # solc gets the contents that source_hash hashed, so it never reads
+        # (or resolves imports against) the file system
+        compiled = compile_standard({
+            'language': 'Solidity',
+            'sources': {
+                source: {'content': self.contents(source).decode('utf-8')}
+                for source in sources
+            },
+            'settings': SOLC_SETTINGS,
+        })
+        contracts = {
+            name: {
+                'abi': output['abi'],
+                'bytecode': output['evm']['bytecode']['object'],
+            }
+            for name, output in compiled['contracts'].get(unit, {}).items()
+        }
+        log.info("Compiled {} ({} sources) in {:.2f}s".format(
+            unit, len(sources), time.time() - start))
+        return {
+            'sourceHash': source_hash,
+            'sources': sources,
+            'contracts': contracts,
+        }
+
+    def build(self, units=None):
+        '''Brings the artifacts of units (default: source_units()) up to date.
+
+        :return: list of the units that were compiled
+        '''
+        already_compiled = len(self.compiled)
+        for unit in units or self.source_units():
+            self.artifact(unit)
+        return self.compiled[already_compiled:]
+
+
+def write_json_atomically(path, obj):
+    '''Writes obj to path so that readers (other test processes) never see
+    a partly written file.'''
+    directory = os.path.dirname(path)
+    os.makedirs(directory, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=directory, suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'w') as tmp_file:
+            json.dump(obj, tmp_file)
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
+
+
+def _get_args():
+    parser = argparse.ArgumentParser(
+        description="Compiles the contracts whose sources changed")
+    parser.add_argument(
+        'units',
+        nargs='*',
+        help="Source units to build, relative to contracts/, e.g. "
+        "examples/exchange/Exchange.sol. Default is every source unit "
+        "outside of the submodules.")
+    return parser.parse_args()
+
+
+def main():
+    args = _get_args()
+    contract_build = ContractBuild()
+    units = args.units or contract_build.source_units()
+    compiled = contract_build.build(units)
+    log.info("{} of {} source units were out of date".format(
+        len(compiled), len(units)))
+
+
+if __name__ == "__main__":
+    main()
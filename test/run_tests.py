@@ -0,0 +1,157 @@
+'''
+Runs the test suite in parallel worker processes.
+
+The tests of every module are split into shards, round robin, and each shard
+runs in its own python process (so its own tester chains and its own
+ChainFixtureTestCase set up). Before starting the workers, the contracts of
+every ChainFixtureTestCase are built once (see build_contracts); the workers
+only read the build artifacts.
+
+    python3 test/run_tests.py [-w WORKERS] [test_module ...]
+'''
+import argparse
+import glob
+import logging
+import os
+import re
+import subprocess
+import sys
+import time
+import unittest
+
+TEST_DIR = os.path.dirname(os.path.abspath(__file__))
+
+log = logging.getLogger('RunTests')
+LOGFORMAT = "%(levelname)s:%(filename)s:%(lineno)s:%(funcName)s(): %(message)s"
+log.setLevel(logging.getLevelName('INFO'))
+logHandler = logging.StreamHandler(stream=sys.stdout)
+logHandler.setFormatter(logging.Formatter(LOGFORMAT))
+log.addHandler(logHandler)
+
+# Run on their own after the others: they measure wall clock time
+SERIAL_MODULES = ("test_ImportTime", )
+
+
+def test_modules():
+    '''Names of all test modules in the test directory.'''
+    return sorted(
+        os.path.splitext(os.path.basename(path))[0]
+        for path in glob.glob(os.path.join(TEST_DIR, "test_*.py"))
+        if os.path.basename(path) != "test_utils.py")
+
+
+def build_fixture_contracts(suite):
+    '''Sets up the chain of every ChainFixtureTestCase of the suite once, so
+    that all the contracts the tests deploy are built (or found up to date)
+    before the workers, which only read the build artifacts, start.
+    '''
+    import test_utils
+    classes = []
+    for test in iter_tests(suite):
+        if (isinstance(test, test_utils.ChainFixtureTestCase)
+                and type(test) not in classes):
+            classes.append(type(test))
+    for cls in classes:
+        start = time.time()
+        cls.setUpClass()
+        cls.tearDownClass()
+        log.info("Built and deployed {} fixtures in {:.2f}s".format(
+            cls.__name__,
+            time.time() - start))
+
+
+def iter_tests(suite):
+    '''All tests of a (nested) unittest suite, in order.'''
+    for test in suite:
+        if isinstance(test, unittest.TestSuite):
+            yield from iter_tests(test)
+        else:
+            yield test
+
+
+def shards(ids, workers):
+    '''Splits ids round robin into at most workers non-empty shards.'''
+    return [shard for shard in (ids[i::workers] for i in range(workers))
+            if shard]
+
+
+def start_shard(ids):
+    env = dict(os.environ, SUBMARINE_CONTRACT_BUILD_READONLY="1")
+    return subprocess.Popen(
+        [sys.executable, "-m", "unittest"] + ids,
+        cwd=TEST_DIR,
+        env=env,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.STDOUT)
+
+
+def run_shards(shard_ids):
+    '''Runs the shards at the same time.
+
+    :return: list of (exit code, output) per shard
+    '''
+    processes = [start_shard(ids) for ids in shard_ids]
+    results = []
+    for process in processes:
+        output, _ = process.communicate()
+        results.append((process.returncode, output.decode(errors="replace")))
+    return results
+
+
+def _get_args():
+    parser = argparse.ArgumentParser(
+        description="Runs the tests in parallel worker processes")
+    parser.add_argument(
+        '-w',
+        '--workers',
+        type=int,
+        default=os.cpu_count() or 1,
+        help="Number of worker processes. Default is the number of CPUs.")
+    parser.add_argument(
+        'modules',
+        nargs='*',
+        help="Test modules to run, e.g. test_LibSubmarineSimple. "
+        "Default is all of them.")
+    return parser.parse_args()
+
+
+def main():
+    args = _get_args()
+    if args.workers < 1:
+        log.error("Number of workers must be at least 1")
+        sys.exit(1)
+    sys.path.insert(0, TEST_DIR)
+    modules = args.modules or test_modules()
+
+    start = time.time()
+    suite = unittest.defaultTestLoader.loadTestsFromNames(modules)
+    tests = list(iter_tests(suite))
+    # Modules that failed to import fail here, not in every worker
+    broken = [test for test in tests if test.id().startswith("unittest.")]
+    failed = bool(broken)
+    if broken:
+        unittest.TextTestRunner().run(unittest.TestSuite(broken))
+    build_fixture_contracts(suite)
+
+    ids = [test.id() for test in tests if test not in broken]
+    parallel = [i for i in ids if i.split(".")[0] not in SERIAL_MODULES]
+    serial = [i for i in ids if i.split(".")[0] in SERIAL_MODULES]
+    results = run_shards(shards(parallel, args.workers))
+    if serial:
+        results += run_shards([serial])
+
+    for returncode, output in results:
+        if returncode != 0:
+            failed = True
+            sys.stdout.write(output)
+    ran = sum(
+        int(match) for _, output in results
+        for match in re.findall(r"^Ran (\d+) tests? in", output, re.M))
+    log.info("Ran {} tests in {} shards in {:.2f}s: {}".format(
+        ran, len(results),
+        time.time() - start, "FAILED" if failed else "OK"))
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
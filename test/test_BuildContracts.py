@@ -0,0 +1,147 @@
+import os
+import shutil
+import tempfile
+import unittest
+from build_contracts import ContractBuild
+
+LIB_SOURCE = '''pragma solidity ^0.5.0;
+
+library Lib {
+    function twice(uint256 x) internal pure returns (uint256) {
+        return 2 * x;
+    }
+}
+'''
+
+MAIN_SOURCE = '''pragma solidity ^0.5.0;
+
+import "./Lib.sol";
+
+contract Main {
+    function twice(uint256 x) public pure returns (uint256) {
+        return Lib.twice(x);
+    }
+}
+'''
+
+OTHER_SOURCE = '''pragma solidity ^0.5.0;
+
+contract Other {
+}
+'''
+
+
+class UncompiledBuild(ContractBuild):
+    '''ContractBuild whose artifacts have no contracts: the cache tests only
+    look at which units are compiled, so they run without solc.'''
+
+    def solc_version(self):
+        return '0.5.0+test'
+
+    def compile(self, unit, source_hash):
+        return {
+            'sourceHash': source_hash,
+            'sources': self.dependencies(unit),
+            'contracts': {},
+        }
+
+
+class TestBuildContracts(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.contracts_dir = os.path.join(self.tmp_dir, 'contracts')
+        self.build_dir = os.path.join(self.tmp_dir, 'build')
+        os.makedirs(self.contracts_dir)
+        self.write_source('Lib.sol', LIB_SOURCE)
+        self.write_source('Main.sol', MAIN_SOURCE)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def write_source(self, unit, source):
+        with open(os.path.join(self.contracts_dir, unit), 'w') as source_file:
+            source_file.write(source)
+
+    def contract_build(self, readonly=False, build_class=UncompiledBuild):
+        return build_class(contracts_dir=self.contracts_dir,
+                           build_dir=self.build_dir,
+                           readonly=readonly)
+
+    def test_dependencies(self):
+        contract_build = self.contract_build()
+        self.assertListEqual(['Lib.sol', 'Main.sol'],
+                             contract_build.source_units())
+        self.assertListEqual(['Lib.sol', 'Main.sol'],
+                             contract_build.dependencies('Main.sol'))
+        self.assertListEqual(['Lib.sol'],
+                             contract_build.dependencies('Lib.sol'))
+
+    def test_cache_hit(self):
+        # Cold: every source unit is compiled once
+        first_build = self.contract_build()
+        self.assertListEqual(['Lib.sol', 'Main.sol'], first_build.build())
+        artifact = first_build.artifact('Main.sol')
+        self.assertListEqual(['Lib.sol', 'Main.sol'], artifact['sources'])
+        self.assertTrue(os.path.isfile(first_build.artifact_path('Main.sol')))
+
+        # Second build in the same process: in memory hit
+        self.assertListEqual([], first_build.build())
+        self.assertListEqual(['Lib.sol', 'Main.sol'], first_build.compiled)
+
+        # Second build in a new process: on disk hit, solc is not invoked
+        second_build = self.contract_build()
+        self.assertListEqual([], second_build.build())
+        self.assertDictEqual(artifact, second_build.artifact('Main.sol'))
+        self.assertListEqual([], second_build.compiled)
+
+    def test_dependency_change(self):
+        self.contract_build().build()
+
+        # Touching an imported source compiles the units that import it
+        self.write_source('Lib.sol', LIB_SOURCE.replace('2 * x', 'x + x'))
+        self.assertListEqual(['Lib.sol', 'Main.sol'],
+                             self.contract_build().build())
+
+        # A source no one imports only compiles itself
+        self.write_source('Other.sol', OTHER_SOURCE)
+        self.assertListEqual(['Other.sol'], self.contract_build().build())
+
+        # Warm: nothing is compiled
+        self.assertListEqual([], self.contract_build().build())
+
+    def test_solc_version(self):
+        # Artifacts of another solc version are out of date
+        self.contract_build().build()
+
+        class OtherSolcBuild(UncompiledBuild):
+            def solc_version(self):
+                return '0.5.1+test'
+
+        self.assertListEqual(
+            ['Lib.sol', 'Main.sol'],
+            self.contract_build(build_class=OtherSolcBuild).build())
+
+    def test_compile(self):
+        # Needs solc
+        contract_build = self.contract_build(build_class=ContractBuild)
+        self.assertListEqual(['Main.sol'], contract_build.build(['Main.sol']))
+        contracts = contract_build.artifact('Main.sol')['contracts']
+        self.assertListEqual(['Main'], sorted(contracts))
+        self.assertTrue(contracts['Main']['bytecode'])
+        self.assertIn('twice',
+                      [entry.get('name') for entry in contracts['Main']['abi']])
+
+    def test_readonly(self):
+        self.contract_build().build()
+        self.write_source('Lib.sol', LIB_SOURCE.replace('2 * x', 'x + x'))
+
+        # A readonly build compiles out of date units, but only in memory
+        readonly_build = self.contract_build(readonly=True)
+        self.assertListEqual(['Main.sol'], readonly_build.build(['Main.sol']))
+        self.assertListEqual([], readonly_build.build(['Main.sol']))
+        self.assertListEqual(['Main.sol'],
+                             self.contract_build().build(['Main.sol']))
+
+
+if __name__ == "__main__":
+    unittest.main()
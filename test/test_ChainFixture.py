@@ -0,0 +1,57 @@
+import unittest
+from ethereum.tools import tester as t
+from test_utils import ChainFixtureTestCase
+
+# Counter contract: every call adds 1 to storage slot 0
+# PUSH1 0 SLOAD PUSH1 1 ADD PUSH1 0 SSTORE STOP
+COUNTER_RUNTIME = bytes.fromhex('60005460010160005500')
+# PUSH1 10 PUSH1 12 PUSH1 0 CODECOPY PUSH1 10 PUSH1 0 RETURN, then the runtime
+COUNTER_INIT = bytes.fromhex('600a600c600039600a6000f3') + COUNTER_RUNTIME
+SEND_AMOUNT = 12345
+
+
+class TestChainFixture(ChainFixtureTestCase):
+    # Every test checks that it starts from the set up chain, then changes
+    # the chain, mining blocks: whichever test runs second fails if the
+    # changes of the first one leak into it.
+
+    @classmethod
+    def set_up_chain(cls, chain):
+        cls.counter = chain.contract(COUNTER_INIT, language='evm')
+        chain.mine(2)
+        cls.fixture_block_number = chain.block.number
+        cls.fixture_balance = chain.head_state.get_balance(t.a2)
+        return {}
+
+    def assert_fixture_state(self, chain):
+        self.assertEqual(COUNTER_RUNTIME, chain.head_state.get_code(self.counter))
+        self.assertEqual(0, chain.head_state.get_storage_data(self.counter, 0))
+        self.assertEqual(self.fixture_block_number, chain.block.number)
+        self.assertEqual(self.fixture_balance,
+                         chain.head_state.get_balance(t.a2))
+
+    def change_chain(self):
+        self.chain.tx(sender=t.k1, to=self.counter, value=0, data=b'')
+        self.chain.tx(sender=t.k1, to=t.a2, value=SEND_AMOUNT, data=b'')
+        self.chain.mine(5)
+        self.assertEqual(1, self.chain.head_state.get_storage_data(
+            self.counter, 0))
+        self.assertEqual(self.fixture_balance + SEND_AMOUNT,
+                         self.chain.head_state.get_balance(t.a2))
+
+    def test_isolation_first(self):
+        self.assert_fixture_state(self.chain)
+        self.change_chain()
+
+    def test_isolation_second(self):
+        self.assert_fixture_state(self.chain)
+        self.change_chain()
+
+    def test_fixture_chain_unchanged(self):
+        self.change_chain()
+        self.assertIsNot(self.fixture_chain, self.chain)
+        self.assert_fixture_state(self.fixture_chain)
+
+
+if __name__ == "__main__":
+    unittest.main()
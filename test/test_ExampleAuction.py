@@ -6,7 +6,7 @@ import unittest
 from ethereum import config, transactions
 from ethereum.tools import tester as t
 from ethereum.utils import checksum_encode, normalize_address, sha3
-from test_utils import rec_hex, rec_bin, deploy_solidity_contract_with_args
+from test_utils import rec_hex, rec_bin, deploy_contract, ChainFixtureTestCase
 from eth_abi.packed import encode_single_packed
 
 sys.path.append(
@@ -17,8 +17,6 @@ sys.path.append(
     os.path.join(os.path.dirname(__file__), '..', 'proveth', 'offchain'))
 import proveth
 
-root_repo_dir = os.path.abspath(os.path.join(os.path.dirname(__file__), '../'))
-
 COMMIT_PERIOD_LENGTH = 20
 REVEAL_PERIOD_LENGTH = 256 # hardcoded in the auction contract...
 # internet points to you if you can figure out the references in these amounts
@@ -50,107 +48,31 @@ logHandler.setFormatter(logging.Formatter(LOGFORMAT))
 log.addHandler(logHandler)
 
 
-class TestExampleAuction(unittest.TestCase):
-    def setUp(self):
-        config.config_metropolis['BLOCK_GAS_LIMIT'] = 2**60
-        self.chain = t.Chain(env=config.Env(config=config.config_metropolis))
-        self.chain.mine(1)
-        contract_dir = os.path.abspath(
-            os.path.join(root_repo_dir, 'contracts/'))
-        os.chdir(root_repo_dir)
-
-        self.erc721_contract = deploy_solidity_contract_with_args(
-            chain=self.chain,
-            solc_config_sources={
-                'openzeppelin-solidity/contracts/token/ERC721/ERC721Mintable.sol': {
-                    'urls':
-                    [os.path.join(contract_dir, 'openzeppelin-solidity/contracts/token/ERC721/ERC721Mintable.sol')]
-                },
-                'openzeppelin-solidity/contracts/access/roles/MinterRole.sol': {
-                    'urls':
-                    [os.path.join(contract_dir, 'openzeppelin-solidity/contracts/access/roles/MinterRole.sol')]
-                },
-                'openzeppelin-solidity/contracts/access/Roles.sol': {
-                    'urls':
-                    [os.path.join(contract_dir, 'openzeppelin-solidity/contracts/access/Roles.sol')]
-                },
-                'openzeppelin-solidity/contracts/token/ERC721/ERC721.sol': {
-                    'urls':
-                    [os.path.join(contract_dir, 'openzeppelin-solidity/contracts/token/ERC721/ERC721.sol')]
-                },
-                'openzeppelin-solidity/contracts/token/ERC721/IERC721.sol': {
-                    'urls':
-                    [os.path.join(contract_dir, 'openzeppelin-solidity/contracts/token/ERC721/IERC721.sol')]
-                },
-                'openzeppelin-solidity/contracts/token/ERC721/IERC721Receiver.sol': {
-                    'urls':
-                    [os.path.join(contract_dir, 'openzeppelin-solidity/contracts/token/ERC721/IERC721Receiver.sol')]
-                },
-                'openzeppelin-solidity/contracts/math/SafeMath.sol': {
-                    'urls':
-                    [os.path.join(contract_dir, 'openzeppelin-solidity/contracts/math/SafeMath.sol')]
-                },
-                'openzeppelin-solidity/contracts/utils/Address.sol': {
-                    'urls':
-                    [os.path.join(contract_dir, 'openzeppelin-solidity/contracts/utils/Address.sol')]
-                },
-                'openzeppelin-solidity/contracts/introspection/IERC165.sol': {
-                    'urls':
-                    [os.path.join(contract_dir, 'openzeppelin-solidity/contracts/introspection/IERC165.sol')]
-                },
-                'openzeppelin-solidity/contracts/introspection/ERC165.sol': {
-                    'urls':
-                    [os.path.join(contract_dir, 'openzeppelin-solidity/contracts/introspection/ERC165.sol')]
-                }
-            },
-            allow_paths=root_repo_dir,
+class TestExampleAuction(ChainFixtureTestCase):
+    @classmethod
+    def set_up_chain(cls, chain):
+        chain.mine(1)
+        erc721_contract = deploy_contract(
+            chain=chain,
             contract_file='openzeppelin-solidity/contracts/token/ERC721/ERC721Mintable.sol',
             contract_name='ERC721Mintable',
             startgas=10**7,
             args=[],
             contract_creator=CONTRACT_OWNER_PRIVATE_KEY)
-        self.erc721_contract.mint(CONTRACT_OWNER_ADDRESS, TOKEN_ID, sender=CONTRACT_OWNER_PRIVATE_KEY)
-
-        self.auction_contract = deploy_solidity_contract_with_args(
-            chain=self.chain,
-            solc_config_sources={
-                'examples/erc721_auction/ERC721AuctionSubmarine.sol': {
-                    'urls':
-                    [os.path.join(contract_dir, 'examples/erc721_auction/ERC721AuctionSubmarine.sol')]
-                },
-                'LibSubmarineSimple.sol': {
-                    'urls':
-                    [os.path.join(contract_dir, 'LibSubmarineSimple.sol')]
-                },
-                'openzeppelin-solidity/contracts/math/SafeMath.sol': {
-                    'urls': [os.path.join(contract_dir, 'openzeppelin-solidity/contracts/math/SafeMath.sol')]
-                },
-                'proveth/ProvethVerifier.sol': {
-                    'urls': [
-                        os.path.join(contract_dir,
-                                     'proveth/ProvethVerifier.sol')
-                    ]
-                },
-                'proveth/RLP.sol': {
-                    'urls': [os.path.join(contract_dir, 'proveth/RLP.sol')]
-                },
-                'openzeppelin-solidity/contracts/token/ERC721/IERC721.sol': {
-                    'urls': [os.path.join(contract_dir, 'openzeppelin-solidity/contracts/token/ERC721/IERC721.sol')]
-                },
-                'openzeppelin-solidity/contracts/token/ERC721/IERC721Receiver.sol': {
-                    'urls': [os.path.join(contract_dir, 'openzeppelin-solidity/contracts/token/ERC721/IERC721Receiver.sol')]
-                },
-                'openzeppelin-solidity/contracts/introspection/IERC165.sol': {
-                    'urls': [os.path.join(contract_dir, 'openzeppelin-solidity/contracts/introspection/IERC165.sol')]
-                }
-            },
-            allow_paths=root_repo_dir,
+        erc721_contract.mint(CONTRACT_OWNER_ADDRESS, TOKEN_ID, sender=CONTRACT_OWNER_PRIVATE_KEY)
+
+        auction_contract = deploy_contract(
+            chain=chain,
             contract_file='examples/erc721_auction/ERC721AuctionSubmarine.sol',
             contract_name='ERC721Auction',
             startgas=10**7,
             args=[],
             contract_creator=CONTRACT_OWNER_PRIVATE_KEY)
-        self.chain.mine(1)
+        chain.mine(1)
+        return {
+            'erc721_contract': erc721_contract,
+            'auction_contract': auction_contract,
+        }
 
     def test_auctionWorkflow(self):
         ##
@@ -646,6 +568,19 @@ class TestExampleAuction(unittest.TestCase):
 
         self.assertEqual(starting_owner_eth_holdings + BID_AMOUNT_Charlie, self.chain.head_state.get_balance(rec_hex(CONTRACT_OWNER_ADDRESS)))
 
+        # The finalized sessions are consumed, their bidders deleted, and
+        # they can't be finalized again
+        for commit, private_key in ((commitAlice, ALICE_PRIVATE_KEY),
+                                    (commitBob, BOB_PRIVATE_KEY),
+                                    (commitCharlie, CHARLIE_PRIVATE_KEY)):
+            self.assertTrue(self.auction_contract.isConsumed(rec_bin(commit)))
+            self.assertFalse(self.auction_contract.revealedAndUnlocked(rec_bin(commit)))
+            self.assertEqual(
+                rec_hex(b'\x00' * 20),
+                self.auction_contract.bidders(rec_bin(commit)))
+            with self.assertRaises(t.TransactionFailed):
+                self.auction_contract.finalize(rec_bin(commit), sender=private_key)
+
 
 if __name__ == "__main__":
     unittest.main()
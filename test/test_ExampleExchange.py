@@ -6,7 +6,7 @@ import unittest
 from ethereum import config, transactions
 from ethereum.tools import tester as t
 from ethereum.utils import checksum_encode, normalize_address, sha3
-from test_utils import rec_hex, rec_bin, deploy_solidity_contract_with_args, proveth_compatible_commit_block
+from test_utils import rec_hex, rec_bin, deploy_contract, proveth_compatible_commit_block, ChainFixtureTestCase
 
 sys.path.append(
     os.path.join(os.path.dirname(__file__), '..', 'generate_commitment'))
@@ -16,8 +16,6 @@ sys.path.append(
     os.path.join(os.path.dirname(__file__), '..', 'proveth', 'offchain'))
 import proveth
 
-root_repo_dir = os.path.abspath(os.path.join(os.path.dirname(__file__), '../'))
-
 COMMIT_PERIOD_LENGTH = 5
 TOTAL_TOKEN_SUPPLY = 1000*10**18
 TOKEN_AMOUNT_STARTING = 1337000000000000000
@@ -50,77 +48,32 @@ logHandler.setFormatter(logging.Formatter(LOGFORMAT))
 log.addHandler(logHandler)
 
 
-class TestExampleAuction(unittest.TestCase):
-    def setUp(self):
-        config.config_metropolis['BLOCK_GAS_LIMIT'] = 2**60
-        self.chain = t.Chain(env=config.Env(config=config.config_metropolis))
-        self.chain.mine(1)
-        contract_dir = os.path.abspath(
-            os.path.join(root_repo_dir, 'contracts/'))
-        os.chdir(root_repo_dir)
-        self.token_contract = deploy_solidity_contract_with_args(
-            chain=self.chain,
-            solc_config_sources={
-            'examples/exchange/ERC20Interface.sol': {
-                'urls':
-                [os.path.join(contract_dir, 'examples/exchange/ERC20Interface.sol')]
-            },
-            'examples/exchange/TestToken.sol': {
-                'urls':
-                [os.path.join(contract_dir, 'examples/exchange/TestToken.sol')]
-                },
-                'openzeppelin-solidity/contracts/math/SafeMath.sol': {
-                    'urls': [os.path.join(contract_dir, 'openzeppelin-solidity/contracts/math/SafeMath.sol')]
-                },
-            },
-            allow_paths=root_repo_dir,
+class TestExampleAuction(ChainFixtureTestCase):
+    @classmethod
+    def set_up_chain(cls, chain):
+        chain.mine(1)
+        token_contract = deploy_contract(
+            chain=chain,
             contract_file='examples/exchange/TestToken.sol',
             contract_name='TestToken',
             startgas=10**7,
             args=["TestToken", "TTT", 18],
             contract_creator=CONTRACT_OWNER_PRIVATE_KEY)
-        self.token_contract.mint(CONTRACT_OWNER_ADDRESS, TOTAL_TOKEN_SUPPLY, sender=CONTRACT_OWNER_PRIVATE_KEY)
-        self.exchange_contract = deploy_solidity_contract_with_args(
-            chain=self.chain,
-            solc_config_sources={
-                'examples/exchange/Exchange.sol': {
-                    'urls':
-                    [os.path.join(contract_dir, 'examples/exchange/Exchange.sol')]
-                },
-                'examples/exchange/ERC20Interface.sol': {
-                    'urls':
-                    [os.path.join(contract_dir, 'examples/exchange/ERC20Interface.sol')]
-                },
-                'examples/exchange/TestToken.sol': {
-                    'urls':
-                    [os.path.join(contract_dir, 'examples/exchange/TestToken.sol')]
-                },
-                'LibSubmarineSimple.sol': {
-                    'urls':
-                    [os.path.join(contract_dir, 'LibSubmarineSimple.sol')]
-                },
-                'openzeppelin-solidity/contracts/math/SafeMath.sol': {
-                    'urls': [os.path.join(contract_dir, 'openzeppelin-solidity/contracts/math/SafeMath.sol')]
-                },
-                'proveth/ProvethVerifier.sol': {
-                    'urls': [
-                        os.path.join(contract_dir,
-                                     'proveth/ProvethVerifier.sol')
-                    ]
-                },
-                'proveth/RLP.sol': {
-                    'urls': [os.path.join(contract_dir, 'proveth/RLP.sol')]
-                }
-            },
-            allow_paths=root_repo_dir,
+        token_contract.mint(CONTRACT_OWNER_ADDRESS, TOTAL_TOKEN_SUPPLY, sender=CONTRACT_OWNER_PRIVATE_KEY)
+        exchange_contract = deploy_contract(
+            chain=chain,
             contract_file='examples/exchange/Exchange.sol',
             contract_name='Exchange',
             startgas=10**7,
-            args=[self.token_contract.address],
+            args=[token_contract.address],
             contract_creator=CONTRACT_OWNER_PRIVATE_KEY)
-        self.token_contract.approve(self.exchange_contract.address, TOKEN_AMOUNT_STARTING, sender=CONTRACT_OWNER_PRIVATE_KEY)
-        self.exchange_contract.initializeExchange(TOKEN_AMOUNT_STARTING, value=ETH_AMOUNT_STARTING, sender=CONTRACT_OWNER_PRIVATE_KEY)
-        self.token_contract.transfer(BOB_ADDRESS, BOB_STARTING_TOKEN_AMOUNT, sender=CONTRACT_OWNER_PRIVATE_KEY)
+        token_contract.approve(exchange_contract.address, TOKEN_AMOUNT_STARTING, sender=CONTRACT_OWNER_PRIVATE_KEY)
+        exchange_contract.initializeExchange(TOKEN_AMOUNT_STARTING, value=ETH_AMOUNT_STARTING, sender=CONTRACT_OWNER_PRIVATE_KEY)
+        token_contract.transfer(BOB_ADDRESS, BOB_STARTING_TOKEN_AMOUNT, sender=CONTRACT_OWNER_PRIVATE_KEY)
+        return {
+            'token_contract': token_contract,
+            'exchange_contract': exchange_contract,
+        }
 
 
     def test_InvalidEthTokenSwapNoCommit(self):
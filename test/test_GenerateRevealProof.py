@@ -0,0 +1,205 @@
+import logging
+import os
+import sys
+import tempfile
+import unittest
+from ethereum import config, transactions, utils
+from ethereum.tools import tester as t
+from test_utils import rec_hex, proveth_compatible_commit_block
+
+sys.path.append(
+    os.path.join(os.path.dirname(__file__), '..', 'generate_commitment'))
+import generate_reveal_proof
+
+sys.path.append(
+    os.path.join(os.path.dirname(__file__), '..', 'proveth', 'offchain'))
+import proveth
+
+OURGASPRICE = 10**6
+BASIC_SEND_GAS_LIMIT = 21000
+
+log = logging.getLogger('TestGenerateRevealProof')
+LOGFORMAT = "%(levelname)s:%(filename)s:%(lineno)s:%(funcName)s(): %(message)s"
+log.setLevel(logging.getLevelName('INFO'))
+logHandler = logging.StreamHandler(stream=sys.stdout)
+logHandler.setFormatter(logging.Formatter(LOGFORMAT))
+log.addHandler(logHandler)
+
+
+class TestGenerateRevealProof(unittest.TestCase):
+    def setUp(self):
+        config.config_metropolis['BLOCK_GAS_LIMIT'] = 2**60
+        self.chain = t.Chain(env=config.Env(config=config.config_metropolis))
+        self.chain.mine()
+
+    def test_generateProofBlobs(self):
+        commit_tx_object = transactions.Transaction(
+            0, OURGASPRICE, BASIC_SEND_GAS_LIMIT, t.a2, 12345,
+            b'').sign(t.k1)
+        self.chain.direct_tx(commit_tx_object)
+        self.chain.mine(1)
+
+        commit_block_number, commit_block_index = self.chain.chain.get_tx_position(
+            commit_tx_object)
+        commit_block = proveth_compatible_commit_block(
+            self.chain.chain.get_block_by_number(commit_block_number),
+            commit_tx_object)
+
+        proof_blobs = generate_reveal_proof.generateProofBlobs(commit_block)
+
+        self.assertEqual([commit_block_index], list(proof_blobs))
+        self.assertEqual(
+            proveth.generate_proof_blob(commit_block, commit_block_index),
+            proof_blobs[commit_block_index])
+        self.assertEqual(
+            proof_blobs,
+            generate_reveal_proof.BlockProofs(commit_block).proofBlobs(
+                [commit_block_index]))
+
+    def test_generateProofBlobs_block(self):
+        txs = []
+        for i in range(40):
+            key = t.keys[i % len(t.keys)]
+            tx = transactions.Transaction(
+                self.chain.head_state.get_nonce(utils.privtoaddr(key)),
+                OURGASPRICE, BASIC_SEND_GAS_LIMIT, t.a2, i + 1, b'').sign(key)
+            self.chain.direct_tx(tx)
+            txs.append(tx)
+        self.chain.mine(1)
+
+        commit_block_number, commit_block_index = self.chain.chain.get_tx_position(
+            txs[17])
+        commit_block_object = self.chain.chain.get_block_by_number(
+            commit_block_number)
+        commit_block = proveth_compatible_commit_block(commit_block_object,
+                                                       txs[17])
+        self.assertEqual(len(txs), len(commit_block['transactions']))
+        self.assertEqual(
+            rec_hex(txs[17].hash),
+            commit_block['transactions'][commit_block_index]['hash'])
+
+        proof_blobs = generate_reveal_proof.generateProofBlobs(commit_block)
+        self.assertEqual(list(range(len(txs))), sorted(proof_blobs))
+        for tx_index in (0, commit_block_index, len(txs) - 1):
+            self.assertEqual(
+                proveth.generate_proof_blob(commit_block, tx_index),
+                proof_blobs[tx_index])
+
+        # The same block, as returned by JSON-RPC
+        json_rpc_block = {
+            key: to_json_rpc(value)
+            for key, value in commit_block.items() if key != 'transactions'
+        }
+        json_rpc_block['logsBloom'] = rec_hex(
+            commit_block['logsBloom'].to_bytes(256, byteorder='big'))
+        json_rpc_block['transactions'] = [{
+            key: to_json_rpc(value)
+            for key, value in tx.items()
+        } for tx in commit_block['transactions']]
+        self.assertEqual(
+            proof_blobs,
+            generate_reveal_proof.generateProofBlobs(
+                proveth_compatible_commit_block(json_rpc_block)))
+
+        json_rpc_block['transactions'] = [
+            tx['hash'] for tx in json_rpc_block['transactions']
+        ]
+        with self.assertRaises(ValueError):
+            proveth_compatible_commit_block(json_rpc_block)
+
+        other_tx = transactions.Transaction(0, OURGASPRICE,
+                                            BASIC_SEND_GAS_LIMIT, t.a3, 1,
+                                            b'').sign(t.k9)
+        with self.assertRaises(ValueError):
+            proveth_compatible_commit_block(commit_block_object, other_tx)
+
+    def test_proofBlobs_match_proveth(self):
+        # Every transaction of blocks whose tries have different shapes: a
+        # single leaf, a branch at the root, and (past index 127) two byte
+        # keys
+        for tx_count in (1, 2, 17, 130):
+            txs = []
+            for i in range(tx_count):
+                key = t.keys[i % len(t.keys)]
+                tx = transactions.Transaction(
+                    self.chain.head_state.get_nonce(utils.privtoaddr(key)),
+                    OURGASPRICE, BASIC_SEND_GAS_LIMIT, t.a2, i + 1,
+                    b'').sign(key)
+                self.chain.direct_tx(tx)
+                txs.append(tx)
+            self.chain.mine(1)
+            commit_block_number, _ = self.chain.chain.get_tx_position(txs[0])
+            commit_block = proveth_compatible_commit_block(
+                self.chain.chain.get_block_by_number(commit_block_number))
+            self.assertEqual(tx_count, len(commit_block['transactions']))
+
+            proof_blobs = generate_reveal_proof.generateProofBlobs(
+                commit_block)
+            for tx_index in range(tx_count):
+                self.assertEqual(
+                    proveth.generate_proof_blob(commit_block, tx_index),
+                    proof_blobs[tx_index],
+                    "tx {} of {}".format(tx_index, tx_count))
+
+    def test_proofBlobCache(self):
+        txs = []
+        for i in range(5):
+            tx = transactions.Transaction(0, OURGASPRICE,
+                                          BASIC_SEND_GAS_LIMIT, t.a2, i + 1,
+                                          b'').sign(t.keys[i])
+            self.chain.direct_tx(tx)
+            txs.append(tx)
+        self.chain.mine(1)
+        commit_block_number, _ = self.chain.chain.get_tx_position(txs[0])
+        commit_block = proveth_compatible_commit_block(
+            self.chain.chain.get_block_by_number(commit_block_number))
+        expected = generate_reveal_proof.generateProofBlobs(commit_block)
+
+        def no_block():
+            self.fail("Cache hits must not need the block")
+
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            path = os.path.join(tmp_dir, "proofs")
+            with generate_reveal_proof.ProofBlobCache(
+                    path, maxEntries=2) as cache:
+                self.assertEqual({
+                    i: expected[i]
+                    for i in (1, 3, 4)
+                },
+                                 cache.getOrBuild(commit_block['hash'],
+                                                  [1, 3, 4],
+                                                  lambda: commit_block))
+                self.assertEqual(3, cache.stats[
+                    generate_reveal_proof.CACHE_MISSES])
+                self.assertEqual(1, cache.stats[
+                    generate_reveal_proof.CACHE_EVICTIONS])
+
+                self.assertEqual({4: expected[4], 1: expected[1]},
+                                 cache.getOrBuild(commit_block['hash'],
+                                                  [4, 1], no_block))
+                self.assertEqual(1, cache.stats[
+                    generate_reveal_proof.CACHE_HITS])
+                self.assertEqual(1, cache.stats[
+                    generate_reveal_proof.CACHE_DISK_HITS])
+                self.assertIsNone(cache.get(commit_block['hash'], 0))
+
+            # A new cache finds them in the file
+            with generate_reveal_proof.ProofBlobCache(path) as cache:
+                self.assertEqual({3: expected[3]},
+                                 cache.getOrBuild(
+                                     rec_hex(commit_block['hash']), [3],
+                                     no_block))
+                self.assertEqual(1, cache.stats[
+                    generate_reveal_proof.CACHE_DISK_HITS])
+
+
+def to_json_rpc(value):
+    if isinstance(value, bytes):
+        return rec_hex(value)
+    if isinstance(value, int):
+        return hex(value)
+    return value
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,406 @@
+import collections
+import io
+import json
+import logging
+import multiprocessing
+import os
+import rlp
+import sys
+import tempfile
+import threading
+import unittest
+from ethereum import transactions
+from ethereum.utils import checksum_encode, normalize_address, sha3, bytearray_to_int
+from test_utils import rec_hex, rec_bin
+
+sys.path.append(
+    os.path.join(os.path.dirname(__file__), '..', 'generate_commitment'))
+import commit_daemon
+import generate_submarine_commit
+
+ALICE_ADDRESS = normalize_address("0x7e5f4552091a69125d5dfcb7b8c2659029395bdf")
+BOB_ADDRESS = normalize_address("0x2b5ad5c4795c026514f8317c7a215e218dccd6cf")
+CONTRACT_ADDRESS = normalize_address("0x6813eb9362372eef6200f3b1dbc3f819671cba69")
+UNLOCK_AMOUNT = 1337000000000000000
+OURGASLIMIT = 3712394
+OURGASPRICE = 10**6
+
+log = logging.getLogger('TestGenerateSubmarineCommit')
+LOGFORMAT = "%(levelname)s:%(filename)s:%(lineno)s:%(funcName)s(): %(message)s"
+log.setLevel(logging.getLevelName('INFO'))
+logHandler = logging.StreamHandler(stream=sys.stdout)
+logHandler.setFormatter(logging.Formatter(LOGFORMAT))
+log.addHandler(logHandler)
+
+
+class TestGenerateSubmarineCommit(unittest.TestCase):
+    def assertValidSession(self, fromAddress, toAddress, sendAmount, dappData,
+                           gasPrice, gasLimit, addressB, commit, witness,
+                           unlock_tx_hex):
+        fullCommit = (fromAddress + toAddress +
+                      sendAmount.to_bytes(32, byteorder='big') + dappData +
+                      rec_bin(witness) + gasPrice.to_bytes(32, byteorder='big')
+                      + gasLimit.to_bytes(32, byteorder='big'))
+        self.assertEqual(rec_hex(sha3(fullCommit)), "0x" + commit)
+
+        unlock_tx_object = rlp.decode(
+            rec_bin(unlock_tx_hex), transactions.Transaction)
+        self.assertEqual(0, unlock_tx_object.nonce)
+        self.assertEqual(gasPrice, unlock_tx_object.gasprice)
+        self.assertEqual(gasLimit, unlock_tx_object.startgas)
+        self.assertEqual(toAddress, unlock_tx_object.to)
+        self.assertEqual(sendAmount, unlock_tx_object.value)
+        self.assertEqual(
+            generate_submarine_commit.unlockFunctionSelector + rec_bin(commit),
+            unlock_tx_object.data)
+        self.assertEqual(27, unlock_tx_object.v)
+        self.assertEqual(
+            bytearray_to_int(sha3(rec_bin(commit) + b'\x01')),
+            unlock_tx_object.r)
+        self.assertEqual(
+            bytearray_to_int(sha3(rec_bin(commit) + b'\x00')),
+            unlock_tx_object.s)
+        self.assertEqual(rec_hex(unlock_tx_object.sender), addressB)
+
+    def test_generateCommitAddress(self):
+        addressB, commit, witness, unlock_tx_hex = generate_submarine_commit.generateCommitAddress(
+            ALICE_ADDRESS, CONTRACT_ADDRESS, UNLOCK_AMOUNT, b'', OURGASPRICE,
+            OURGASLIMIT)
+        self.assertValidSession(ALICE_ADDRESS, CONTRACT_ADDRESS,
+                                UNLOCK_AMOUNT, b'', OURGASPRICE, OURGASLIMIT,
+                                addressB, commit, witness, unlock_tx_hex)
+
+    def test_generateCommitAddresses(self):
+        commitRequests = [
+            (ALICE_ADDRESS, CONTRACT_ADDRESS, UNLOCK_AMOUNT, b'', OURGASPRICE, OURGASLIMIT),
+            (BOB_ADDRESS, CONTRACT_ADDRESS, 1, b'\x42' * 7, OURGASPRICE, OURGASLIMIT),
+            (ALICE_ADDRESS, CONTRACT_ADDRESS, UNLOCK_AMOUNT, b'', 2 * OURGASPRICE, 21000),
+            (ALICE_ADDRESS, CONTRACT_ADDRESS, UNLOCK_AMOUNT, b'', OURGASPRICE, OURGASLIMIT),
+        ]
+        addressBs, commits, witnesses, unlock_tx_hexes = generate_submarine_commit.generateCommitAddresses(
+            commitRequests)
+
+        for column in (addressBs, commits, witnesses, unlock_tx_hexes):
+            self.assertEqual(len(commitRequests), len(column))
+        for row, commitRequest in enumerate(commitRequests):
+            self.assertValidSession(*commitRequest, addressBs[row],
+                                    commits[row], witnesses[row],
+                                    unlock_tx_hexes[row])
+
+        # Identical requests still get their own witness and commit address.
+        self.assertNotEqual(witnesses[0], witnesses[3])
+        self.assertNotEqual(addressBs[0], addressBs[3])
+
+    def test_generateCommitAddresses_workers(self):
+        # Every row has its own amount, so that rows coming back out of order
+        # would fail validation.
+        commitRequests = [
+            (ALICE_ADDRESS, CONTRACT_ADDRESS, UNLOCK_AMOUNT + i, b'', OURGASPRICE, OURGASLIMIT)
+            for i in range(10)
+        ]
+        addressBs, commits, witnesses, unlock_tx_hexes = generate_submarine_commit.generateCommitAddresses(
+            commitRequests, workers=2, chunkSize=3)
+
+        for column in (addressBs, commits, witnesses, unlock_tx_hexes):
+            self.assertEqual(len(commitRequests), len(column))
+        for row, commitRequest in enumerate(commitRequests):
+            self.assertValidSession(*commitRequest, addressBs[row],
+                                    commits[row], witnesses[row],
+                                    unlock_tx_hexes[row])
+        self.assertEqual(len(commitRequests), len(set(witnesses)))
+
+    def test_generateCommitAddresses_empty(self):
+        self.assertEqual(([], [], [], []),
+                         generate_submarine_commit.generateCommitAddresses([]))
+
+    def test_generateGasLadder(self):
+        gasVariants = [(OURGASPRICE * 2**i, OURGASLIMIT) for i in range(4)]
+        gasVariants += [(OURGASPRICE, 21000), (OURGASPRICE, OURGASLIMIT)]
+        ladder = generate_submarine_commit.generateGasLadder(
+            ALICE_ADDRESS, CONTRACT_ADDRESS, UNLOCK_AMOUNT, b'\x42',
+            gasVariants)
+
+        self.assertEqual(gasVariants[:5], list(ladder))
+        for (gasPrice, gasLimit), session in ladder.items():
+            self.assertValidSession(ALICE_ADDRESS, CONTRACT_ADDRESS,
+                                    UNLOCK_AMOUNT, b'\x42', gasPrice,
+                                    gasLimit, *session)
+        self.assertEqual(5, len(set(session[0] for session in ladder.values())))
+
+        self.assertEqual(((OURGASPRICE, 21000), ladder[(OURGASPRICE, 21000)]),
+                         generate_submarine_commit.pickGasVariant(
+                             ladder, OURGASPRICE))
+        self.assertEqual(
+            ((OURGASPRICE * 4, OURGASLIMIT),
+             ladder[(OURGASPRICE * 4, OURGASLIMIT)]),
+            generate_submarine_commit.pickGasVariant(
+                ladder, OURGASPRICE * 3, 30000))
+        self.assertIsNone(
+            generate_submarine_commit.pickGasVariant(ladder, OURGASPRICE * 9))
+
+    def test_retryStats(self):
+        stats = collections.Counter()
+        before = generate_submarine_commit.retryStats.copy()
+        generate_submarine_commit.generateCommitAddress(
+            ALICE_ADDRESS, CONTRACT_ADDRESS, UNLOCK_AMOUNT, b'', OURGASPRICE,
+            OURGASLIMIT, stats=stats)
+        generate_submarine_commit.generateCommitAddresses(
+            [(ALICE_ADDRESS, CONTRACT_ADDRESS, UNLOCK_AMOUNT, b'', OURGASPRICE, OURGASLIMIT)] * 4,
+            workers=2, chunkSize=2, stats=stats)
+
+        self.assertEqual(5, stats[generate_submarine_commit.SESSIONS])
+        self.assertLessEqual(
+            set(stats), {
+                generate_submarine_commit.SESSIONS,
+                generate_submarine_commit.RETRY_R_RANGE,
+                generate_submarine_commit.RETRY_S_RANGE,
+                generate_submarine_commit.RETRY_VRS
+            })
+        after = generate_submarine_commit.retryStats.copy()
+        after.subtract(before)
+        self.assertEqual(stats, +after)
+
+    def test_maxAttempts(self):
+        # Every witness draws the same (rejected or accepted) commit, so
+        # generation either succeeds at once or has to give up.
+        prefix = generate_submarine_commit._commitPrefix(
+            ALICE_ADDRESS, CONTRACT_ADDRESS, UNLOCK_AMOUNT, b'')
+        suffix = generate_submarine_commit._commitSuffix(
+            OURGASPRICE, OURGASLIMIT)
+        for i in range(256):
+            witness = bytes([i]) * 32
+            stats = collections.Counter()
+            try:
+                generate_submarine_commit._generateUnlockTx(
+                    prefix, suffix, CONTRACT_ADDRESS, UNLOCK_AMOUNT,
+                    OURGASPRICE, OURGASLIMIT,
+                    witnesses=iter(lambda: witness, None), stats=stats)
+            except generate_submarine_commit.CommitGenerationError:
+                self.assertEqual(generate_submarine_commit.MAX_ATTEMPTS,
+                                 sum(stats.values()))
+                return
+            self.assertEqual({generate_submarine_commit.SESSIONS: 1}, stats)
+        self.fail("No rejected witness found")
+
+    def test_recoverUnlockSender_crossCheck(self):
+        # Includes witnesses that have no valid (V, R, S), which both ways of
+        # recovering have to reject.
+        prefix = generate_submarine_commit._commitPrefix(
+            ALICE_ADDRESS, CONTRACT_ADDRESS, UNLOCK_AMOUNT, b'')
+        suffix = generate_submarine_commit._commitSuffix(
+            OURGASPRICE, OURGASLIMIT)
+        template = generate_submarine_commit._UnlockTxTemplate(
+            CONTRACT_ADDRESS, UNLOCK_AMOUNT, OURGASPRICE, OURGASLIMIT)
+        rsCandidates = generate_submarine_commit._rsCandidates(
+            prefix, suffix, generate_submarine_commit.WitnessPool())
+        recovered = 0
+        for _ in range(64):
+            commit, witness, R, S = next(rsCandidates)
+            sender = generate_submarine_commit._recoverUnlockSender(
+                template, commit, 27, R, S)
+            fallbackSender = generate_submarine_commit._recoverSenderFallback(
+                transactions.Transaction(
+                    0, OURGASPRICE, OURGASLIMIT, CONTRACT_ADDRESS,
+                    UNLOCK_AMOUNT,
+                    generate_submarine_commit.unlockFunctionSelector + commit,
+                    27, R, S))
+            self.assertEqual(fallbackSender, sender)
+            if sender is not None:
+                recovered += 1
+        self.assertGreater(recovered, 0)
+        self.assertLess(recovered, 64)
+
+    def test_unlockTxTemplate(self):
+        commit = sha3(b'commit')
+        for sendAmount, gasPrice, gasLimit, nonce in [
+            (UNLOCK_AMOUNT, OURGASPRICE, OURGASLIMIT, 0), (0, 0, 0, 0),
+            (1, 127, 128, 1), (2**256 - 1, 2**255, 2**64, 2**32)]:
+            template = generate_submarine_commit._UnlockTxTemplate(
+                CONTRACT_ADDRESS, sendAmount, gasPrice, gasLimit, nonce)
+            unsigned = transactions.UnsignedTransaction(
+                nonce, gasPrice, gasLimit, CONTRACT_ADDRESS, sendAmount,
+                generate_submarine_commit.unlockFunctionSelector + commit)
+            self.assertEqual(sha3(rlp.encode(unsigned)),
+                             template.unsignedHash(commit))
+            # Signature values with leading zero bytes and single byte ones
+            for V, R, S in [(27, 1, 2), (28, 0x7f, 0x80), (27, 2**248 - 1,
+                                                            2**256 - 1)]:
+                tx = transactions.Transaction(
+                    nonce, gasPrice, gasLimit, CONTRACT_ADDRESS, sendAmount,
+                    generate_submarine_commit.unlockFunctionSelector + commit,
+                    V, R, S)
+                self.assertEqual(rlp.encode(tx),
+                                 template.signed(commit, V, R, S))
+                self.assertEqual(
+                    rlp.encode(tx),
+                    rlp.encode(template.transaction(commit, V, R, S)))
+
+    def test_generateCommitAddresses_crossCheckRecovery(self):
+        crossCheckRecovery = generate_submarine_commit.crossCheckRecovery
+        generate_submarine_commit.crossCheckRecovery = True
+        try:
+            commitRequests = [
+                (ALICE_ADDRESS, CONTRACT_ADDRESS, UNLOCK_AMOUNT, b'', OURGASPRICE, OURGASLIMIT)
+            ] * 16
+            addressBs, commits, witnesses, unlock_tx_hexes = generate_submarine_commit.generateCommitAddresses(
+                commitRequests)
+        finally:
+            generate_submarine_commit.crossCheckRecovery = crossCheckRecovery
+        for row, commitRequest in enumerate(commitRequests):
+            self.assertValidSession(*commitRequest, addressBs[row],
+                                    commits[row], witnesses[row],
+                                    unlock_tx_hexes[row])
+
+    def test_witnessPool_threads(self):
+        witnessPool = generate_submarine_commit.WitnessPool(blockSize=7)
+        drawn = [[] for _ in range(4)]
+
+        def draw(witnesses):
+            for _ in range(500):
+                witnesses.append(witnessPool.draw())
+
+        threads = [threading.Thread(target=draw, args=(witnesses, ))
+                   for witnesses in drawn]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        allDrawn = [w for witnesses in drawn for w in witnesses]
+        self.assertEqual(2000, len(allDrawn))
+        self.assertEqual({32}, set(len(w) for w in allDrawn))
+        self.assertEqual(len(allDrawn), len(set(allDrawn)))
+
+    def test_witnessPool_fork(self):
+        witnessPool = generate_submarine_commit.WitnessPool()
+        witnessPool.draw()  # fills the buffer the child inherits
+
+        context = multiprocessing.get_context("fork")
+        receiver, sender = context.Pipe(duplex=False)
+        child = context.Process(
+            target=lambda: sender.send([witnessPool.draw() for _ in range(8)]))
+        child.start()
+        childWitnesses = receiver.recv()
+        child.join()
+
+        parentWitnesses = [witnessPool.draw() for _ in range(8)]
+        self.assertFalse(set(childWitnesses) & set(parentWitnesses))
+
+    def test_streamCommitAddresses(self):
+        for workers in (None, 2):
+            requests = [
+                {"fromAddress": checksum_encode(ALICE_ADDRESS),
+                 "toAddress": checksum_encode(CONTRACT_ADDRESS),
+                 "sendAmount": UNLOCK_AMOUNT, "id": 7},
+                {"fromAddress": checksum_encode(BOB_ADDRESS),
+                 "sendAmount": 1, "dappData": "0x" + "42" * 7,
+                 "gasPrice": 2 * OURGASPRICE},
+                {"fromAddress": rec_hex(ALICE_ADDRESS),
+                 "sendAmount": UNLOCK_AMOUNT},
+                {"fromAddress": checksum_encode(ALICE_ADDRESS),
+                 "sendAmount": -1},
+            ]
+            lines = [json.dumps(request) + "\n" for request in requests]
+            lines[2:2] = ["\n", "{not json\n"]
+            out = io.StringIO()
+
+            generated = generate_submarine_commit.streamCommitAddresses(
+                lines, out, workers=workers,
+                defaults={"toAddress": checksum_encode(CONTRACT_ADDRESS),
+                          "gasPrice": OURGASPRICE,
+                          "gasLimit": OURGASLIMIT})
+
+            self.assertEqual(2, generated)
+            results = [json.loads(line) for line in out.getvalue().splitlines()]
+            self.assertEqual([1, 2, 4, 5, 6], [r["line"] for r in results])
+            self.assertEqual(7, results[0]["id"])
+            for result, (fromAddress, sendAmount, dappData, gasPrice) in zip(
+                    results, [(ALICE_ADDRESS, UNLOCK_AMOUNT, b'', OURGASPRICE),
+                              (BOB_ADDRESS, 1, b'\x42' * 7, 2 * OURGASPRICE)]):
+                self.assertValidSession(fromAddress, CONTRACT_ADDRESS,
+                                        sendAmount, dappData, gasPrice,
+                                        OURGASLIMIT, result["addressB"],
+                                        result["commit"], result["witness"],
+                                        result["txHex"])
+            for result in results[2:]:
+                self.assertEqual({"line", "error"}, set(result))
+            self.assertIn("EIP-55", results[3]["error"])
+            self.assertIn("sendAmount", results[4]["error"])
+
+    def test_streamCommitAddresses_badValues(self):
+        valid = {"fromAddress": checksum_encode(ALICE_ADDRESS),
+                 "toAddress": checksum_encode(CONTRACT_ADDRESS),
+                 "sendAmount": UNLOCK_AMOUNT}
+        bad = [dict(valid, dappData=5), dict(valid, dappData=["42"]),
+               dict(valid, sendAmount=2**256), dict(valid, gasPrice=2**256),
+               dict(valid, gasLimit=2**300)]
+        for workers in (None, 2):
+            lines = [json.dumps(request) + "\n" for request in bad + [valid]]
+            out = io.StringIO()
+
+            generated = generate_submarine_commit.streamCommitAddresses(
+                lines, out, workers=workers)
+
+            self.assertEqual(1, generated)
+            results = [json.loads(line) for line in out.getvalue().splitlines()]
+            self.assertEqual(list(range(1, len(bad) + 2)),
+                             [r["line"] for r in results])
+            for result in results[:len(bad)]:
+                self.assertEqual({"line", "error"}, set(result))
+            self.assertIn("dappData", results[0]["error"])
+            self.assertIn("dappData", results[1]["error"])
+            self.assertIn("sendAmount", results[2]["error"])
+            self.assertIn("gasPrice", results[3]["error"])
+            self.assertIn("gasLimit", results[4]["error"])
+            self.assertNotIn("error", results[-1])
+
+    def test_commitDaemon(self):
+        with tempfile.TemporaryDirectory() as tmpDir:
+            server = commit_daemon.makeCommitServer(
+                os.path.join(tmpDir, "commit.sock"), workers=2)
+            serverThread = threading.Thread(target=server.serve_forever)
+            serverThread.start()
+            try:
+                with commit_daemon.CommitClient(server.server_address) as client:
+                    result = client.generate(
+                        checksum_encode(ALICE_ADDRESS),
+                        checksum_encode(CONTRACT_ADDRESS), UNLOCK_AMOUNT,
+                        gasPrice=OURGASPRICE, gasLimit=OURGASLIMIT)
+                    self.assertValidSession(
+                        ALICE_ADDRESS, CONTRACT_ADDRESS, UNLOCK_AMOUNT, b'',
+                        OURGASPRICE, OURGASLIMIT, result["addressB"],
+                        result["commit"], result["witness"], result["txHex"])
+
+                    requests = [{
+                        "fromAddress": checksum_encode(BOB_ADDRESS),
+                        "toAddress": checksum_encode(CONTRACT_ADDRESS),
+                        "sendAmount": i,
+                        "id": i
+                    } for i in range(50)]
+                    requests[3] = {"id": 3}
+                    requests[4] = dict(requests[4], dappData=5)
+                    requests[5] = dict(requests[5], sendAmount=2**256)
+                    results = client.generateMany(requests)
+            finally:
+                server.shutdown()
+                server.server_close()
+                serverThread.join()
+            self.assertFalse(os.listdir(tmpDir))
+
+        self.assertEqual(list(range(50)), [r["id"] for r in results])
+        self.assertEqual(list(range(2, 52)), [r["line"] for r in results])
+        self.assertIn("fromAddress", results[3]["error"])
+        self.assertIn("dappData", results[4]["error"])
+        self.assertIn("sendAmount", results[5]["error"])
+        for i, result in enumerate(results):
+            if i not in (3, 4, 5):
+                self.assertValidSession(
+                    BOB_ADDRESS, CONTRACT_ADDRESS, i, b'',
+                    generate_submarine_commit.DEFAULT_GAS_PRICE,
+                    generate_submarine_commit.DEFAULT_GAS_LIMIT,
+                    result["addressB"], result["commit"], result["witness"],
+                    result["txHex"])
+
+
+if __name__ == "__main__":
+    unittest.main()
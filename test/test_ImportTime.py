@@ -0,0 +1,109 @@
+import json
+import logging
+import os
+import subprocess
+import sys
+import unittest
+
+GENERATE_COMMITMENT_DIR = os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), '..', 'generate_commitment')
+
+# Budgets in seconds, without starting the interpreter itself. Wall clock
+# times vary too much on shared CI workers, so the budgets are only checked
+# if SUBMARINE_IMPORT_TIME_BUDGETS is set; the times are always logged.
+CHECK_BUDGETS = bool(os.environ.get('SUBMARINE_IMPORT_TIME_BUDGETS'))
+HELP_BUDGET = 0.5
+LIBRARY_BUDGET = 2.0
+CLIENT_BUDGET = 0.5
+
+log = logging.getLogger('TestImportTime')
+LOGFORMAT = "%(levelname)s:%(filename)s:%(lineno)s:%(funcName)s(): %(message)s"
+log.setLevel(logging.getLevelName('INFO'))
+logHandler = logging.StreamHandler(stream=sys.stdout)
+logHandler.setFormatter(logging.Formatter(LOGFORMAT))
+log.addHandler(logHandler)
+
+# Measures one way of loading the code in a fresh interpreter, and prints
+# the time it took and the top level packages it imported.
+MEASURE = '''
+import json, runpy, sys, time
+sys.path.insert(0, {directory!r})
+sys.argv = {argv!r}
+before = set(sys.modules)
+start = time.time()
+try:
+    {statement}
+except SystemExit:
+    pass
+elapsed = time.time() - start
+print(json.dumps({{"seconds": elapsed, "modules": sorted(set(sys.modules) - before)}}))
+'''
+
+
+def measure(statement, argv=("generate_submarine_commit.py", )):
+    '''
+    :return: seconds, set of modules imported
+    '''
+    output = subprocess.check_output(
+        [
+            sys.executable, "-c",
+            MEASURE.format(
+                directory=GENERATE_COMMITMENT_DIR,
+                argv=list(argv),
+                statement=statement)
+        ],
+        stderr=subprocess.DEVNULL)
+    result = json.loads(output.decode().strip().splitlines()[-1])
+    return result["seconds"], set(result["modules"])
+
+
+class TestImportTime(unittest.TestCase):
+    def assertNotImported(self, modules, packages):
+        for module in modules:
+            self.assertNotIn(module.split(".")[0], packages, module)
+
+    def assertWithinBudget(self, seconds, budget, description):
+        log.info("{}: {:.3f}s (budget {}s)".format(description, seconds,
+                                                   budget))
+        if CHECK_BUDGETS:
+            self.assertLess(
+                seconds, budget, "{} took {:.3f}s, budget is {}s".format(
+                    description, seconds, budget))
+
+    def test_help(self):
+        seconds, modules = measure(
+            "runpy.run_path('{}', run_name='__main__')".format(
+                os.path.join(GENERATE_COMMITMENT_DIR,
+                             "generate_submarine_commit.py")),
+            argv=("generate_submarine_commit.py", "--help"))
+        self.assertNotImported(modules, {"ethereum", "rlp", "solc", "py_ecc"})
+        self.assertWithinBudget(seconds, HELP_BUDGET,
+                                "generate_submarine_commit.py --help")
+
+    def test_argumentError(self):
+        seconds, modules = measure(
+            "runpy.run_path('{}', run_name='__main__')".format(
+                os.path.join(GENERATE_COMMITMENT_DIR,
+                             "generate_submarine_commit.py")),
+            argv=("generate_submarine_commit.py", "-a", "1"))
+        self.assertNotImported(modules, {"ethereum", "rlp", "solc", "py_ecc"})
+        self.assertWithinBudget(seconds, HELP_BUDGET,
+                                "generate_submarine_commit.py -a 1")
+
+    def test_library(self):
+        seconds, modules = measure("import generate_submarine_commit")
+        self.assertIn("ethereum.transactions", modules)
+        self.assertNotIn("test_utils", modules)
+        self.assertNotIn("solc", modules)
+        self.assertNotIn("ethereum.tools", modules)
+        self.assertWithinBudget(seconds, LIBRARY_BUDGET,
+                                "import generate_submarine_commit")
+
+    def test_client(self):
+        seconds, modules = measure("import commit_daemon")
+        self.assertNotImported(modules, {"ethereum", "rlp", "solc"})
+        self.assertWithinBudget(seconds, CLIENT_BUDGET, "import commit_daemon")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -3,22 +3,24 @@ import os
 import rlp
 import sys
 import unittest
-from ethereum import config, transactions
+from ethereum import config, transactions, utils
 from ethereum.tools import tester as t
 from ethereum.utils import checksum_encode, normalize_address, sha3, ecrecover_to_pub
 from ethereum.exceptions import InvalidTransaction
-from test_utils import rec_hex, rec_bin, deploy_solidity_contract_with_args, proveth_compatible_commit_block
+import test_utils
+from build_contracts import CONTRACTS_DIR, ContractBuild
+from test_utils import rec_hex, rec_bin, deploy_contract, proveth_compatible_commit_block, ChainFixtureTestCase
 
 sys.path.append(
     os.path.join(os.path.dirname(__file__), '..', 'generate_commitment'))
 import generate_submarine_commit
+import generate_reveal_proof
+import submarine_state
 
 sys.path.append(
     os.path.join(os.path.dirname(__file__), '..', 'proveth', 'offchain'))
 import proveth
 
-root_repo_dir = os.path.abspath(os.path.join(os.path.dirname(__file__), '../'))
-
 COMMIT_PERIOD_LENGTH = 3
 UNLOCK_AMOUNT = 1337000000000000000
 OURGASLIMIT = 3712394
@@ -27,6 +29,8 @@ BASIC_SEND_GAS_LIMIT = 21000
 extraTransactionFees = 100000000000000000
 ACCOUNT_STARTING_BALANCE = 1000000000000000000000000
 SOLIDITY_NULL_INITIALVAL = 0
+# Most bytes of runtime code a contract can have (EIP-170)
+MAX_CODE_SIZE = 24576
 
 log = logging.getLogger('TestLibSubmarineSimple')
 LOGFORMAT = "%(levelname)s:%(filename)s:%(lineno)s:%(funcName)s(): %(message)s"
@@ -36,43 +40,18 @@ logHandler.setFormatter(logging.Formatter(LOGFORMAT))
 log.addHandler(logHandler)
 
 
-class TestLibSubmarineSimple(unittest.TestCase):
-    def setUp(self):
-        config.config_metropolis['BLOCK_GAS_LIMIT'] = 2**60
-        self.chain = t.Chain(env=config.Env(config=config.config_metropolis))
-        self.chain.mine()
-        contract_dir = os.path.abspath(
-            os.path.join(root_repo_dir, 'contracts/'))
-        os.chdir(root_repo_dir)
-
-        self.verifier_contract = deploy_solidity_contract_with_args(
-            chain=self.chain,
-            solc_config_sources={
-                'LibSubmarineSimpleTestHelper.sol': {
-                    'urls':
-                    [os.path.join(contract_dir, 'LibSubmarineSimpleTestHelper.sol')]
-                },
-                'LibSubmarineSimple.sol': {
-                    'urls':
-                    [os.path.join(contract_dir, 'LibSubmarineSimple.sol')]
-                },
-                'openzeppelin-solidity/contracts/math/SafeMath.sol': {
-                    'urls': [os.path.join(contract_dir, 'openzeppelin-solidity/contracts/math/SafeMath.sol')]
-                },
-                'proveth/ProvethVerifier.sol': {
-                    'urls': [
-                        os.path.join(contract_dir,
-                                     'proveth/ProvethVerifier.sol')
-                    ]
-                },
-                'proveth/Solidity-RLP/contracts/RLPReader.sol': {
-                    'urls': [os.path.join(contract_dir, 'proveth/Solidity-RLP/contracts/RLPReader.sol')]
-                }
-            },
-            allow_paths=root_repo_dir,
+class TestLibSubmarineSimple(ChainFixtureTestCase):
+    @classmethod
+    def set_up_chain(cls, chain):
+        chain.mine()
+        verifier_contract = deploy_contract(
+            chain=chain,
             contract_file='LibSubmarineSimpleTestHelper.sol',
             contract_name='LibSubmarineSimpleTestHelper',
             startgas=10**7)
+        return {
+            'verifier_contract': verifier_contract,
+        }
 
     def generateInvalidUnlockTx(self, userAddress, contractAddress, maliciousAddress):
         commit, witness, R, S = generate_submarine_commit._generateRS(
@@ -125,6 +104,44 @@ class TestLibSubmarineSimple(unittest.TestCase):
             log.info("Address no good (%s), retrying" % e)
             return self.generateInvalidUnlockTx(userAddress, contractAddress, maliciousAddress)
 
+    def test_contract_build(self):
+        # The contracts are compiled at most once (not at all if their build
+        # artifact is up to date)
+        self.assertLessEqual(
+            test_utils.contract_build().compiled.count(
+                'LibSubmarineSimpleTestHelper.sol'), 1)
+        # Once the fixture is set up, building its contracts again (e.g. in
+        # the next test run) compiles nothing
+        self.assertListEqual(
+            [],
+            ContractBuild(readonly=True).build(
+                ['LibSubmarineSimpleTestHelper.sol']))
+        # compile_standard_cached returns the same build artifact
+        artifact = test_utils.contract_build().artifact(
+            'LibSubmarineSimpleTestHelper.sol')
+        compiled = test_utils.compile_standard_cached({
+            'LibSubmarineSimpleTestHelper.sol': {
+                'urls': [os.path.join(CONTRACTS_DIR,
+                                      'LibSubmarineSimpleTestHelper.sol')]
+            }
+        }, allow_paths=CONTRACTS_DIR)
+        helper = compiled['contracts']['LibSubmarineSimpleTestHelper.sol'][
+            'LibSubmarineSimpleTestHelper']
+        self.assertEqual(
+            artifact['contracts']['LibSubmarineSimpleTestHelper']['bytecode'],
+            helper['evm']['bytecode']['object'])
+        self.assertEqual(
+            artifact['contracts']['LibSubmarineSimpleTestHelper']['abi'],
+            helper['abi'])
+
+    def test_codeSize(self):
+        code_size = len(self.chain.head_state.get_code(
+            self.verifier_contract.address))
+        log.info("LibSubmarineSimpleTestHelper runtime code: {} bytes".format(
+            code_size))
+        self.assertGreater(code_size, 0)
+        self.assertLessEqual(code_size, MAX_CODE_SIZE)
+
     def test_workflow(self):
         ##
         ## STARTING STATE
@@ -874,5 +891,278 @@ class TestLibSubmarineSimple(unittest.TestCase):
                 sender=ALICE_PRIVATE_KEY
             )
 
+    def commit_session(self, private_key, dapp_data=b''):
+        '''
+        Generates a session of private_key with the verifier contract and
+        sends its commit transaction (without mining it).
+
+        :return: commit, commit tx object, unlock tx unsigned rlp, witness
+        '''
+        addressB, commit, witness, unlock_tx_hex = generate_submarine_commit.generateCommitAddress(
+            utils.privtoaddr(private_key),
+            normalize_address(rec_hex(self.verifier_contract.address)),
+            UNLOCK_AMOUNT, dapp_data, OURGASPRICE, OURGASLIMIT)
+        unlock_tx_object = rlp.decode(
+            rec_bin(unlock_tx_hex), transactions.Transaction)
+        unlock_tx_unsigned_rlp = rlp.encode(
+            transactions.UnsignedTransaction(
+                unlock_tx_object.nonce, unlock_tx_object.gasprice,
+                unlock_tx_object.startgas, unlock_tx_object.to,
+                unlock_tx_object.value, unlock_tx_object.data),
+            transactions.UnsignedTransaction)
+        commit_tx_object = transactions.Transaction(
+            self.chain.head_state.get_nonce(utils.privtoaddr(private_key)),
+            OURGASPRICE, BASIC_SEND_GAS_LIMIT, rec_bin(addressB),
+            (UNLOCK_AMOUNT + extraTransactionFees),
+            b'').sign(private_key)
+        self.chain.direct_tx(commit_tx_object)
+        return rec_bin(commit), commit_tx_object, unlock_tx_unsigned_rlp, rec_bin(witness)
+
+    def reveal_args(self, session, dapp_data=b''):
+        '''
+        :param session: return value of commit_session, once its commit tx
+            is mined
+        :return: the arguments of reveal for session
+        '''
+        commit, commit_tx_object, unlock_tx_unsigned_rlp, witness = session
+        commit_block_number, commit_block_index = self.chain.chain.get_tx_position(
+            commit_tx_object)
+        commit_proof_blob = proveth.generate_proof_blob(
+            proveth_compatible_commit_block(
+                self.chain.chain.get_block_by_number(commit_block_number),
+                commit_tx_object),
+            commit_block_index)
+        return (commit_block_number, dapp_data, witness,
+                unlock_tx_unsigned_rlp, commit_proof_blob)
+
+    def test_revealMany(self):
+        ALICE_PRIVATE_KEY = t.k1
+
+        self.chain.mine(1)
+        # Two sessions committed in one block, one in the next
+        alice_sessions = [self.commit_session(ALICE_PRIVATE_KEY),
+                          self.commit_session(ALICE_PRIVATE_KEY, b'\x42' * 40)]
+        self.chain.mine(1)
+        alice_sessions.append(self.commit_session(ALICE_PRIVATE_KEY))
+        self.chain.mine(self.verifier_contract.commitPeriodLength() + 1)
+
+        reveals = [self.reveal_args(alice_sessions[0]),
+                   self.reveal_args(alice_sessions[1], b'\x42' * 40),
+                   self.reveal_args(alice_sessions[2])]
+        self.assertEqual(
+            generate_reveal_proof.DEFAULT_REVEAL_BATCH_LIMIT,
+            self.verifier_contract.revealBatchLimit())
+
+        ##
+        ## ONE INVALID SESSION: NOTHING IS REVEALED
+        ##
+        invalid_reveal = reveals[2][:2] + (b'\x01' * 32, ) + reveals[2][3:]
+        with self.assertRaises(t.TransactionFailed):
+            self.verifier_contract.revealMany(
+                generate_reveal_proof.encodeRevealBatch(
+                    reveals[:2] + [invalid_reveal]),
+                sender=ALICE_PRIVATE_KEY)
+        for commit, _, _, _ in alice_sessions:
+            self.assertListEqual(
+                self.verifier_contract.getSubmarineState(commit),
+                [SOLIDITY_NULL_INITIALVAL] * 4)
+
+        ##
+        ## REVEAL ALL OF THEM AT ONCE
+        ##
+        batches = generate_reveal_proof.revealBatches(reveals)
+        self.assertEqual(1, len(batches))
+        self.verifier_contract.revealMany(batches[0], sender=ALICE_PRIVATE_KEY)
+        self.chain.mine(1)
+        for session, reveal in zip(alice_sessions, reveals):
+            self.assertListEqual(
+                self.verifier_contract.getSubmarineState(session[0]), [
+                    UNLOCK_AMOUNT, SOLIDITY_NULL_INITIALVAL, reveal[0],
+                    self.chain.chain.get_tx_position(session[1])[1]
+                ])
+
+        # Already revealed, in a batch or on its own
+        with self.assertRaises(t.TransactionFailed):
+            self.verifier_contract.revealMany(
+                generate_reveal_proof.encodeRevealBatch(reveals[2:]),
+                sender=ALICE_PRIVATE_KEY)
+        with self.assertRaises(t.TransactionFailed):
+            self.verifier_contract.reveal(*reveals[0], sender=ALICE_PRIVATE_KEY)
+
+    def test_revealAttested(self):
+        ALICE_PRIVATE_KEY = t.k1
+
+        self.chain.mine(1)
+        alice_sessions = [self.commit_session(ALICE_PRIVATE_KEY),
+                          self.commit_session(ALICE_PRIVATE_KEY)]
+        self.chain.mine(1)
+        other_block_session = self.commit_session(ALICE_PRIVATE_KEY)
+        self.chain.mine(self.verifier_contract.commitPeriodLength() + 1)
+
+        commit_block_number, _ = self.chain.chain.get_tx_position(
+            alice_sessions[0][1])
+        commit_block_object = self.chain.chain.get_block_by_number(
+            commit_block_number)
+
+        def trie_proof_reveal(session, tx_index=None):
+            reveal = self.reveal_args(session)
+            if tx_index is None:
+                tx_index = self.chain.chain.get_tx_position(session[1])[1]
+            block_proofs = generate_reveal_proof.BlockProofs(
+                proveth_compatible_commit_block(
+                    self.chain.chain.get_block_by_number(reveal[0])))
+            return reveal[:4] + (block_proofs.trieProof(tx_index), )
+
+        # Nothing attested yet: trie proofs are not enough
+        self.assertEqual(
+            b'\x00' * 32,
+            self.verifier_contract.attestedTransactionsRoots(
+                commit_block_object.header.hash))
+        with self.assertRaises(t.TransactionFailed):
+            self.verifier_contract.reveal(
+                *trie_proof_reveal(alice_sessions[1]), sender=ALICE_PRIVATE_KEY)
+
+        ##
+        ## THE FIRST REVEAL WITH A PROOF BLOB ATTESTS THE BLOCK
+        ##
+        self.verifier_contract.reveal(
+            *self.reveal_args(alice_sessions[0]), sender=ALICE_PRIVATE_KEY)
+        self.assertEqual(
+            commit_block_object.header.tx_list_root,
+            self.verifier_contract.attestedTransactionsRoots(
+                commit_block_object.header.hash))
+
+        ##
+        ## LATER REVEALS ONLY NEED THE TRIE PROOF
+        ##
+        # The proof of another transaction of the block
+        with self.assertRaises(t.TransactionFailed):
+            self.verifier_contract.reveal(
+                *trie_proof_reveal(alice_sessions[1], tx_index=0),
+                sender=ALICE_PRIVATE_KEY)
+        # A block that is not attested
+        with self.assertRaises(t.TransactionFailed):
+            self.verifier_contract.reveal(
+                *trie_proof_reveal(other_block_session),
+                sender=ALICE_PRIVATE_KEY)
+
+        reveal = trie_proof_reveal(alice_sessions[1])
+        self.assertLess(len(reveal[4]), len(self.reveal_args(alice_sessions[1])[4]))
+        self.verifier_contract.reveal(*reveal, sender=ALICE_PRIVATE_KEY)
+        self.chain.mine(1)
+        for commit, commit_tx_object, _, _ in alice_sessions:
+            self.assertListEqual(
+                self.verifier_contract.getSubmarineState(commit), [
+                    UNLOCK_AMOUNT, SOLIDITY_NULL_INITIALVAL,
+                    commit_block_number,
+                    self.chain.chain.get_tx_position(commit_tx_object)[1]
+                ])
+
+    def test_getSubmarineStates(self):
+        ALICE_PRIVATE_KEY = t.k1
+
+        self.chain.mine(1)
+        alice_sessions = [self.commit_session(ALICE_PRIVATE_KEY),
+                          self.commit_session(ALICE_PRIVATE_KEY)]
+        self.chain.mine(self.verifier_contract.commitPeriodLength() + 1)
+        for session in alice_sessions:
+            self.verifier_contract.reveal(
+                *self.reveal_args(session), sender=ALICE_PRIVATE_KEY)
+        # Unlock does no checks, anyone can send the unlock amount
+        self.verifier_contract.unlock(
+            alice_sessions[0][0], value=UNLOCK_AMOUNT, sender=t.k2)
+        self.chain.mine(1)
+
+        # Revealed and unlocked, revealed only, unknown, many times over
+        submarine_ids = [alice_sessions[0][0], alice_sessions[1][0],
+                         b'\x01' * 32] * 100
+        states, completed = submarine_state.querySubmarineStates(
+            self.verifier_contract, submarine_ids, chunkSize=128)
+        self.assertEqual(len(submarine_ids), len(completed))
+        for i, submarine_id in enumerate(submarine_ids):
+            self.assertListEqual(
+                self.verifier_contract.getSubmarineState(submarine_id),
+                [column[i] for column in states])
+            self.assertEqual(
+                self.verifier_contract.revealedAndUnlocked(submarine_id),
+                completed[i])
+        self.assertListEqual([True, False, False], completed[:3])
+        self.assertListEqual([UNLOCK_AMOUNT, UNLOCK_AMOUNT, 0],
+                             states.amountRevealed[:3])
+
+        self.assertEqual([], self.verifier_contract.getSubmarineStates([]))
+        self.assertEqual([], self.verifier_contract.revealedAndUnlockedMany([]))
+
+    def test_consumeSession(self):
+        ALICE_PRIVATE_KEY = t.k1
+
+        self.chain.mine(1)
+        session = self.commit_session(ALICE_PRIVATE_KEY)
+        self.chain.mine(self.verifier_contract.commitPeriodLength() + 1)
+        commit = session[0]
+        reveal = self.reveal_args(session)
+
+        # Only revealed sessions can be consumed
+        with self.assertRaises(t.TransactionFailed):
+            self.verifier_contract.consume(commit)
+        self.verifier_contract.reveal(*reveal, sender=ALICE_PRIVATE_KEY)
+        self.verifier_contract.unlock(commit, value=UNLOCK_AMOUNT, sender=t.k2)
+        self.chain.mine(1)
+        self.assertTrue(self.verifier_contract.revealedAndUnlocked(commit))
+
+        ##
+        ## CONSUMED: TOMBSTONE
+        ##
+        self.verifier_contract.consume(commit)
+        self.chain.mine(1)
+        self.assertTrue(self.verifier_contract.isConsumed(commit))
+        self.assertFalse(self.verifier_contract.revealedAndUnlocked(commit))
+        states, completed = submarine_state.querySubmarineStates(
+            self.verifier_contract, [commit])
+        self.assertListEqual([True], submarine_state.consumedSessions(states))
+        self.assertListEqual([False], completed)
+        self.assertListEqual(
+            self.verifier_contract.getSubmarineState(commit), [
+                SOLIDITY_NULL_INITIALVAL,
+                submarine_state.CONSUMED_AMOUNT_UNLOCKED, reveal[0],
+                self.chain.chain.get_tx_position(session[1])[1]
+            ])
+
+        # The tombstone blocks replays of the session
+        with self.assertRaises(t.TransactionFailed):
+            self.verifier_contract.reveal(*reveal, sender=ALICE_PRIVATE_KEY)
+        with self.assertRaises(t.TransactionFailed):
+            self.verifier_contract.unlock(
+                commit, value=UNLOCK_AMOUNT * 2, sender=t.k2)
+        with self.assertRaises(t.TransactionFailed):
+            self.verifier_contract.consume(commit)
+
+        ##
+        ## A NEW COMMIT TX TO THE SAME SUBMARINE ADDRESS CAN'T BE REVEALED
+        ##
+        def recommit():
+            commit_tx_object = session[1]
+            recommit_tx_object = transactions.Transaction(
+                self.chain.head_state.get_nonce(
+                    utils.privtoaddr(ALICE_PRIVATE_KEY)),
+                OURGASPRICE, BASIC_SEND_GAS_LIMIT, commit_tx_object.to,
+                commit_tx_object.value, b'').sign(ALICE_PRIVATE_KEY)
+            self.chain.direct_tx(recommit_tx_object)
+            self.chain.mine(self.verifier_contract.commitPeriodLength() + 1)
+            return self.reveal_args((commit, recommit_tx_object) + session[2:])
+
+        # Within the blockhash window of the original commit block
+        with self.assertRaises(t.TransactionFailed):
+            self.verifier_contract.reveal(*recommit(), sender=ALICE_PRIVATE_KEY)
+        # And long after it
+        self.chain.mine(256)
+        with self.assertRaises(t.TransactionFailed):
+            self.verifier_contract.reveal(*recommit(), sender=ALICE_PRIVATE_KEY)
+        with self.assertRaises(t.TransactionFailed):
+            self.verifier_contract.unlock(
+                commit, value=UNLOCK_AMOUNT * 2, sender=t.k2)
+        self.assertTrue(self.verifier_contract.isConsumed(commit))
+        self.assertFalse(self.verifier_contract.revealedAndUnlocked(commit))
+
 if __name__ == "__main__":
     unittest.main()
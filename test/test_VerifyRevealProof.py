@@ -0,0 +1,311 @@
+import logging
+import os
+import rlp
+import sys
+import unittest
+from ethereum import config, transactions, utils
+from ethereum.tools import tester as t
+from test_utils import rec_bin, deploy_contract, proveth_compatible_commit_block
+
+sys.path.append(
+    os.path.join(os.path.dirname(__file__), '..', 'generate_commitment'))
+import generate_reveal_proof
+import generate_submarine_commit
+import verify_reveal_proof
+
+sys.path.append(
+    os.path.join(os.path.dirname(__file__), '..', 'proveth', 'offchain'))
+import proveth
+
+UNLOCK_AMOUNT = 1337000000000000000
+OURGASLIMIT = 3712394
+OURGASPRICE = 10**6
+BASIC_SEND_GAS_LIMIT = 21000
+
+log = logging.getLogger('TestVerifyRevealProof')
+LOGFORMAT = "%(levelname)s:%(filename)s:%(lineno)s:%(funcName)s(): %(message)s"
+log.setLevel(logging.getLevelName('INFO'))
+logHandler = logging.StreamHandler(stream=sys.stdout)
+logHandler.setFormatter(logging.Formatter(LOGFORMAT))
+log.addHandler(logHandler)
+
+
+class TestVerifyRevealProof(unittest.TestCase):
+    def setUp(self):
+        config.config_metropolis['BLOCK_GAS_LIMIT'] = 2**60
+        self.chain = t.Chain(env=config.Env(config=config.config_metropolis))
+        self.chain.mine()
+
+    def commit(self, send_amount, commit_value, commit_data=b'',
+               contract_address=t.a5):
+        '''
+        Generates a session of t.a1 with contract_address and sends its
+        commit transaction, between some other transactions.
+
+        :return: reveal arguments for verify_reveal_proof.verifyReveal
+        '''
+        addressB, commit, witness, unlock_tx_hex = generate_submarine_commit.generateCommitAddress(
+            t.a1, contract_address, send_amount, b'', OURGASPRICE,
+            OURGASLIMIT)
+        for i in range(5):
+            self.chain.direct_tx(
+                transactions.Transaction(
+                    self.chain.head_state.get_nonce(t.a2), OURGASPRICE,
+                    BASIC_SEND_GAS_LIMIT, t.a3, i + 1, b'').sign(t.k2))
+        commit_tx_object = transactions.Transaction(
+            self.chain.head_state.get_nonce(t.a0), OURGASPRICE,
+            10**6, rec_bin(addressB), commit_value,
+            commit_data).sign(t.k0)
+        self.chain.direct_tx(commit_tx_object)
+        self.chain.mine(1)
+
+        commit_block_number, commit_block_index = self.chain.chain.get_tx_position(
+            commit_tx_object)
+        commit_block_object = self.chain.chain.get_block_by_number(
+            commit_block_number)
+        commit_proof_blob = proveth.generate_proof_blob(
+            proveth_compatible_commit_block(commit_block_object,
+                                            commit_tx_object),
+            commit_block_index)
+
+        unlock_tx_object = rlp.decode(
+            rec_bin(unlock_tx_hex), transactions.Transaction)
+        unlock_tx_unsigned_rlp = rlp.encode(
+            transactions.UnsignedTransaction(
+                unlock_tx_object.nonce, unlock_tx_object.gasprice,
+                unlock_tx_object.startgas, unlock_tx_object.to,
+                unlock_tx_object.value, unlock_tx_object.data),
+            transactions.UnsignedTransaction)
+        return (commit_block_object.header.hash, commit_proof_blob,
+                unlock_tx_unsigned_rlp, rec_bin(witness), t.a1)
+
+    def test_verifyReveal(self):
+        reveal = self.commit(UNLOCK_AMOUNT, UNLOCK_AMOUNT + 1)
+        verified = verify_reveal_proof.verifyReveal(
+            *reveal, dappData=b'', contractAddress=t.a5)
+
+        commit_block_number, commit_block_index = 2, 5
+        self.assertEqual(
+            utils.sha3(t.a1 + t.a5 + UNLOCK_AMOUNT.to_bytes(32, 'big') +
+                       reveal[3] + OURGASPRICE.to_bytes(32, 'big') +
+                       OURGASLIMIT.to_bytes(32, 'big')), verified.submarineId)
+        self.assertEqual(UNLOCK_AMOUNT, verified.amountRevealed)
+        self.assertEqual(commit_block_number, verified.commitTxBlockNumber)
+        self.assertEqual(commit_block_index, verified.commitTxIndex)
+        self.assertEqual(
+            self.chain.chain.get_block_by_number(commit_block_number)
+            .transactions[commit_block_index].to, verified.submarineAddress)
+
+    def test_verifyReveal_trieProof(self):
+        block_hash, proof_blob, unlock_tx_unsigned_rlp, witness, revealer = self.commit(
+            UNLOCK_AMOUNT, UNLOCK_AMOUNT)
+        commit_block_object = self.chain.chain.get_block(block_hash)
+        transactions_root = commit_block_object.header.tx_list_root
+        block_proofs = generate_reveal_proof.BlockProofs(
+            proveth_compatible_commit_block(commit_block_object))
+        commit_block_number, commit_block_index = 2, 5
+        trie_proof = block_proofs.trieProof(commit_block_index)
+
+        verified = verify_reveal_proof.verifyReveal(
+            block_hash, trie_proof, unlock_tx_unsigned_rlp, witness,
+            revealer, b'', t.a5, transactions_root, commit_block_number)
+        self.assertEqual(
+            verify_reveal_proof.verifyReveal(block_hash, proof_blob,
+                                             unlock_tx_unsigned_rlp, witness,
+                                             revealer, b'', t.a5), verified)
+
+        # Without the attested transactions root, as reveal would
+        with self.assertRaisesRegex(verify_reveal_proof.InvalidRevealError,
+                                    "not attested"):
+            verify_reveal_proof.verifyReveal(block_hash, trie_proof,
+                                             unlock_tx_unsigned_rlp, witness,
+                                             revealer)
+        invalid_trie_proofs = [
+            # Another block's transactions root
+            (self.chain.chain.get_block_by_number(1).header.tx_list_root,
+             trie_proof),
+            # Another transaction of the block
+            (transactions_root,
+             block_proofs.trieProof(commit_block_index - 1)),
+            # The proof of another index
+            (transactions_root,
+             rlp.encode([commit_block_index - 1,
+                         rlp.decode(trie_proof)[1]])),
+            # A list as index
+            (transactions_root,
+             rlp.encode([[b'\x05'], rlp.decode(trie_proof)[1]])),
+        ]
+        for root, proof in invalid_trie_proofs:
+            with self.assertRaises(verify_reveal_proof.InvalidRevealError):
+                verify_reveal_proof.verifyReveal(
+                    block_hash, proof, unlock_tx_unsigned_rlp, witness,
+                    revealer, b'', None, root)
+
+    def test_verifyReveal_invalid(self):
+        block_hash, proof_blob, unlock_tx_unsigned_rlp, witness, revealer = self.commit(
+            UNLOCK_AMOUNT, UNLOCK_AMOUNT)
+        invalid_reveals = [
+            # Someone else revealing
+            (block_hash, proof_blob, unlock_tx_unsigned_rlp, witness, t.a2),
+            # Wrong witness
+            (block_hash, proof_blob, unlock_tx_unsigned_rlp, b'\x01' * 32,
+             revealer),
+            # Wrong DApp data
+            (block_hash, proof_blob, unlock_tx_unsigned_rlp, witness,
+             revealer, b'\x42'),
+            # Another block
+            (self.chain.chain.get_block_by_number(1).header.hash, proof_blob,
+             unlock_tx_unsigned_rlp, witness, revealer),
+            # Another contract
+            (block_hash, proof_blob, unlock_tx_unsigned_rlp, witness,
+             revealer, b'', t.a6),
+            # Not a proof
+            (block_hash, proof_blob[:-1], unlock_tx_unsigned_rlp, witness,
+             revealer),
+        ]
+        for reveal in invalid_reveals:
+            with self.assertRaises(verify_reveal_proof.InvalidRevealError):
+                verify_reveal_proof.verifyReveal(*reveal)
+
+        with self.assertRaisesRegex(verify_reveal_proof.InvalidRevealError,
+                                    "less than the unlock tx value"):
+            verify_reveal_proof.verifyReveal(
+                *self.commit(UNLOCK_AMOUNT, UNLOCK_AMOUNT - 1))
+        with self.assertRaisesRegex(verify_reveal_proof.InvalidRevealError,
+                                    "has data"):
+            verify_reveal_proof.verifyReveal(
+                *self.commit(UNLOCK_AMOUNT, UNLOCK_AMOUNT, b'\x42'))
+
+    def test_verifyReveal_malformed(self):
+        block_hash, proof_blob, unlock_tx_unsigned_rlp, witness, revealer = self.commit(
+            UNLOCK_AMOUNT, UNLOCK_AMOUNT)
+        unlock_tx = rlp.decode(unlock_tx_unsigned_rlp)
+        proof = rlp.decode(proof_blob)
+        malformed_reveals = [
+            # A list where the unlock tx has an integer
+            (block_hash, proof_blob,
+             rlp.encode([[b'\x01']] + unlock_tx[1:]), witness, revealer),
+            # A list where the unlock tx has its to address
+            (block_hash, proof_blob,
+             rlp.encode(unlock_tx[:3] + [[unlock_tx[3]]] + unlock_tx[4:]),
+             witness, revealer),
+            # A list as proof type, and a string as block header
+            (block_hash, rlp.encode([[b'\x01']] + proof[1:]),
+             unlock_tx_unsigned_rlp, witness, revealer),
+            (block_hash, rlp.encode(proof[:1] + [b'\x01'] + proof[2:]),
+             unlock_tx_unsigned_rlp, witness, revealer),
+            # A list as stack indexes
+            (block_hash, rlp.encode(proof[:3] + [[proof[3]]] + proof[4:]),
+             unlock_tx_unsigned_rlp, witness, revealer),
+            # Not five items
+            (block_hash, rlp.encode(proof[:3] + proof[4:]),
+             unlock_tx_unsigned_rlp, witness, revealer),
+            (block_hash, rlp.encode(proof + [b'']),
+             unlock_tx_unsigned_rlp, witness, revealer),
+        ]
+        for reveal in malformed_reveals:
+            with self.assertRaises(verify_reveal_proof.InvalidRevealError):
+                verify_reveal_proof.verifyReveal(*reveal)
+
+        # Trie nodes with a list as path, and as value
+        for node in ([[b'\x20'], b'\x01'], [b'\x20\x80', [b'\x01']],
+                     [b''] * 16 + [[b'\x01']]):
+            with self.assertRaises(verify_reveal_proof.InvalidRevealError):
+                verify_reveal_proof._validateMPTProof(
+                    utils.sha3(rlp.encode(node)), b'' if len(node) == 17 else
+                    verify_reveal_proof._nibbles(b'\x80'), [node])
+
+        # A malformed reveal doesn't stop the others from being checked
+        results = verify_reveal_proof.verifyReveals(
+            malformed_reveals + [(block_hash, proof_blob,
+                                  unlock_tx_unsigned_rlp, witness, revealer)])
+        for verified, error in results[:-1]:
+            self.assertIsNone(verified)
+            self.assertIsNotNone(error)
+        self.assertIsNone(results[-1][1])
+
+    def test_verifyReveal_matches_contract(self):
+        # verifyReveal accepts exactly the reveals LibSubmarineSimple.reveal
+        # accepts
+        contract = deploy_contract(
+            chain=self.chain,
+            contract_file='LibSubmarineSimpleTestHelper.sol',
+            contract_name='LibSubmarineSimpleTestHelper',
+            startgas=10**7)
+        block_hash, proof_blob, unlock_tx_unsigned_rlp, witness, revealer = self.commit(
+            UNLOCK_AMOUNT, UNLOCK_AMOUNT, contract_address=contract.address)
+        self.chain.mine(contract.commitPeriodLength() + 1)
+        commit_block_number = self.chain.chain.get_block(block_hash).number
+        proof = rlp.decode(proof_blob)
+        stack = proof[4]
+        unlock_tx = rlp.decode(unlock_tx_unsigned_rlp)
+
+        def proof_with(**items):
+            changed = list(proof)
+            for index, item in items.items():
+                changed[int(index[1:])] = item
+            return rlp.encode(changed)
+
+        # description, DApp data, witness, unlock tx, proof blob
+        reveals = [
+            ("valid", b'', witness, unlock_tx_unsigned_rlp, proof_blob),
+            ("wrong witness", b'', b'\x01' * 32, unlock_tx_unsigned_rlp,
+             proof_blob),
+            ("wrong DApp data", b'\x42', witness, unlock_tx_unsigned_rlp,
+             proof_blob),
+            ("unlock tx nonce", b'', witness,
+             rlp.encode([b'\x01'] + unlock_tx[1:]), proof_blob),
+            ("truncated proof", b'', witness, unlock_tx_unsigned_rlp,
+             proof_blob[:-1]),
+            ("list as stack indexes", b'', witness, unlock_tx_unsigned_rlp,
+             proof_with(i3=[proof[3]])),
+            ("four items", b'', witness, unlock_tx_unsigned_rlp,
+             rlp.encode(proof[:3] + proof[4:])),
+            ("six items", b'', witness, unlock_tx_unsigned_rlp,
+             rlp.encode(proof + [b''])),
+            ("another tx index", b'', witness, unlock_tx_unsigned_rlp,
+             proof_with(i2=b'\x04')),
+            ("wrong node hash", b'', witness, unlock_tx_unsigned_rlp,
+             proof_with(i4=stack[:-1] +
+                        [[stack[-1][0], stack[-1][1] + b'\x00']])),
+            ("another block header", b'', witness, unlock_tx_unsigned_rlp,
+             proof_with(i1=rlp.decode(rlp.encode(
+                 self.chain.chain.get_block_by_number(1).header)))),
+        ]
+        for description, dapp_data, reveal_witness, unlock_rlp, blob in reveals:
+            try:
+                verify_reveal_proof.verifyReveal(block_hash, blob, unlock_rlp,
+                                                 reveal_witness, revealer,
+                                                 dapp_data, contract.address)
+                verified = True
+            except verify_reveal_proof.InvalidRevealError:
+                verified = False
+            snapshot = self.chain.snapshot()
+            try:
+                contract.reveal(commit_block_number, dapp_data,
+                                reveal_witness, unlock_rlp, blob, sender=t.k1)
+                revealed = True
+            except t.TransactionFailed:
+                revealed = False
+            self.chain.revert(snapshot)
+            self.assertEqual(revealed, verified, description)
+            self.assertEqual(description == "valid", verified, description)
+
+    def test_verifyReveals(self):
+        valid = self.commit(UNLOCK_AMOUNT, UNLOCK_AMOUNT)
+        invalid = valid[:3] + (b'\x01' * 32, ) + valid[4:]
+        reveals = [valid, invalid] * 20
+        expected = verify_reveal_proof.verifyReveals(reveals)
+        self.assertEqual(len(reveals), len(expected))
+        for (verified, error), reveal in zip(expected, reveals):
+            self.assertEqual(reveal is invalid, verified is None)
+            self.assertEqual(reveal is invalid, error is not None)
+
+        self.assertEqual(expected,
+                         verify_reveal_proof.verifyReveals(
+                             reveals, workers=2, chunkSize=3))
+        self.assertEqual([], verify_reveal_proof.verifyReveals([], workers=2))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -1,7 +1,16 @@
+import copy
+import os
+import unittest
 from ethereum.abi import ContractTranslator
 from ethereum.tools import tester
-from ethereum import utils
-from solc import compile_standard
+from ethereum import config, utils
+from build_contracts import ContractBuild, SOLC_SETTINGS
+
+# Set by run_tests.py in its workers: the parent process builds the contracts,
+# the workers only read the build artifacts
+CONTRACT_BUILD_READONLY = bool(os.environ.get('SUBMARINE_CONTRACT_BUILD_READONLY'))
+_contract_build = None
+
 
 def rec_hex(x):
     if isinstance(x, list):
@@ -22,17 +31,73 @@ def rec_bin(x):
             return utils.decode_hex(x)
 
 
-def deploy_solidity_contract_with_args(chain, solc_config_sources, allow_paths, contract_file, contract_name, startgas, args=[], contract_creator=tester.k0):
-    compiled = compile_standard({
-        'language': 'Solidity',
-        'sources': solc_config_sources,
-        'settings': {'evmVersion': 'byzantium',
-                     'outputSelection': {'*': {'*': ['abi', 'evm.bytecode']}},
-                    },
-    }, allow_paths=allow_paths)
+def deploy_contract(chain, contract_file, contract_name, startgas, args=[], contract_creator=tester.k0):
+    '''Deploys contract contract_name of source unit contract_file (relative
+    to contracts/, e.g. 'examples/exchange/Exchange.sol') from its build
+    artifact, compiling it first if its sources changed (see
+    build_contracts).
+    '''
+    compiled = contract_build().artifact(contract_file)['contracts'][contract_name]
+    return deploy_compiled_contract(chain, compiled['abi'], compiled['bytecode'], startgas, args, contract_creator)
+
 
+def deploy_solidity_contract_with_args(chain, solc_config_sources, allow_paths, contract_file, contract_name, startgas, args=[], contract_creator=tester.k0):
+    '''Deploys contract contract_name of source contract_file of a
+    solc standard JSON 'sources' dict, compiled with compile_standard_cached.
+    '''
+    compiled = compile_standard_cached(solc_config_sources, allow_paths)
     abi = compiled['contracts'][contract_file][contract_name]['abi']
     binary = compiled['contracts'][contract_file][contract_name]['evm']['bytecode']['object']
+    return deploy_compiled_contract(chain, abi, binary, startgas, args, contract_creator)
+
+
+def compile_standard_cached(solc_config_sources, allow_paths, settings=None):
+    '''Same as solc.compile_standard for Solidity sources under contracts/
+    (given by 'urls'), but each source is only compiled if one of the
+    sources it imports, transitively, the solc version or the settings
+    changed: the output comes from the build artifacts of contract_build(),
+    in the shape compile_standard returns, with the ABI and the bytecode of
+    every contract.
+
+    allow_paths is not needed anymore, solc gets the contents of the
+    sources; it is kept for compatibility.
+    '''
+    if settings is not None and settings != SOLC_SETTINGS:
+        raise ValueError(
+            "Only the build_contracts.SOLC_SETTINGS are cached, got {}".format(
+                settings))
+    build = contract_build()
+    contracts = {}
+    for source_name, source in solc_config_sources.items():
+        unit = None
+        for url in source.get('urls', []):
+            path = os.path.abspath(url)
+            if os.path.isfile(path) and path.startswith(build.contracts_dir + os.sep):
+                unit = build.unit_name(path)
+                break
+        if unit is None:
+            raise ValueError(
+                "Source {} is not a file under {}".format(
+                    source_name, build.contracts_dir))
+        contracts[source_name] = {
+            name: {
+                'abi': compiled['abi'],
+                'evm': {'bytecode': {'object': compiled['bytecode']}},
+            }
+            for name, compiled in build.artifact(unit)['contracts'].items()
+        }
+    return {'contracts': contracts}
+
+
+def contract_build():
+    '''The ContractBuild of this process.'''
+    global _contract_build
+    if _contract_build is None:
+        _contract_build = ContractBuild(readonly=CONTRACT_BUILD_READONLY)
+    return _contract_build
+
+
+def deploy_compiled_contract(chain, abi, binary, startgas, args=[], contract_creator=tester.k0):
     ct = ContractTranslator(abi)
     address = chain.contract(
         utils.decode_hex(binary) + (ct.encode_constructor_arguments(args) if args else b''),
@@ -44,46 +109,147 @@ def deploy_solidity_contract_with_args(chain, solc_config_sources, allow_paths,
     contract = tester.ABIContract(chain, ct, address)
     return contract
 
-def proveth_compatible_commit_block(commit_block, commit_tx):
-    '''Converts a pyethereum block object (commit_block) that contains
-    a single pyethereum transaction object (commit_tx) into
-    the format proveth expects.
+
+class ChainFixtureTestCase(unittest.TestCase):
+    '''Test case whose tests all start from the same tester chain: the
+    chain and its contracts are set up once per class by set_up_chain, and
+    every test gets its own copy of them in setUp.
+
+    (tester.Chain.revert cannot go back across mined blocks, so the tests
+    run on a deep copy of the set up chain instead. test_ChainFixture checks
+    that the tests do not see each other's changes.)
     '''
+
+    @classmethod
+    def set_up_chain(cls, chain):
+        '''Sets up the chain the tests of the class start with, e.g. deploys
+        their contracts. Returns a dict from attribute name to ABIContract,
+        which setUp sets on the test case, bound to the copy of the chain.
+        '''
+        return {}
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.fixture_chain = new_tester_chain()
+        cls.fixture_contracts = cls.set_up_chain(cls.fixture_chain)
+
+    def setUp(self):
+        self.chain, contracts = copy_chain_fixture(self.fixture_chain,
+                                                   self.fixture_contracts)
+        for name, contract in contracts.items():
+            setattr(self, name, contract)
+
+
+def new_tester_chain():
+    '''A new tester chain with the settings the tests use.'''
+    config.config_metropolis['BLOCK_GAS_LIMIT'] = 2**60
+    return tester.Chain(env=config.Env(config=config.config_metropolis))
+
+
+def copy_chain_fixture(chain, contracts):
+    '''Returns a deep copy of chain, and contracts (a dict of ABIContracts
+    on chain) bound to the copy.
+    '''
+    chain = copy.deepcopy(chain)
+    return chain, {
+        name: tester.ABIContract(chain, contract.translator, contract.address)
+        for name, contract in contracts.items()
+    }
+
+
+def proveth_compatible_commit_block(commit_block, commit_tx=None):
+    '''Converts a block with all of its transactions into the format proveth
+    expects.
+
+    commit_block is either a pyethereum block object, or a block as returned
+    by the eth_getBlockByNumber / eth_getBlockByHash JSON-RPC calls with full
+    transaction objects, which is proveth's format already.
+
+    commit_tx (a pyethereum transaction object) is optional; if given, it
+    must be one of the transactions of the block.
+    '''
+    if isinstance(commit_block, dict):
+        proveth_expected_block_format_dict = json_rpc_block(commit_block)
+    else:
+        proveth_expected_block_format_dict = pyethereum_block(commit_block)
+
+    if commit_tx is not None and rec_hex(commit_tx.hash) not in {
+            normalize_hex(tx['hash'])
+            for tx in proveth_expected_block_format_dict['transactions']}:
+        raise ValueError("commit_tx {} is not in block {}".format(
+            rec_hex(commit_tx.hash),
+            proveth_expected_block_format_dict['number']))
+    return proveth_expected_block_format_dict
+
+
+def pyethereum_block(block):
+    '''Converts a pyethereum block object into the format proveth expects.
+    The header fields (and the block hash) are computed once for the whole
+    block.
+    '''
+    header = block.header
+    block_hash = header.hash
     proveth_expected_block_format_dict = dict()
-    proveth_expected_block_format_dict['parentHash'] = commit_block.prevhash
-    proveth_expected_block_format_dict['sha3Uncles'] = commit_block.uncles_hash
-    proveth_expected_block_format_dict['miner'] = commit_block.coinbase
-    proveth_expected_block_format_dict['stateRoot'] = commit_block.state_root
-    proveth_expected_block_format_dict['transactionsRoot'] = commit_block.tx_list_root
-    proveth_expected_block_format_dict['receiptsRoot'] = commit_block.receipts_root
-    proveth_expected_block_format_dict['logsBloom'] = commit_block.bloom
-    proveth_expected_block_format_dict['difficulty'] = commit_block.difficulty
-    proveth_expected_block_format_dict['number'] = commit_block.number
-    proveth_expected_block_format_dict['gasLimit'] = commit_block.gas_limit
-    proveth_expected_block_format_dict['gasUsed'] = commit_block.gas_used
-    proveth_expected_block_format_dict['timestamp'] = commit_block.timestamp
-    proveth_expected_block_format_dict['extraData'] = commit_block.extra_data
-    proveth_expected_block_format_dict['mixHash'] = commit_block.mixhash
-    proveth_expected_block_format_dict['nonce'] = commit_block.nonce
-    proveth_expected_block_format_dict['hash'] = commit_block.hash
+    proveth_expected_block_format_dict['parentHash'] = header.prevhash
+    proveth_expected_block_format_dict['sha3Uncles'] = header.uncles_hash
+    proveth_expected_block_format_dict['miner'] = header.coinbase
+    proveth_expected_block_format_dict['stateRoot'] = header.state_root
+    proveth_expected_block_format_dict['transactionsRoot'] = header.tx_list_root
+    proveth_expected_block_format_dict['receiptsRoot'] = header.receipts_root
+    proveth_expected_block_format_dict['logsBloom'] = header.bloom
+    proveth_expected_block_format_dict['difficulty'] = header.difficulty
+    proveth_expected_block_format_dict['number'] = header.number
+    proveth_expected_block_format_dict['gasLimit'] = header.gas_limit
+    proveth_expected_block_format_dict['gasUsed'] = header.gas_used
+    proveth_expected_block_format_dict['timestamp'] = header.timestamp
+    proveth_expected_block_format_dict['extraData'] = header.extra_data
+    proveth_expected_block_format_dict['mixHash'] = header.mixhash
+    proveth_expected_block_format_dict['nonce'] = header.nonce
+    proveth_expected_block_format_dict['hash'] = block_hash
     proveth_expected_block_format_dict['uncles'] = []
 
-    proveth_expected_block_format_dict['transactions'] = ({
-        "blockHash":          commit_block.hash,
-        "blockNumber":        str(hex((commit_block['number']))),
-        "from":               utils.checksum_encode(commit_tx.sender),
-        "gas":                str(hex(commit_tx.startgas)),
-        "gasPrice":           str(hex(commit_tx.gasprice)),
-        "hash":               rec_hex(commit_tx.hash),
-        "input":              rec_hex(commit_tx.data),
-        "nonce":              str(hex(commit_tx.nonce)),
-        "to":                 utils.checksum_encode(commit_tx.to),
-        "transactionIndex":   str(hex(0)),
-        "value":              str(hex(commit_tx.value)),
-        "v":                  str(hex(commit_tx.v)),
-        "r":                  str(hex(commit_tx.r)),
-        "s":                  str(hex(commit_tx.s)),
-    }, )
+    block_number = str(hex(header.number))
+    proveth_expected_block_format_dict['transactions'] = tuple({
+        "blockHash":          block_hash,
+        "blockNumber":        block_number,
+        "from":               utils.checksum_encode(tx.sender),
+        "gas":                str(hex(tx.startgas)),
+        "gasPrice":           str(hex(tx.gasprice)),
+        "hash":               rec_hex(tx.hash),
+        "input":              rec_hex(tx.data),
+        "nonce":              str(hex(tx.nonce)),
+        "to":                 utils.checksum_encode(tx.to) if tx.to else None,
+        "transactionIndex":   str(hex(tx_index)),
+        "value":              str(hex(tx.value)),
+        "v":                  str(hex(tx.v)),
+        "r":                  str(hex(tx.r)),
+        "s":                  str(hex(tx.s)),
+    } for tx_index, tx in enumerate(block.transactions))
 
     return proveth_expected_block_format_dict
 
+
+def json_rpc_block(block):
+    '''Checks that a JSON-RPC block has full transaction objects (rather
+    than only their hashes), in order, and returns a copy of it.
+    '''
+    transactions = tuple(block['transactions'])
+    for tx_index, tx in enumerate(transactions):
+        if not isinstance(tx, dict):
+            raise ValueError(
+                "Block {} has transaction hashes only, request it with full "
+                "transaction objects".format(block['number']))
+        if int(tx['transactionIndex'], 16) != tx_index:
+            raise ValueError("Transaction {} of block {} has index {}".format(
+                tx_index, block['number'], tx['transactionIndex']))
+    proveth_expected_block_format_dict = dict(block)
+    proveth_expected_block_format_dict['transactions'] = transactions
+    return proveth_expected_block_format_dict
+
+
+def normalize_hex(x):
+    '''Returns a hex string or bytes as lower case 0x prefixed hex.'''
+    if isinstance(x, str):
+        return "0x" + x[2:].lower() if x.startswith("0x") else "0x" + x.lower()
+    return rec_hex(x)